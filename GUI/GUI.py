@@ -1,16 +1,10 @@
+import os
+import sys
 import time
 import logging
-import numpy as np
-import pickle
-from scipy import stats
-import pandas as pd
 import serial
 import serial.tools.list_ports
-import pyqtgraph as pg
-from pyqtgraph import PlotWidget
 
-from PyQt5 import QtCore
-from PyQt5.QtCore import QRect
 from PyQt5.QtCore import Qt
 from PyQt5.QtCore import (
     QObject,
@@ -32,21 +26,84 @@ from PyQt5.QtWidgets import (
     QWidget,
     QLabel,
     QSpacerItem,
+    QShortcut,
+    QLineEdit,
     QWidget
 )
 
 from PyQt5.QtGui import (
     QFont,
+    QKeySequence,
     QPixmap
 )
 
-# Globals
-CONN_STATUS = False
-KILL        = False
-CALIBRATION = False
-UPDATE      = False
-PREDICTION  = False
-RESTART     = False
+# Shared host code lives in the smartglasses package at the top of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from smartglasses.model_manager import ModelManager
+from smartglasses.render import PlotRenderer, FRAME_RATE
+from smartglasses.session import DeviceSession
+from smartglasses.async_serial import SerialLoop
+from smartglasses.metrics import summary
+from smartglasses.ingest import headroom_summary
+from smartglasses.tracing import LoopLag
+from smartglasses.recording import is_recording, RECORDING_EXTENSION
+from smartglasses.profiles import ProfileStore
+from smartglasses.pipeline import (
+    SAMPLE,
+    CALIBRATED,
+    BASELINE,
+    PROFILE,
+    PREDICTION
+)
+
+# Number of samples kept in the plotted history (36000 samples = 1 h at 10 Hz)
+HISTORY_LENGTH = 36000
+# Seconds of history shown by the plot, selectable in the request step
+PLOT_SPANS = {'5 s': 5.0, '1 min': 60.0, '10 min': 600.0, '1 h': 3600.0}
+PLOT_SPAN = '5 s'
+# Frame format sent by the PSoC: 'ascii', 'binary' or 'auto' to detect it
+PROTOCOL = 'auto'
+# Serial reading: 'thread' (a blocking reader per device in the thread pool)
+# or 'asyncio' (one SerialLoop thread for the devices of all the windows)
+SERIAL_BACKEND = 'thread'
+# Print the values of every sample on the console (slows down the reading thread)
+PRINT_SAMPLES = False
+# File the metrics are appended to with Ctrl+M (one JSON object per line)
+METRICS_PATH = 'metrics.jsonl'
+# Latency budget from the last sample of a window to the request shown, in seconds (95th percentile)
+LATENCY_BUDGET = 0.25
+# Record the bytes received from each device to RECORDINGS_PATH (replay them by
+# typing the path of the .sgrec file in place of the port)
+RECORD_SESSIONS = False
+RECORDINGS_PATH = 'recordings'
+# Classify the windows in an inference thread of each device, so that the
+# reading never waits for the model (the GUI thread never runs it either way)
+BACKGROUND_INFERENCE = True
+# Period of the timer measuring how long the GUI thread is kept busy, in seconds
+HEARTBEAT_INTERVAL = 0.05
+# Keep following the drift of the signal at rest after the calibration (the
+# baseline is frozen while an expression is held), instead of a fixed baseline
+ADAPTIVE_BASELINE = True
+# Save the calibration of each device and user to PROFILES_PATH and, when they
+# connect again, skip the calibration if the first second of signal agrees with it
+REUSE_CALIBRATION = True
+PROFILES_PATH = 'profiles.json'
+# Stop the calibration as soon as the baseline is known within this, in pF (None
+# to always calibrate for 5 s): a user at rest is calibrated in about 1 s
+CALIBRATION_TOLERANCE = 0.005
+# Frames per second sent by the glasses: 10 with the firmware timer, up to 400 with
+# the FDC sample rate (FDC_100_Hz to FDC_400_Hz), decimated to the 10 Hz of the models
+DEVICE_RATE = 10
+# Baud rate of the serial link (400 Hz needs binary frames at 115200 baud)
+BAUDRATE = 9600
+
+# Exported from the trained model with: python -m smartglasses.mlp mlp_1.pkl mlp_1.npz
+MODEL_PATH = 'mlp_1.npz'
+# Show the connection and calibration screen first and load the plot
+# (pyqtgraph) and the model in the background
+FAST_START = True
+# Samples between two predictions in continuous mode (1 = a prediction at every sample)
+CONTINUOUS_HOP = 1
 
 #########################
 # SERIAL_WORKER_SIGNALS #
@@ -55,109 +112,93 @@ class SerialWorkerSignals(QObject):
 
     device_port = pyqtSignal(str)
     status = pyqtSignal(str, int)
-    data_ready = pyqtSignal(list, list, list, list, list)
-    calibration = pyqtSignal(float, float, float, float)
-    prediction = pyqtSignal(float, float, float, float)
+    calibration = pyqtSignal(object)
+    prediction = pyqtSignal(object, object)
+    baseline = pyqtSignal(object)
+    profile = pyqtSignal(object)
 
 #################
 # SERIAL_WORKER #
 #################
 class SerialWorker(QRunnable):
     
-    def __init__(self, serial_port_name):
+    def __init__(self, serial_port_name, model_manager=None, history=HISTORY_LENGTH, protocol=PROTOCOL,
+                 backend=SERIAL_BACKEND, record=None, background_inference=BACKGROUND_INFERENCE,
+                 adaptive_baseline=ADAPTIVE_BASELINE, profiles=None, user='',
+                 calibration_tolerance=CALIBRATION_TOLERANCE, input_rate=DEVICE_RATE):
 
         super().__init__()
 
-        self.time = []
-        self.cap1 = []
-        self.cap2 = []
-        self.cap3 = []
-        self.cap4 = []
-
-        self.port = serial.Serial()
         self.port_name = serial_port_name
-        self.baudrate = 9600
+        self.baudrate = BAUDRATE
+        # connection, calibration, buffers and predictions of this device only
+        self.session = DeviceSession(serial_port_name, model_manager, self.baudrate, protocol, history,
+                                     backend=backend, record=record, background_inference=background_inference,
+                                     adaptive_baseline=adaptive_baseline, profiles=profiles, user=user,
+                                     calibration_tolerance=calibration_tolerance, input_rate=input_rate)
+        self.source = self.session.source
+        self.pipeline = self.session.pipeline
+        self.port = None
         self.signals = SerialWorkerSignals()
+        # predictions come from the reading thread or, in the background, from the inference thread
+        self.pipeline.subscribe(PREDICTION, self.emit_prediction)
 
     @pyqtSlot()
     def run(self):
 
-        global CONN_STATUS
-        global UPDATE
-        global CALIBRATION
-        global RESTART
-
-        if not CONN_STATUS:
+        if not self.session.connected:
             try:
-                self.port = serial.Serial(port=self.port_name, baudrate=self.baudrate,
-                                        write_timeout=0, timeout=0.1)                
-                if self.port.is_open:
-                    CONN_STATUS = True
-                    status_check = 0
-                    self.timer_count = 0
-                    update_plot = False
-                    capacitance_values =  []
+                if self.session.open():
+                    self.port = self.source.port
                     self.signals.status.emit(self.port_name, 1)
 
-                    while True:
-                        if status_check == 0:
-                            print('\n')
-                            flag = self.port.read_until(b'\n').decode()
-                            if flag == 'SOS\n':
-                                status_check = 1
-                        if status_check == 1:
-                            capacitance = self.port.read_until(b'EOS\n').decode().split()
-                            capacitance_values.append(capacitance)
-                            capacitance_values = [j.replace('\n', '') for j in capacitance]
-                            capacitance_values = capacitance_values[:-1] 
-                            newcap1 = capacitance_values[0]
-                            newcap1 = float(newcap1)
-                            print(newcap1)
-                            newcap2 = capacitance_values[1]
-                            newcap2 = float(newcap2)
-                            print(newcap2)
-                            newcap3 = capacitance_values[2]
-                            newcap3 = float(newcap3)
-                            print(newcap3)
-                            newcap4 = capacitance_values[3]
-                            newcap4 = float(newcap4)
-                            print(newcap4)         
-                            status_check = 0
-
-                            self.time.append(self.timer_count*0.1)
-                            self.timer_count = self.timer_count + 1
-                            self.cap1.append(newcap1)
-                            self.cap2.append(newcap2)
-                            self.cap3.append(newcap3)
-                            self.cap4.append(newcap4)
-                            
-                            if CALIBRATION == True:
-                                self.signals.calibration.emit(newcap1, newcap2, newcap3, newcap4)
-                            
-                            if PREDICTION == True:
-                                self.signals.prediction.emit(newcap1, newcap2, newcap3, newcap4)
-
-                            if UPDATE == True: 
-                                self.signals.data_ready.emit(self.time, self.cap1, self.cap2, self.cap3, self.cap4)
-
-                        if len(self.time) == 50:
-                            update_plot = True
-                        
-                        if update_plot == True:
-                            self.time = self.time[1:]
-                            self.cap1 = self.cap1[1:]
-                            self.cap2 = self.cap2[1:]
-                            self.cap3 = self.cap3[1:]
-                            self.cap4 = self.cap4[1:]
-                            update_plot = False
-                            if UPDATE == True:
-                                self.signals.data_ready.emit(self.time, self.cap1, self.cap2, self.cap3, self.cap4)
+                    for event in self.session.events():
+                        self.emit_event(event)
 
             except serial.SerialException:
                 logging.info("Error with port {}.".format(self.port_name))
                 self.signals.status.emit(self.port_name, 0)
                 time.sleep(0.01)
 
+    async def read(self):
+        """!
+        @brief Same as run() for the asyncio backend, as a coroutine of the SerialLoop.
+        """
+        if not self.session.connected:
+            try:
+                if self.session.open():
+                    self.port = self.source.port
+                    self.signals.status.emit(self.port_name, 1)
+
+                    async for event in self.session.aevents():
+                        self.emit_event(event)
+
+            except serial.SerialException:
+                logging.info("Error with port {}.".format(self.port_name))
+                self.signals.status.emit(self.port_name, 0)
+
+    def emit_event(self, event):
+        """!
+        @brief Turn a pipeline event into the signal of the interface.
+        """
+        if event.kind == SAMPLE:
+            if PRINT_SAMPLES:
+                print('\n')
+                for value in event.data.values:
+                    print(value)
+        elif event.kind == CALIBRATED:
+            self.signals.calibration.emit(event.data)
+        elif event.kind == BASELINE:
+            self.signals.baseline.emit(event.data)
+        elif event.kind == PROFILE:
+            self.signals.profile.emit(event.data)
+
+    def emit_prediction(self, label):
+        """!
+        @brief Pass a prediction and its stage times to the interface.
+        """
+        self.signals.prediction.emit(label, self.pipeline.last_trace)
+
     @pyqtSlot()
     def send(self, char):
         """!
@@ -174,16 +215,12 @@ class SerialWorker(QRunnable):
         """!
         @brief Close the serial port before closing the app.
         """
-        global CONN_STATUS
-        global KILL
-
-        if KILL and CONN_STATUS:
-            self.port.close()
+        if self.session.connected:
+            self.session.close()
+            self.pipeline.close()
             time.sleep(0.01)
-            CONN_STATUS = False
             self.signals.device_port.emit(self.port_name)
-            
-        KILL = False
+
         logging.info("Process killed")
 
 ###############
@@ -191,28 +228,25 @@ class SerialWorker(QRunnable):
 ###############
 class UserInterface(QMainWindow):
 
-    def __init__(self):
+    def __init__(self, model_manager=None, port_name=None, serial_loop=None, profiles=None):
+        """!
+        @param model_manager ModelManager shared with the windows of the other devices (None to load the model).
+        @param port_name serial port to connect to once the window is created (None to choose it).
+        @param serial_loop SerialLoop shared with the windows of the other devices (asyncio backend).
+        @param profiles ProfileStore shared with the windows of the other devices (None to open PROFILES_PATH).
+        """
         super(UserInterface, self).__init__()
 
-        self.serial_worker = SerialWorker(None)
+        # the classifier is loaded once and swapped in again only when the file changes
+        if model_manager is None:
+            model_manager = ModelManager(MODEL_PATH, background=FAST_START)
+        self.model_manager = model_manager
+        self.model_manager.start_watching()
+        if profiles is None and REUSE_CALIBRATION:
+            profiles = ProfileStore(PROFILES_PATH)
+        self.profiles = profiles
 
-        self.local_time = []
-        self.cap1 = []
-        self.cap2 = []
-        self.cap3 = []
-        self.cap4 = []
-        
-        self.cap1fullcal = []
-        self.cap2fullcal = []
-        self.cap3fullcal = []
-        self.cap4fullcal = []
-        self.i = 0
-
-        self.cap1fullprediction = []
-        self.cap2fullprediction = []
-        self.cap3fullprediction = []
-        self.cap4fullprediction = []
-        self.j = 0
+        self.serial_worker = SerialWorker(None, self.model_manager)
 
         self.dict_output = {
             0: 'PAIN WARNING',
@@ -222,23 +256,42 @@ class UserInterface(QMainWindow):
             4: 'HUNGER WARMING',
             }
 
-        self.meancal1 = 0
-        self.meancal2 = 0
-        self.meancal3 = 0
-        self.meancal4 = 0
-
         self.cal_start = False
         self.cal_finished = False
         self.pred_start = False
         self.pred_finished = False
         self.NEXT_STEP = False
+        self.counter = 0
+        self.update_plot = False
+        self.device_windows = []
 
         self.setWindowTitle("User Interface1")
         self.setMinimumSize(800, 600)
+        # each window reads its device in its own pool, so that a slow device does not hold the others
         self.threadpool = QThreadPool()
-        self.connected = CONN_STATUS
+        self.serial_loop = serial_loop if serial_loop is not None else SerialLoop()
         self.serialscan()
+        self.renderer = None
         self.initUI()
+
+        # the plot is redrawn at a fixed frame rate, whatever the sample rate
+        self.plot_timer = QTimer(self)
+        self.plot_timer.timeout.connect(self.render_plot)
+        self.plot_timer.start(int(1000 / FRAME_RATE))
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.show_status)
+        self.status_timer.start(1000)
+        # a timer firing late means the GUI thread was busy (e.g. drawing or predicting)
+        self.loop_lag = LoopLag(HEARTBEAT_INTERVAL)
+        self.heartbeat_timer = QTimer(self)
+        self.heartbeat_timer.timeout.connect(self.loop_lag.beat)
+        self.heartbeat_timer.start(int(HEARTBEAT_INTERVAL * 1000))
+        self.last_metrics = None
+        QShortcut(QKeySequence("Ctrl+M"), self, self.dump_metrics)
+
+        if port_name is not None:
+            self.com_list_widget.setCurrentText(port_name)
+            self.conn_btn.setChecked(True)
     
     def initUI(self):
  
@@ -247,7 +300,9 @@ class UserInterface(QMainWindow):
 
         button_conn = QVBoxLayout()
         button_conn.addWidget(self.com_list_widget)
+        button_conn.addWidget(self.user_widget)
         button_conn.addWidget(self.conn_btn)  
+        button_conn.addWidget(self.new_device_btn)
 
         self.main_layout = QVBoxLayout(central_widget)
         self.main_layout.setAlignment(Qt.AlignTop | Qt.AlignHCenter)
@@ -338,6 +393,14 @@ class UserInterface(QMainWindow):
         timer_button_layout.addWidget(self.next_button)
         self.next_button.clicked.connect(self.hideElements)
 
+        #continuous recognition botton
+        self.continuous_button = QPushButton("Continuous", self)
+        self.continuous_button.setFont(QFont('Arial', 14))
+        self.continuous_button.setCheckable(True)
+        self.continuous_button.hide()
+        timer_button_layout.addWidget(self.continuous_button)
+        self.continuous_button.toggled.connect(self.toggle_continuous)
+
         # legend
         legend_layout = QHBoxLayout()
         self.main_layout.addLayout(legend_layout)
@@ -349,12 +412,47 @@ class UserInterface(QMainWindow):
         self.legend_label.hide()
         legend_layout.addWidget(self.legend_label)
 
+        self.span_widget = QComboBox()
+        self.span_widget.addItems(PLOT_SPANS)
+        self.span_widget.setCurrentText(PLOT_SPAN)
+        self.span_widget.currentTextChanged.connect(self.span_changed)
+        self.span_widget.hide()
+        legend_layout.addWidget(self.span_widget)
+
         spacer_item = QSpacerItem(180, 0)
         legend_layout.addItem(spacer_item)
 
         self.image_legend_layout = QHBoxLayout()
         self.main_layout.addLayout(self.image_legend_layout)
 
+        self.image_l = QLabel(self)
+        self.pixmap_l = QPixmap("legend.jpeg")
+        scaled_pixmap_l = self.pixmap_l.scaled(500, 500, Qt.AspectRatioMode.KeepAspectRatio)
+        self.image_l.setPixmap(scaled_pixmap_l)
+        self.image_l.setAlignment(Qt.AlignRight)
+        self.image_l.hide()
+        self.image_legend_layout.addWidget(self.image_l)
+        self.main_layout.addStretch()
+
+        # in fast-start mode the plot (and pyqtgraph) is created by paintEvent
+        # once the window is on screen
+        self.graphWidget = None
+        self.plot_scheduled = False
+        if not FAST_START or 'pyqtgraph' in sys.modules:
+            self.create_plot()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.graphWidget is None and not self.plot_scheduled:
+            self.plot_scheduled = True
+            QTimer.singleShot(0, self.create_plot)
+
+    def create_plot(self):
+        """!
+        @brief Create the capacitance plot next to the legend.
+        """
+        from pyqtgraph import PlotWidget
+
         self.graphWidget = PlotWidget()
         self.graphWidget.showGrid(x=True, y=True)
         self.graphWidget.setBackground('white')
@@ -363,17 +461,8 @@ class UserInterface(QMainWindow):
         self.graphWidget.setLabel('left', 'Capacity', **styles)
         self.graphWidget.setLabel('bottom', 'Time [s]', **styles)
         self.graphWidget.addLegend()
-        self.image_legend_layout.addWidget(self.graphWidget)
-
-        self.image_l = QLabel(self)
-        self.pixmap_l = QPixmap("legend.jpeg")
-        scaled_pixmap_l = self.pixmap_l.scaled(500, 500, Qt.AspectRatioMode.KeepAspectRatio)
-        self.image_l.setPixmap(scaled_pixmap_l)
-        self.image_l.setAlignment(Qt.AlignRight)
-        self.image_l.hide()
-        self.image_legend_layout.addWidget(self.image_l)
+        self.image_legend_layout.insertWidget(0, self.graphWidget)
         self.draw()
-        self.main_layout.addStretch()
 
     def updateCountdownCal(self):
         if self.counter > 0:
@@ -391,133 +480,80 @@ class UserInterface(QMainWindow):
             self.cal_box.setText(str(self.counter / 10) + " s")
             self.counter -= 1
         else:
+            # the request is shown by prediction() as soon as the classifier returns
             self.timer.stop()
-            self.cal_box.setText(str(self.dict_output[self.prediction_value[0]]) + "\nIf the request is wrong,\nclick on the 'Restart' button\nand repeat the calibration.")
-            self.pred_finished = True
+            self.cal_box.setText("Analyzing your request...")
 
     def start_actn(self):  
-        global CALIBRATION
-        global PREDICTION
 
         if self.cal_start == False:
             self.timer = QTimer(self)
             self.timer.timeout.connect(self.updateCountdownCal)
             self.counter = 50
             self.timer.start(100)
-        if CALIBRATION == False:
-            CALIBRATION = True
-            self.i = 0
+            self.serial_worker.pipeline.start_calibration()
         if self.pred_start == True:
             self.timer = QTimer(self)
             self.timer.timeout.connect(self.updateCountdownReq)
             self.counter = 50
             self.timer.start(100)
-            PREDICTION = True
-            self.j = 0
+            self.serial_worker.pipeline.start_window()
     
-    def calibration(self, cap1, cap2, cap3, cap4):
+    def calibration(self, means):
+        """!
+        @brief Store the baseline computed by the pipeline (by the calibration, then at rest if it is adaptive).
+        """
+        if self.renderer is not None:
+            self.renderer.set_offset(means)
+        if not self.cal_start and self.counter > 0:
+            # the baseline was stable before the end of the countdown
+            self.counter = 0
+            self.updateCountdownCal()
+            saved = self.serial_worker.pipeline.metrics.gauges.get('calibration_saved', 0.0)
+            self.cal_box.setText("Done! ({:.1f} s saved)".format(saved))
+
+    def profile(self, result):
+        """!
+        @brief Skip the calibration if the first samples agree with the saved calibration of the device and user.
+        """
+        if result.accepted:
+            self.NEXT_STEP = True
+            self.cal_start = True
+            self.pred_start = True
+            self.cal_box.setText("Calibration restored!")
+        else:
+            self.cal_box.setText("Click on the 'Calibration' button\nto repeat the calibration.")
 
-        global CALIBRATION
-        
-        if CALIBRATION == True:
-            if self.i < 50:
-                self.cap1fullcal.append(cap1)
-                self.cap2fullcal.append(cap2)
-                self.cap3fullcal.append(cap3)
-                self.cap4fullcal.append(cap4)
-                self.i = self.i + 1
-            if self.i >= 50:
-                CALIBRATION = False
-                self.meancal1 = np.round((np.array(self.cap1fullcal)).mean(), decimals=2)
-                self.meancal2 = np.round((np.array(self.cap2fullcal)).mean(), decimals=2)
-                self.meancal3 = np.round((np.array(self.cap3fullcal)).mean(), decimals=2)
-                self.meancal4 = np.round((np.array(self.cap4fullcal)).mean(), decimals=2)
-                self.cap1fullcal = []
-                self.cap2fullcal = []
-                self.cap3fullcal = []
-                self.cap4fullcal = []
-
-    def prediction(self, cap1, cap2, cap3, cap4):
-        
-        global PREDICTION
-        
-        with open('mlp_1.pkl', 'rb') as file:
-            model_mlp = pickle.load(file)
-
-        if self.j < 50:
-            self.cap1fullprediction.append(cap1 - self.meancal1)
-            self.cap2fullprediction.append(cap2 - self.meancal2)
-            self.cap3fullprediction.append(cap3 - self.meancal3)
-            self.cap4fullprediction.append(cap4 - self.meancal4)
-            self.j = self.j + 1
-        if self.j >= 50:
+    def prediction(self, label, trace=None):
+        """!
+        @brief Show the class predicted by the pipeline for the last window.
+
+        @param trace stage times of the prediction (smartglasses.tracing.Trace), to measure the latency.
+        """
+        self.prediction_value = [label]
+        if self.continuous_button.isChecked():
+            self.cal_box.setText(str(self.dict_output[label]))
+        else:
             print("PREDICTION FINITA")
-            PREDICTION = False
-            array_cap2 = np.array(self.cap2fullprediction)
-            mean_left = array_cap2.mean()
-            var_left = array_cap2.var()
-            mode_left = stats.mode(array_cap2, axis=None, keepdims=True)
-            mode_value_left = mode_left.mode[0]
-            max_left = array_cap2.max()
-            min_left = array_cap2.min()
-
-            array_cap3 = np.array(self.cap3fullprediction)
-            mean_center = array_cap3.mean()
-            var_center = array_cap3.var()
-            mode_center = stats.mode(array_cap3, axis=None, keepdims=True)
-            mode_value_center = mode_center.mode[0]
-            max_center = array_cap3.max()
-            min_center = array_cap3.min()
-
-            array_cap4 = np.array(self.cap4fullprediction)
-            mean_eyebrow = array_cap4.mean()
-            var_eyebrow = array_cap4.var()
-            mode_eyebrow = stats.mode(array_cap4, axis=None, keepdims=True)
-            mode_value_eyebrow = mode_eyebrow.mode[0]
-            max_eyebrow = array_cap4.max()
-            min_eyebrow = array_cap4.min()
-
-            array_cap1 = np.array(self.cap1fullprediction)
-            mean_right = array_cap1.mean()
-            var_right = array_cap1.var()
-            mode_right = stats.mode(array_cap1, axis=None, keepdims=True)
-            mode_value_right = mode_right.mode[0]
-            max_right = array_cap1.max()
-            min_right = array_cap1.min()
-
-            self.cap1fullprediction = []
-            self.cap2fullprediction = []
-            self.cap3fullprediction = []
-            self.cap4fullprediction = []
-
-            df = pd.DataFrame({
-                'Mean_Left': [mean_left],
-                'Var_Left': [var_left],
-                'Mode_Left': [mode_value_left],
-                'Max_Left': [max_left],
-                'Min_Left': [min_left],
-                'Mean_Center': [mean_center],
-                'Var_Center': [var_center],
-                'Mode_Center': [mode_value_center],
-                'Max_Center': [max_center],
-                'Min_Center': [min_center],
-                'Mean_Right': [mean_right],
-                'Var_Right': [var_right],
-                'Mode_Right': [mode_value_right],
-                'Max_Right': [max_right],
-                'Min_Right': [min_right],
-                'Mean_Eyebrow': [mean_eyebrow],
-                'Var_Eyebrow': [var_eyebrow],
-                'Mode_Eyebrow': [mode_value_eyebrow],
-                'Max_Eyebrow': [max_eyebrow],
-                'Min_Eyebrow': [min_eyebrow],
-            })
-
-            self.prediction_value = model_mlp.predict(df)
+            self.timer.stop()
+            self.cal_box.setText(str(self.dict_output[label]) + "\nIf the request is wrong,\nclick on the 'Restart' button\nand repeat the calibration.")
+            self.pred_finished = True
+        self.record_display(trace)
+
+    def toggle_continuous(self, checked):
+        """!
+        @brief Classify the last 5 seconds at every sample, without pressing 'Send Request'.
+        """
+        if checked:
+            self.calibration_button.setDisabled(True)
+            self.cal_box.setText("Keep the facial expression\nfor 5 seconds...")
+            self.serial_worker.pipeline.start_continuous(CONTINUOUS_HOP)
+        else:
+            self.calibration_button.setDisabled(False)
+            self.cal_box.setText("")
+            self.serial_worker.pipeline.stop_continuous()
 
     def hideElements(self):
-        global UPDATE
-        global RESTART
 
         if self.pred_finished == False:
             if self.NEXT_STEP == True:
@@ -528,20 +564,18 @@ class UserInterface(QMainWindow):
             self.scritta2.setText("Stay with the facial expression you want to communicate for 5 seconds! \nWe are analyzing your request...")
             self.pixmap = QPixmap("attesa2.png")
             self.next_button.setText("Restart")
+            self.continuous_button.show()
             self.legend_label.show()
+            self.span_widget.show()
             self.image_l.show()
-            UPDATE = True
+            self.update_plot = True
         else:
-            RESTART = True
             self.initUI()
             self.reset_values()
     
     def reset_values(self):
-        global UPDATE
-        global RESTART
 
-        RESTART             = False
-        UPDATE              = False
+        self.update_plot    = False
         self.cal_start      = False
         self.cal_finished   = False
         self.pred_start     = False
@@ -549,63 +583,102 @@ class UserInterface(QMainWindow):
         self.NEXT_STEP      = False
         self.pred_finished  = False
 
-        self.graphWidget.clear()
-        self.draw()
+        self.continuous_button.setChecked(False)
 
-        self.local_time = []
-        self.cap1 = []
-        self.cap2 = []
-        self.cap3 = []
-        self.cap4 = []
-        
-        self.cap1fullcal = []
-        self.cap2fullcal = []
-        self.cap3fullcal = []
-        self.cap4fullcal = []
-        self.i = 0
-
-        self.cap1fullprediction = []
-        self.cap2fullprediction = []
-        self.cap3fullprediction = []
-        self.cap4fullprediction = []
-        self.j = 0
-
-        self.meancal1 = 0
-        self.meancal2 = 0
-        self.meancal3 = 0
-        self.meancal4 = 0
-    
-        self.cap1line.setData(x=self.local_time, y=self.cap1)
-        self.cap2line.setData(x=self.local_time, y=self.cap2)
-        self.cap3line.setData(x=self.local_time, y=self.cap3)
-        self.cap4line.setData(x=self.local_time, y=self.cap4)
+        if self.graphWidget is not None:
+            self.graphWidget.clear()
+            self.draw()
+
+        self.serial_worker.pipeline.reset()
+
+        if self.renderer is not None:
+            self.renderer.set_offset((0, 0, 0, 0))
+            self.renderer.clear()
 
     def draw(self):
 
-        self.cap1line = self.plot(self.graphWidget, self.local_time, self.cap1, 'Right', 'black')
-        self.cap2line = self.plot(self.graphWidget, self.local_time, self.cap2, 'Left', 'blue')
-        self.cap3line = self.plot(self.graphWidget, self.local_time, self.cap3, 'Center', 'red')
-        self.cap4line = self.plot(self.graphWidget, self.local_time, self.cap4, 'Eyebrow', 'green') 
+        # the curves are filled by the renderer from the history of the pipeline
+        self.cap1line = self.plot(self.graphWidget, 'Right', 'black')
+        self.cap2line = self.plot(self.graphWidget, 'Left', 'blue')
+        self.cap3line = self.plot(self.graphWidget, 'Center', 'red')
+        self.cap4line = self.plot(self.graphWidget, 'Eyebrow', 'green')
+
+        self.renderer = PlotRenderer([self.cap1line, self.cap2line, self.cap3line, self.cap4line],
+                                     self.plot_history, PLOT_SPANS[self.span_widget.currentText()])
+        self.renderer.set_offset(self.serial_worker.pipeline.means)
         
-    def plot(self, graph, x, y, curve_name, color):
+    def plot(self, graph, curve_name, color):
+        import pyqtgraph as pg
 
         pen = pg.mkPen(color=color)
-        line = graph.plot(x, y, name=curve_name, pen=pen)
+        line = graph.plot(name=curve_name, pen=pen)
         graph.getViewBox().setYRange(-0.3, 0.6)
         return line
     
-    def add_data(self, time, cap1, cap2, cap3, cap4):
+    def plot_history(self, span):
+        return self.serial_worker.pipeline.history_snapshot(span)
 
-        self.local_time = time
-        self.cap1 = cap1 - self.meancal1
-        self.cap2 = cap2 - self.meancal2
-        self.cap3 = cap3 - self.meancal3
-        self.cap4 = cap4 - self.meancal4
+    def render_plot(self):
+        """!
+        @brief Redraw the plot from the latest samples (called at FRAME_RATE).
+        """
+        if self.renderer is None:
+            return
+        if self.update_plot:
+            self.renderer.render()
+        else:
+            self.renderer.pause()
 
-        self.cap1line.setData(x=self.local_time, y=self.cap1)
-        self.cap2line.setData(x=self.local_time, y=self.cap2)
-        self.cap3line.setData(x=self.local_time, y=self.cap3)
-        self.cap4line.setData(x=self.local_time, y=self.cap4)
+    def span_changed(self, text):
+        if self.renderer is not None:
+            self.renderer.set_span(PLOT_SPANS[text])
+
+    def show_status(self):
+        """!
+        @brief Show the stream metrics and the frame rate and frame time of the plot in the status bar.
+        """
+        if not self.serial_worker.session.connected:
+            return
+        metrics = self.serial_worker.pipeline.metrics.snapshot()
+        message = summary(metrics, self.last_metrics) + " | " + headroom_summary(
+            metrics, self.last_metrics, self.serial_worker.baudrate)
+        self.last_metrics = metrics
+        latency = self.serial_worker.pipeline.latency
+        if latency.summary():
+            message = message + " | " + latency.summary()
+            if latency.over_budget(LATENCY_BUDGET):
+                message = message + " OVER BUDGET ({:.0f} ms)".format(LATENCY_BUDGET * 1000)
+        if self.update_plot and self.renderer is not None:
+            message = message + " | " + self.renderer.counter.summary()
+        baseline = self.serial_worker.pipeline.baseline
+        if baseline is not None and baseline.ready:
+            message = message + " | baseline {}".format("frozen" if baseline.frozen else "tracking")
+        if self.serial_worker.pipeline.inference is not None:
+            message = message + " | " + self.serial_worker.pipeline.inference.summary()
+        message = message + " | GUI lag max {:.0f} ms".format(self.loop_lag.take_max() * 1000)
+        self.statusBar().showMessage(message)
+
+    def record_display(self, trace):
+        """!
+        @brief Record the time a prediction reached the screen and check the latency budget.
+        """
+        if trace is None:
+            return
+        latency = self.serial_worker.pipeline.latency
+        latency.record_display(trace)
+        if latency.durations['end_to_end'][-1] > LATENCY_BUDGET:
+            logging.warning("Request shown {:.0f} ms after its last sample (budget {:.0f} ms)".format(
+                latency.durations['end_to_end'][-1] * 1000, LATENCY_BUDGET * 1000))
+
+    def dump_metrics(self):
+        """!
+        @brief Append the metrics of the device and of the plot to METRICS_PATH.
+        """
+        plot = self.renderer.counter.stats() if self.renderer is not None else None
+        pipeline = self.serial_worker.pipeline
+        pipeline.metrics.dump(METRICS_PATH, device=self.serial_worker.port_name, plot=plot,
+                              latency=pipeline.latency.report())
+        self.statusBar().showMessage("Metrics written to {}".format(os.path.abspath(METRICS_PATH)))
 
     ####################
     # SERIAL INTERFACE #
@@ -617,6 +690,8 @@ class UserInterface(QMainWindow):
         # Create the combo box to host port list
         self.port_text = ""
         self.com_list_widget = QComboBox()
+        # editable, so that a device path (e.g. the emulator pty) can be typed in
+        self.com_list_widget.setEditable(True)
         self.com_list_widget.currentTextChanged.connect(self.port_changed)
         
         # Create the connection button
@@ -632,6 +707,14 @@ class UserInterface(QMainWindow):
             ]
         self.com_list_widget.addItems(serial_ports)
 
+        # The calibration profiles are saved per device and user
+        self.user_widget = QLineEdit()
+        self.user_widget.setPlaceholderText("User")
+
+        # Create the button opening the window of another device
+        self.new_device_btn = QPushButton(text="Monitor another device")
+        self.new_device_btn.clicked.connect(self.new_device)
+
     ##################
     # SERIAL SIGNALS #
     ##################
@@ -649,24 +732,43 @@ class UserInterface(QMainWindow):
         """
         if checked:
             # setup reading worker
-            self.serial_worker = SerialWorker(self.port_text) # needs to be re defined
+            self.serial_worker = SerialWorker(self.port_text, self.model_manager, backend=SERIAL_BACKEND,
+                                              record=self.recording_path(),
+                                              background_inference=BACKGROUND_INFERENCE,
+                                              adaptive_baseline=ADAPTIVE_BASELINE,
+                                              profiles=self.profiles,
+                                              user=self.user_widget.text().strip(),
+                                              calibration_tolerance=CALIBRATION_TOLERANCE) # needs to be re defined
             # connect worker signals to functions
             self.serial_worker.signals.status.connect(self.check_serialport_status)
             self.serial_worker.signals.device_port.connect(self.connected_device)
-            self.serial_worker.signals.data_ready.connect(self.add_data)
             self.serial_worker.signals.calibration.connect(self.calibration)
+            self.serial_worker.signals.baseline.connect(self.calibration)
             self.serial_worker.signals.prediction.connect(self.prediction)
+            self.serial_worker.signals.profile.connect(self.profile)
             # execute the worker
-            self.threadpool.start(self.serial_worker)
+            if self.serial_worker.session.backend == 'asyncio':
+                self.serial_loop.submit(self.serial_worker.read())
+            else:
+                self.threadpool.start(self.serial_worker)
         else:
-            global KILL
-            KILL = True
             self.serial_worker.killed()
             self.com_list_widget.setDisabled(False) # enable the possibility to change port
+            self.user_widget.setDisabled(False)
             self.conn_btn.setText(
                 "Connect to port {}".format(self.port_text)
             )
 
+    def recording_path(self):
+        """!
+        @brief File the session about to start is recorded to (None when not recording).
+        """
+        if not RECORD_SESSIONS or is_recording(self.port_text):
+            return None
+        os.makedirs(RECORDINGS_PATH, exist_ok=True)
+        device = os.path.basename(self.port_text) or 'device'
+        return os.path.join(RECORDINGS_PATH, "{}_{}{}".format(device, time.strftime('%Y%m%d-%H%M%S'), RECORDING_EXTENSION))
+
     def check_serialport_status(self, port_name, status):
         """!
         @brief Handle the status of the serial port connection.
@@ -679,10 +781,15 @@ class UserInterface(QMainWindow):
         elif status == 1:
             # enable all the widgets on the interface
             self.com_list_widget.setDisabled(True) # disable the possibility to change COM port when already connected
+            self.user_widget.setDisabled(True)
             self.conn_btn.setText(
                 "Disconnect from port {}".format(port_name)
             )
+            self.setWindowTitle("User Interface1 - {}".format(port_name))
             logging.info("Connected to port {}".format(port_name))
+            # the saved calibration is checked on the first samples, the user calibrates if it does not agree
+            if not self.cal_start and self.serial_worker.session.restore_calibration(fallback=False) is not None:
+                self.cal_box.setText("Checking the saved calibration,\nremain still...")
 
     def connected_device(self, port_name):
         """!
@@ -690,18 +797,38 @@ class UserInterface(QMainWindow):
         """
         logging.info("Port {} closed.".format(port_name))
 
+    def new_device(self):
+        """!
+        @brief Open a window for another pair of glasses, with its own session and the same model.
+        """
+        window = UserInterface(self.model_manager, serial_loop=self.serial_loop, profiles=self.profiles)
+        QApplication.instance().aboutToQuit.connect(window.ExitHandler)
+        self.device_windows.append(window)
+        window.show()
+
+    def closeEvent(self, event):
+        # the other windows keep running: release only the port of this device
+        self.serial_worker.killed()
+        super().closeEvent(event)
+
     def ExitHandler(self):
         """!
         @brief Kill every possible running thread upon exiting application.
         """
-        global KILL
-        KILL = True
         self.serial_worker.killed()
+        self.serial_loop.stop()
+        self.model_manager.stop_watching()
 
 #run
 if __name__ == '__main__':
     app = QApplication([])
-    window = UserInterface()
-    app.aboutToQuit.connect(window.ExitHandler)
-    window.show()
+    # one window per device given on the command line (python GUI.py COM3 COM4),
+    # all sharing the same model
+    model_manager = ModelManager(MODEL_PATH, background=FAST_START)
+    serial_loop = SerialLoop()
+    profiles = ProfileStore(PROFILES_PATH) if REUSE_CALIBRATION else None
+    windows = [UserInterface(model_manager, port_name, serial_loop, profiles) for port_name in sys.argv[1:] or [None]]
+    for window in windows:
+        app.aboutToQuit.connect(window.ExitHandler)
+        window.show()
     app.exec_()
\ No newline at end of file
@@ -10,11 +10,40 @@ double capacitance_values[4] = {0,0,0,0};
 char message[60] = {'\0'};
 uint8_t temporary[2];
 
+#if BINARY_PROTOCOL
+#define FRAME_SIZE 18
+uint32_t raw_values[4] = {0,0,0,0};
+uint8_t frame[FRAME_SIZE];
+uint16_t sequence = 0;
+
+void Sensors_ProcessRawData(void);
+uint16_t CRC16_Compute(const uint8_t* data, uint8_t length);
+#endif
 
 void Sensors_ProcessCapacitanceData(void);
 
 CY_ISR(Custom_ISR_TIMER)
 {
+#if BINARY_PROTOCOL
+    Sensors_ProcessRawData();
+    frame[0] = 0xA5;
+    frame[1] = 0x5A;
+    frame[2] = sequence & 0xFF;
+    frame[3] = sequence >> 8;
+    for (uint8_t i = 0; i < 4; i++)
+    {
+        // 24-bit result: MSB register and upper byte of the LSB register
+        uint32_t result = raw_values[i] >> 8;
+        frame[4 + 3*i] = result & 0xFF;
+        frame[5 + 3*i] = (result >> 8) & 0xFF;
+        frame[6 + 3*i] = (result >> 16) & 0xFF;
+    }
+    uint16_t crc = CRC16_Compute(&frame[2], FRAME_SIZE - 4);
+    frame[FRAME_SIZE - 2] = crc & 0xFF;
+    frame[FRAME_SIZE - 1] = crc >> 8;
+    UART_1_PutArray(frame, FRAME_SIZE);
+    sequence++;
+#else
     //I2C_Peripheral_ReadRegisterMulti(0x50, 0x0C, 2, temporary);
     Sensors_ProcessCapacitanceData();
     sprintf(message, "SOS\n");
@@ -26,6 +55,7 @@ CY_ISR(Custom_ISR_TIMER)
     }
     sprintf(message, "EOS\n");
     UART_1_PutString(message);      
+#endif
 }
 
 
@@ -37,3 +67,29 @@ void Sensors_ProcessCapacitanceData(void)
         FDC_ReadMeasurement(ch, &capacitance_values[ch]);
     }
 }
+
+#if BINARY_PROTOCOL
+void Sensors_ProcessRawData(void)
+{
+    for (uint8_t ch = 0; ch < 4; ch++)
+    {
+        // Read measurement registers without conversion
+        FDC_ReadRawMeasurement(ch, &raw_values[ch]);
+    }
+}
+
+// CRC-16/CCITT-FALSE: polynomial 0x1021, initial value 0xFFFF
+uint16_t CRC16_Compute(const uint8_t* data, uint8_t length)
+{
+    uint16_t crc = 0xFFFF;
+    for (uint8_t i = 0; i < length; i++)
+    {
+        crc ^= (uint16_t)data[i] << 8;
+        for (uint8_t bit = 0; bit < 8; bit++)
+        {
+            crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+        }
+    }
+    return crc;
+}
+#endif
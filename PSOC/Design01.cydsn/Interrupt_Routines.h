@@ -2,4 +2,9 @@
 #include "stdio.h"
 #include "project.h"
 
+/* Set to 1 to send compact binary frames instead of the SOS/EOS text frames:
+   sync word 0xA5 0x5A, uint16 sequence number, 4 x signed 24-bit raw measurement
+   and CRC-16/CCITT-FALSE of sequence and measurements, all little endian. */
+#define BINARY_PROTOCOL 0
+
 CY_ISR_PROTO(Custom_ISR_TIMER);
\ No newline at end of file
@@ -1,19 +1,14 @@
 import sys
 import time
 import logging
-import numpy as np
-import pickle  
-from scipy import stats
-import csv
-import pandas as pd
 import os
 
-from PyQt5 import QtCore
 from PyQt5.QtCore import (
     QObject,
     QThreadPool, 
     QRunnable, 
     pyqtSignal, 
+    QTimer,
     pyqtSlot
 )
 
@@ -24,27 +19,82 @@ from PyQt5.QtWidgets import (
     QComboBox,
     QHBoxLayout,
     QVBoxLayout,
+    QLineEdit,
+    QShortcut,
     QWidget
 )
+from PyQt5.QtGui import QKeySequence
  
 import serial
 import serial.tools.list_ports
-import pyqtgraph as pg
-from pyqtgraph import PlotWidget
-
-# Globals
-CONN_STATUS = False
-SAMPLE      = False
-KILL        = False
-CALIBRATION = False
-SAVE        = False
-UPDATE      = False
-PREDICTION = False
-
-MEAN1CAL = 0
-MEAN2CAL = 0
-MEAN3CAL = 0
-MEAN4CAL = 0
+
+# Shared host code lives in the smartglasses package at the top of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from smartglasses.model_manager import ModelManager
+from smartglasses.store import AcquisitionStore, text_width
+from smartglasses.render import PlotRenderer, FRAME_RATE
+from smartglasses.session import DeviceSession
+from smartglasses.async_serial import SerialLoop
+from smartglasses.metrics import summary
+from smartglasses.ingest import headroom_summary
+from smartglasses.tracing import LoopLag
+from smartglasses.recording import is_recording, RECORDING_EXTENSION
+from smartglasses.profiles import ProfileStore
+from smartglasses.pipeline import (
+    SAMPLE,
+    CALIBRATED,
+    BASELINE,
+    PROFILE,
+    WINDOW,
+    PREDICTION
+)
+
+# Number of samples kept in the plotted history (36000 samples = 1 h at 10 Hz)
+HISTORY_LENGTH = 36000
+# Seconds of history shown by the plot
+PLOT_SPANS = {'5 s': 5.0, '1 min': 60.0, '10 min': 600.0, '1 h': 3600.0}
+PLOT_SPAN = '5 s'
+# Frame format sent by the PSoC: 'ascii', 'binary' or 'auto' to detect it
+PROTOCOL = 'auto'
+# Serial reading: 'thread' (a blocking reader per device in the thread pool)
+# or 'asyncio' (one SerialLoop thread for the devices of all the windows)
+SERIAL_BACKEND = 'thread'
+# Print the values of every sample on the console (slows down the reading thread)
+PRINT_SAMPLES = False
+# File the metrics are appended to with Ctrl+M (one JSON object per line)
+METRICS_PATH = 'metrics.jsonl'
+# Latency budget from the last sample of a window to the request shown, in seconds (95th percentile)
+LATENCY_BUDGET = 0.25
+# Record the bytes received from each device to RECORDINGS_PATH (replay them by
+# typing the path of the .sgrec file in place of the port)
+RECORD_SESSIONS = False
+RECORDINGS_PATH = 'recordings'
+# Classify the windows in an inference thread of each device, so that the
+# reading never waits for the model (the GUI thread never runs it either way)
+BACKGROUND_INFERENCE = True
+# Period of the timer measuring how long the GUI thread is kept busy, in seconds
+HEARTBEAT_INTERVAL = 0.05
+# Keep following the drift of the signal at rest after the calibration (the
+# baseline is frozen while an expression is held), instead of a fixed baseline
+ADAPTIVE_BASELINE = True
+# Save the calibration of each device and subject to PROFILES_PATH and, when they
+# connect again, skip the calibration if the first second of signal agrees with it
+REUSE_CALIBRATION = True
+PROFILES_PATH = 'profiles.json'
+# Stop the calibration as soon as the baseline is known within this, in pF (None
+# to always calibrate for 5 s): a user at rest is calibrated in about 1 s
+CALIBRATION_TOLERANCE = 0.005
+# Frames per second sent by the glasses: 10 with the firmware timer, up to 400 with
+# the FDC sample rate (FDC_100_Hz to FDC_400_Hz), decimated to the 10 Hz of the models
+DEVICE_RATE = 10
+# Baud rate of the serial link (400 Hz needs binary frames at 115200 baud)
+BAUDRATE = 9600
+
+MODEL_PATH = 'test_mlp_1.pkl'
+# Folder of the acquisition store the trials are saved to
+STORE_PATH = 'acquisitions'
+# Show the buttons first and load the plot (pyqtgraph) and the model in the background
+FAST_START = True
 
 #########################
 # SERIAL_WORKER_SIGNALS #
@@ -53,119 +103,96 @@ class SerialWorkerSignals(QObject):
 
     device_port = pyqtSignal(str)
     status = pyqtSignal(str, int)
-    data_ready = pyqtSignal(list, list, list, list, list)
-    calibration = pyqtSignal(float, float, float, float)
-    prediction = pyqtSignal(float, float, float, float)
-    sample = pyqtSignal(float, float, float, float)
-    save = pyqtSignal()
+    calibration = pyqtSignal(object)
+    prediction = pyqtSignal(object, object)
+    baseline = pyqtSignal(object)
+    profile = pyqtSignal(object)
+    sample = pyqtSignal(object)
 
 #################
 # SERIAL_WORKER #
 #################
 class SerialWorker(QRunnable):
     
-    def __init__(self, serial_port_name):
+    def __init__(self, serial_port_name, model_manager=None, history=HISTORY_LENGTH, protocol=PROTOCOL,
+                 backend=SERIAL_BACKEND, record=None, background_inference=BACKGROUND_INFERENCE,
+                 adaptive_baseline=ADAPTIVE_BASELINE, profiles=None, user='',
+                 calibration_tolerance=CALIBRATION_TOLERANCE, input_rate=DEVICE_RATE):
 
         super().__init__()
 
-        self.time = []
-        self.cap1 = []
-        self.cap2 = []
-        self.cap3 = []
-        self.cap4 = []
-
-        self.port = serial.Serial()
         self.port_name = serial_port_name
-        self.baudrate = 9600
+        self.baudrate = BAUDRATE
+        # connection, calibration, buffers and windows of this device only
+        self.session = DeviceSession(serial_port_name, model_manager, self.baudrate, protocol, history,
+                                     backend=backend, record=record, background_inference=background_inference,
+                                     adaptive_baseline=adaptive_baseline, profiles=profiles, user=user,
+                                     calibration_tolerance=calibration_tolerance, input_rate=input_rate)
+        self.source = self.session.source
+        self.pipeline = self.session.pipeline
+        self.port = None
         self.signals = SerialWorkerSignals()
+        # predictions come from the reading thread or, in the background, from the inference thread
+        self.pipeline.subscribe(PREDICTION, self.emit_prediction)
 
-
-        
     @pyqtSlot()
     def run(self):
-        global CONN_STATUS
-        global SAMPLE
-        global UPDATE
-        global CALIBRATION
-        global SAVE
-        global PREDICTION
-
-        if not CONN_STATUS:
+
+        if not self.session.connected:
             try:
-                self.port = serial.Serial(port=self.port_name, baudrate=self.baudrate,
-                                        write_timeout=0, timeout=0.1)                
-                if self.port.is_open:
-                    CONN_STATUS = True
-                    status_check = 0
-                    timer_count = 0
-                    update_plot = False
-                    capacitance_values =  []
+                if self.session.open():
+                    self.port = self.source.port
                     self.signals.status.emit(self.port_name, 1)
 
-                    while True:
-                        if status_check == 0:
-                            print('\n')
-                            flag = self.port.read_until(b'\n').decode()
-                            if flag == 'SOS\n':
-                                status_check = 1
-                        if status_check == 1:
-                            capacitance = self.port.read_until(b'EOS\n').decode().split()
-                            capacitance_values.append(capacitance)
-                            capacitance_values = [j.replace('\n', '') for j in capacitance]
-                            capacitance_values = capacitance_values[:-1] 
-                            newcap1 = capacitance_values[0]
-                            newcap1 = float(newcap1)
-                            print(newcap1)
-                            newcap2 = capacitance_values[1]
-                            newcap2 = float(newcap2)
-                            print(newcap2)
-                            newcap3 = capacitance_values[2]
-                            newcap3 = float(newcap3)
-                            print(newcap3)
-                            newcap4 = capacitance_values[3]
-                            newcap4 = float(newcap4)
-                            print(newcap4)         
-                            status_check = 0
-
-                            self.time.append(timer_count*0.1)
-                            timer_count = timer_count + 1
-                            self.cap1.append(newcap1)
-                            self.cap2.append(newcap2)
-                            self.cap3.append(newcap3)
-                            self.cap4.append(newcap4)
-
-                            if UPDATE == True:
-                                self.signals.data_ready.emit(self.time, self.cap1, self.cap2, self.cap3, self.cap4)
-                            if CALIBRATION == True:
-                                self.signals.calibration.emit(newcap1, newcap2, newcap3, newcap4)
-                            if SAMPLE == True:
-                                self.signals.sample.emit(newcap1, newcap2, newcap3, newcap4)
-                            if SAVE == True:
-                                self.signals.save.emit()
-                            if PREDICTION == True:
-                                self.signals.prediction.emit(newcap1, newcap2, newcap3, newcap4)
-               
-
-                        if len(self.time) == 50:
-                            update_plot = True
-
-                        if update_plot == True:
-                            self.time = self.time[1:]
-                            self.cap1 = self.cap1[1:]
-                            self.cap2 = self.cap2[1:]
-                            self.cap3 = self.cap3[1:]
-                            self.cap4 = self.cap4[1:]
-                            update_plot = False
- 
-                            #Line to constantly update data in the graph with every new acquisition
-                            if UPDATE == True:
-                                self.signals.data_ready.emit(self.time, self.cap1, self.cap2, self.cap3, self.cap4)
+                    for event in self.session.events():
+                        self.emit_event(event)
 
             except serial.SerialException:
                 logging.info("Error with port {}.".format(self.port_name))
                 self.signals.status.emit(self.port_name, 0)
                 time.sleep(0.01)
 
+    async def read(self):
+        """!
+        @brief Same as run() for the asyncio backend, as a coroutine of the SerialLoop.
+        """
+        if not self.session.connected:
+            try:
+                if self.session.open():
+                    self.port = self.source.port
+                    self.signals.status.emit(self.port_name, 1)
+
+                    async for event in self.session.aevents():
+                        self.emit_event(event)
+
+            except serial.SerialException:
+                logging.info("Error with port {}.".format(self.port_name))
+                self.signals.status.emit(self.port_name, 0)
+
+    def emit_event(self, event):
+        """!
+        @brief Turn a pipeline event into the signal of the interface.
+        """
+        if event.kind == SAMPLE:
+            if PRINT_SAMPLES:
+                print('\n')
+                for value in event.data.values:
+                    print(value)
+        elif event.kind == CALIBRATED:
+            self.signals.calibration.emit(event.data)
+        elif event.kind == BASELINE:
+            self.signals.baseline.emit(event.data)
+        elif event.kind == PROFILE:
+            self.signals.profile.emit(event.data)
+        elif event.kind == WINDOW and not self.pipeline.predict_window:
+            self.signals.sample.emit(event.data)
+
+    def emit_prediction(self, label):
+        """!
+        @brief Pass a prediction and its stage times to the interface.
+        """
+        self.signals.prediction.emit(label, self.pipeline.last_trace)
+
     @pyqtSlot()
     def send(self, char):
         """!
@@ -182,52 +209,45 @@ class SerialWorker(QRunnable):
         """!
         @brief Close the serial port before closing the app.
         """
-        global CONN_STATUS
-        global KILL
-
-        if KILL and CONN_STATUS:
-            self.port.close()
+        if self.session.connected:
+            self.session.close()
+            self.pipeline.close()
             time.sleep(0.01)
-            CONN_STATUS = False
             self.signals.device_port.emit(self.port_name)
-            
-        KILL = False
+
         logging.info("Process killed")
 
 ###############
 # MAIN WINDOW #
 ###############
 class MainWindow(QMainWindow): 
-    def __init__(self):
+    def __init__(self, model_manager=None, store=None, port_name=None, serial_loop=None, profiles=None):
+        """!
+        @param model_manager ModelManager shared with the windows of the other devices (None to load the model).
+        @param store AcquisitionStore shared with the windows of the other devices (None to open STORE_PATH).
+        @param port_name serial port to connect to once the window is created (None to choose it).
+        @param serial_loop SerialLoop shared with the windows of the other devices (asyncio backend).
+        @param profiles ProfileStore shared with the windows of the other devices (None to open PROFILES_PATH).
+        """
 
         super(MainWindow, self).__init__() 
 
-        self.serial_worker = SerialWorker(None)
+        # the classifier is loaded once and swapped in again only when the file changes
+        if model_manager is None:
+            model_manager = ModelManager(MODEL_PATH, background=FAST_START)
+        self.model_manager = model_manager
+        self.model_manager.start_watching()
+
+        self.serial_worker = SerialWorker(None, self.model_manager)
+
+        # windows sampled since the last save
+        self.trials = []
+        self.store = store if store is not None else AcquisitionStore(STORE_PATH)
+        if profiles is None and REUSE_CALIBRATION:
+            profiles = ProfileStore(PROFILES_PATH)
+        self.profiles = profiles
+        self.session = time.strftime('%Y%m%d-%H%M%S')
 
-        self.local_time = []
-        self.cap1 = []
-        self.cap2 = []
-        self.cap3 = []
-        self.cap4 = []
-        
-        self.cap1fullcal = []
-        self.cap2fullcal = []
-        self.cap3fullcal = []
-        self.cap4fullcal = []
-        self.i = 0
-
-        self.cap1fullsample = []
-        self.cap2fullsample = []
-        self.cap3fullsample = []
-        self.cap4fullsample = []
-        self.j = 0
-
-        self.cap1fullprediction = []
-        self.cap2fullprediction = []
-        self.cap3fullprediction = []
-        self.cap4fullprediction = []
-        self.k = 0
-        
         self.dict_output = {
             0: 'Angry',
             1: 'Default',
@@ -235,24 +255,46 @@ class MainWindow(QMainWindow):
             3: 'Head-up',
             4: 'Smile'
             }
-        
+
+        # baseline of this device and plot updates of this window
+        self.means = (0, 0, 0, 0)
+        self.update_plot = False
 
         self.setWindowTitle("GUI")
         width = 200
         height = 160
         self.setMinimumSize(width, height)
+        # each window reads its device in its own pool, so that a slow device does not hold the others
         self.threadpool = QThreadPool()
-        self.connected = CONN_STATUS
+        self.serial_loop = serial_loop if serial_loop is not None else SerialLoop()
         self.serialscan()
+        self.renderer = None
         self.initUI()
 
+        # the plot is redrawn at a fixed frame rate, whatever the sample rate
+        self.plot_timer = QTimer(self)
+        self.plot_timer.timeout.connect(self.render_plot)
+        self.plot_timer.start(int(1000 / FRAME_RATE))
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.show_status)
+        self.status_timer.start(1000)
+        # a timer firing late means the GUI thread was busy (e.g. drawing or predicting)
+        self.loop_lag = LoopLag(HEARTBEAT_INTERVAL)
+        self.heartbeat_timer = QTimer(self)
+        self.heartbeat_timer.timeout.connect(self.loop_lag.beat)
+        self.heartbeat_timer.start(int(HEARTBEAT_INTERVAL * 1000))
+        self.last_metrics = None
+        QShortcut(QKeySequence("Ctrl+M"), self, self.dump_metrics)
+
+        if port_name is not None:
+            self.com_list_widget.setCurrentText(port_name)
+            self.conn_btn.setChecked(True)
+
     #####################
     # GRAPHIC INTERFACE #
     #####################
     def initUI(self):
 
-        self.graphWidget = PlotWidget()    
-
         self.sample_btn = QPushButton(
             text="Sample",
             clicked=self.trigger_sample
@@ -273,6 +315,18 @@ class MainWindow(QMainWindow):
             text="Prediction",
             clicked=self.trigger_prediction
         )
+        # class and subject saved with the trials
+        self.label_widget = QComboBox()
+        self.label_widget.setEditable(True)
+        self.label_widget.addItems(self.dict_output.values())
+        self.label_widget.setCurrentText('Default')
+        self.subject_widget = QLineEdit()
+        self.subject_widget.setPlaceholderText("Subject")
+        self.subject_widget.setMaxLength(text_width('subject'))
+        self.span_widget = QComboBox()
+        self.span_widget.addItems(PLOT_SPANS)
+        self.span_widget.setCurrentText(PLOT_SPAN)
+        self.span_widget.currentTextChanged.connect(self.span_changed)
 
         # Layout
         button_conn = QHBoxLayout()
@@ -284,14 +338,39 @@ class MainWindow(QMainWindow):
         button_hlay.addWidget(self.save_btn)
         button_hlay.addWidget(self.calibration_btn)
         button_hlay.addWidget(self.prediction_btn)
+        button_hlay.addWidget(self.label_widget)
+        button_hlay.addWidget(self.subject_widget)
+        button_hlay.addWidget(self.span_widget)
         vlay = QVBoxLayout()
         vlay.addLayout(button_conn)
         vlay.addLayout(button_hlay)
-        vlay.addWidget(self.graphWidget)
+        self.vlay = vlay
         widget = QWidget()
         widget.setLayout(vlay)
         self.setCentralWidget(widget)
 
+        # in fast-start mode the plot (and pyqtgraph) is created by paintEvent
+        # once the window is on screen
+        self.graphWidget = None
+        self.plot_scheduled = False
+        if not FAST_START or 'pyqtgraph' in sys.modules:
+            self.create_plot()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.graphWidget is None and not self.plot_scheduled:
+            self.plot_scheduled = True
+            QTimer.singleShot(0, self.create_plot)
+
+    def create_plot(self):
+        """!
+        @brief Create the capacitance plot below the buttons.
+        """
+        from pyqtgraph import PlotWidget
+
+        self.graphWidget = PlotWidget()
+        self.vlay.addWidget(self.graphWidget)
+
         # Plot settings
         self.graphWidget.showGrid(x=True, y=True)
         self.graphWidget.setBackground('k')
@@ -303,235 +382,172 @@ class MainWindow(QMainWindow):
         self.draw()
 
     def trigger_data(self):
-        global UPDATE
-        if UPDATE == False:
-            UPDATE = True   
+        if self.update_plot == False:
+            self.update_plot = True
 
     def trigger_calibration(self):
-        global CALIBRATION
-        if CALIBRATION == False:
-            CALIBRATION = True
-            self.cap1fullcal = []
-            self.cap2fullcal = []
-            self.cap3fullcal = []
-            self.cap4fullcal = []
-            self.i = 0
+        self.serial_worker.pipeline.start_calibration()
     
     def trigger_sample(self):
-        global SAMPLE
-        if SAMPLE == False:
-            SAMPLE = True
-            self.j = 0
+        if not self.serial_worker.pipeline.calibrated:
+            print("Error! Remember to do the calibration first!\nClick on the 'Restart' button to repeat the proceeding")
+        else:
+            self.serial_worker.pipeline.start_window(predict=False)
 
     def trigger_save(self):
-        global SAVE
-        if SAVE == False:
-            SAVE = True
-
+        self.save()
     
     def trigger_prediction(self):
-        global PREDICTION
-        if PREDICTION == False:
-            PREDICTION = True
-            self.cap1fullprediction = []
-            self.cap2fullprediction = []
-            self.cap3fullprediction = []
-            self.cap4fullprediction = []
-            self.k = 0
-
-    def calibration(self, cap1, cap2, cap3, cap4):
-
-        global CALIBRATION
-        global MEAN1CAL
-        global MEAN2CAL
-        global MEAN3CAL
-        global MEAN4CAL
-        
-        if CALIBRATION == True:
-            if self.i < 50:
-                self.cap1fullcal.append(cap1)
-                self.cap2fullcal.append(cap2)
-                self.cap3fullcal.append(cap3)
-                self.cap4fullcal.append(cap4)
-                self.i = self.i + 1
-                print(self.i)
-            if self.i >= 50:
-                print("CALIBRATION DONE")
-                CALIBRATION = False
-                MEAN1CAL = np.round((np.array(self.cap1fullcal)).mean(), decimals=2)
-                MEAN2CAL = np.round((np.array(self.cap2fullcal)).mean(), decimals=2)
-                MEAN3CAL = np.round((np.array(self.cap3fullcal)).mean(), decimals=2)
-                MEAN4CAL = np.round((np.array(self.cap4fullcal)).mean(), decimals=2)
-                print(MEAN1CAL)
-
-    def prediction(self, cap1, cap2, cap3, cap4):
-        
-        global PREDICTION
-        global MEAN1CAL
-        global MEAN2CAL
-        global MEAN3CAL
-        global MEAN4CAL
-        
-        with open('test_mlp_1.pkl', 'rb') as file:
-            model_mlp = pickle.load(file) 
-
-        if self.k < 50:
-            self.cap1fullprediction.append(cap1 - MEAN1CAL)
-            self.cap2fullprediction.append(cap2 - MEAN2CAL)
-            self.cap3fullprediction.append(cap3 - MEAN3CAL)
-            self.cap4fullprediction.append(cap4 - MEAN4CAL)
-            self.k = self.k + 1
-        if self.k >= 50:
-            PREDICTION = False
-            array_cap2 = np.array(self.cap2fullprediction)
-            mean_left = array_cap2.mean()
-            var_left = array_cap2.var()
-            mode_left = stats.mode(array_cap2, axis=None, keepdims=True)
-            mode_value_left = mode_left.mode[0]
-            max_left = array_cap2.max()
-            min_left = array_cap2.min()
-
-            array_cap3 = np.array(self.cap3fullprediction)
-            mean_center = array_cap3.mean()
-            var_center = array_cap3.var()
-            mode_center = stats.mode(array_cap3, axis=None, keepdims=True)
-            mode_value_center = mode_center.mode[0]
-            max_center = array_cap3.max()
-            min_center = array_cap3.min()
-
-            array_cap4 = np.array(self.cap4fullprediction)
-            mean_eyebrow = array_cap4.mean()
-            var_eyebrow = array_cap4.var()
-            mode_eyebrow = stats.mode(array_cap4, axis=None, keepdims=True)
-            mode_value_eyebrow = mode_eyebrow.mode[0]
-            max_eyebrow = array_cap4.max()
-            min_eyebrow = array_cap4.min()
-
-            array_cap1 = np.array(self.cap1fullprediction)
-            mean_right = array_cap1.mean()
-            var_right = array_cap1.var()
-            mode_right = stats.mode(array_cap1, axis=None, keepdims=True)
-            mode_value_right = mode_right.mode[0]
-            max_right = array_cap1.max()
-            min_right = array_cap1.min()
-
-            df = pd.DataFrame({
-                'Mean_Left': [mean_left],
-                'Var_Left': [var_left],
-                'Mode_Left': [mode_value_left],
-                'Max_Left': [max_left],
-                'Min_Left': [min_left],
-                'Mean_Center': [mean_center],
-                'Var_Center': [var_center],
-                'Mode_Center': [mode_value_center],
-                'Max_Center': [max_center],
-                'Min_Center': [min_center],
-                'Mean_Right': [mean_right],
-                'Var_Right': [var_right],
-                'Mode_Right': [mode_value_right],
-                'Max_Right': [max_right],
-                'Min_Right': [min_right],
-                'Mean_Eyebrow': [mean_eyebrow],
-                'Var_Eyebrow': [var_eyebrow],
-                'Mode_Eyebrow': [mode_value_eyebrow],
-                'Max_Eyebrow': [max_eyebrow],
-                'Min_Eyebrow': [min_eyebrow]
-            })
-
-            prediction = model_mlp.predict(df)
-            predicted_target = self.dict_output[prediction[0]]
-            print("MLP:")
-            print(predicted_target)
-            print("********************************") 
+        self.serial_worker.pipeline.start_window(predict=True)
+
+    def calibration(self, means):
+
+        print("CALIBRATION DONE ({:.1f} s saved)".format(
+            self.serial_worker.pipeline.metrics.gauges.get('calibration_saved', 0.0)))
+        self.means = means
+        print(self.means[0])
+        if self.renderer is not None:
+            self.renderer.set_offset(means)
+
+    def baseline(self, means):
+        """!
+        @brief Follow the baseline updated by the pipeline at rest.
+        """
+        self.means = means
+        if self.renderer is not None:
+            self.renderer.set_offset(means)
+
+    def profile(self, result):
+        """!
+        @brief Report whether the saved calibration of the device and subject was reused.
+        """
+        if result.accepted:
+            print("SAVED CALIBRATION RESTORED")
+        else:
+            print("The saved calibration does not match, click on 'Calibration'")
+
+    def prediction(self, label, trace=None):
+
+        predicted_target = self.dict_output[label]
+        print("MLP:")
+        print(predicted_target)
+        print("********************************") 
+        self.record_display(trace)
 
 
     def draw(self):
 
-        self.cap1line = self.plot(self.graphWidget, self.local_time, self.cap1, 'Right', 'r')
-        self.cap2line = self.plot(self.graphWidget, self.local_time, self.cap2, 'Left', 'c')
-        self.cap3line = self.plot(self.graphWidget, self.local_time, self.cap3, 'Center', 'y')
-        self.cap4line = self.plot(self.graphWidget, self.local_time, self.cap4, 'Eyebrow', 'w')
+        # the curves are filled by the renderer from the history of the pipeline
+        self.cap1line = self.plot(self.graphWidget, 'Right', 'r')
+        self.cap2line = self.plot(self.graphWidget, 'Left', 'c')
+        self.cap3line = self.plot(self.graphWidget, 'Center', 'y')
+        self.cap4line = self.plot(self.graphWidget, 'Eyebrow', 'w')
+
+        self.renderer = PlotRenderer([self.cap1line, self.cap2line, self.cap3line, self.cap4line],
+                                     self.plot_history, PLOT_SPANS[self.span_widget.currentText()])
+        self.renderer.set_offset(self.means)
    
-    def plot(self, graph, x, y, curve_name, color):
+    def plot(self, graph, curve_name, color):
+        import pyqtgraph as pg
 
         pen = pg.mkPen(color=color)
-        line = graph.plot(x, y, name=curve_name, pen=pen)
+        line = graph.plot(name=curve_name, pen=pen)
         graph.getViewBox().setYRange(-0.3, 0.6)
         return line
         
-    def add_data(self, time, cap1, cap2, cap3, cap4):
-
-        global MEAN1CAL
-        global MEAN2CAL
-        global MEAN3CAL
-        global MEAN4CAL
-        global UPDATE
-
-        self.local_time = time
-        self.cap1 = cap1 - MEAN1CAL
-        self.cap2 = cap2 - MEAN2CAL
-        self.cap3 = cap3 - MEAN3CAL
-        self.cap4 = cap4 - MEAN4CAL
-
-        self.cap1line.setData(x=self.local_time, y=self.cap1)
-        self.cap2line.setData(x=self.local_time, y=self.cap2)
-        self.cap3line.setData(x=self.local_time, y=self.cap3)
-        self.cap4line.setData(x=self.local_time, y=self.cap4)
-
-    def sample(self, cap1, cap2, cap3, cap4):
-        
-        global MEAN1CAL
-        global MEAN2CAL
-        global MEAN3CAL
-        global MEAN4CAL
-        global SAMPLE
-
-        if SAMPLE == True:
-            if MEAN1CAL == 0 or MEAN2CAL == 0 or MEAN3CAL == 0 or MEAN4CAL == 0:
-                print("Error! Remember to do the calibration first!\nClick on the 'Restart' button to repeat the proceeding")
-                SAMPLE = False
-            else:
-                if self.j < 50:
-                    self.cap1fullsample.append(cap1 - MEAN1CAL)
-                    self.cap2fullsample.append(cap2 - MEAN2CAL)
-                    self.cap3fullsample.append(cap3 - MEAN3CAL)
-                    self.cap4fullsample.append(cap4 - MEAN4CAL)
-                    self.j = self.j + 1
-                if self.j >= 50:
-                    print("SAMPLE DONE")
-                    SAMPLE = False
-    
-    @pyqtSlot()
-    def save(self):
-
-        global SAVE
-
-        if SAVE == True:
+    def plot_history(self, span):
+        return self.serial_worker.pipeline.history_snapshot(span)
 
-            with open("Default Left.csv", "a", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(np.round([row for row in self.cap2fullsample], decimals=2))
-
-            with open("Default Center.csv", "a", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(np.round([row for row in self.cap3fullsample], decimals=2))
+    def render_plot(self):
+        """!
+        @brief Redraw the plot from the latest samples (called at FRAME_RATE).
+        """
+        if self.renderer is None:
+            return
+        if self.update_plot:
+            self.renderer.render()
+        else:
+            self.renderer.pause()
 
-            with open("Default Eyebrow.csv", "a", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(np.round([row for row in self.cap4fullsample], decimals=2))
+    def span_changed(self, text):
+        if self.renderer is not None:
+            self.renderer.set_span(PLOT_SPANS[text])
 
-            with open("Default Right.csv", "a", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(np.round([row for row in self.cap1fullsample], decimals=2))
+    def show_status(self):
+        """!
+        @brief Show the stream metrics and the frame rate and frame time of the plot in the status bar.
+        """
+        if not self.serial_worker.session.connected:
+            return
+        metrics = self.serial_worker.pipeline.metrics.snapshot()
+        message = summary(metrics, self.last_metrics) + " | " + headroom_summary(
+            metrics, self.last_metrics, self.serial_worker.baudrate)
+        self.last_metrics = metrics
+        latency = self.serial_worker.pipeline.latency
+        if latency.summary():
+            message = message + " | " + latency.summary()
+            if latency.over_budget(LATENCY_BUDGET):
+                message = message + " OVER BUDGET ({:.0f} ms)".format(LATENCY_BUDGET * 1000)
+        if self.update_plot and self.renderer is not None:
+            message = message + " | " + self.renderer.counter.summary()
+        baseline = self.serial_worker.pipeline.baseline
+        if baseline is not None and baseline.ready:
+            message = message + " | baseline {}".format("frozen" if baseline.frozen else "tracking")
+        if self.serial_worker.pipeline.inference is not None:
+            message = message + " | " + self.serial_worker.pipeline.inference.summary()
+        message = message + " | GUI lag max {:.0f} ms".format(self.loop_lag.take_max() * 1000)
+        self.statusBar().showMessage(message)
+
+    def record_display(self, trace):
+        """!
+        @brief Record the time a prediction reached the screen and check the latency budget.
+        """
+        if trace is None:
+            return
+        latency = self.serial_worker.pipeline.latency
+        latency.record_display(trace)
+        if latency.durations['end_to_end'][-1] > LATENCY_BUDGET:
+            logging.warning("Request shown {:.0f} ms after its last sample (budget {:.0f} ms)".format(
+                latency.durations['end_to_end'][-1] * 1000, LATENCY_BUDGET * 1000))
+
+    def dump_metrics(self):
+        """!
+        @brief Append the metrics of the device and of the plot to METRICS_PATH.
+        """
+        plot = self.renderer.counter.stats() if self.renderer is not None else None
+        pipeline = self.serial_worker.pipeline
+        pipeline.metrics.dump(METRICS_PATH, device=self.serial_worker.port_name, plot=plot,
+                              latency=pipeline.latency.report())
+        self.statusBar().showMessage("Metrics written to {}".format(os.path.abspath(METRICS_PATH)))
 
-                current_directory = os.getcwd()
-                print("Current directory:", current_directory)
-            
-            SAVE = False
-            self.cap1fullsample = []
-            self.cap2fullsample = []
-            self.cap3fullsample = []
-            self.cap4fullsample = []
+    def sample(self, window):
+        """!
+        @brief Keep a window of samples until it is saved.
+        """
+        self.trials.append(window)
+        print("SAMPLE DONE")
+    
+    @pyqtSlot()
+    def save(self):
+        """!
+        @brief Append the sampled windows to the acquisition store with the selected class and subject.
+        """
+        label = self.label_widget.currentText()
+        subject = self.subject_widget.text()
+        saved = 0
+        try:
+            for window in self.trials:
+                self.store.append(window.raw, label, subject, self.session, window.means, window.times)
+                saved = saved + 1
+        except ValueError as error:
+            # the trials not saved are kept, to be saved again once the name is fixed
+            self.trials = self.trials[saved:]
+            print("Trials not saved: {}".format(error))
+            self.statusBar().showMessage("Trials not saved: {}".format(error))
+            return
+        if self.trials:
+            print("Saved {} {} trials to {}".format(len(self.trials), label, os.path.abspath(STORE_PATH)))
+        self.trials = []
 
     ####################
     # SERIAL INTERFACE #
@@ -543,6 +559,8 @@ class MainWindow(QMainWindow):
         # Create the combo box to host port list
         self.port_text = ""
         self.com_list_widget = QComboBox()
+        # editable, so that a device path (e.g. the emulator pty) can be typed in
+        self.com_list_widget.setEditable(True)
         self.com_list_widget.currentTextChanged.connect(self.port_changed)
         
         # Create the connection button
@@ -576,27 +594,44 @@ class MainWindow(QMainWindow):
         """
         if checked:
             # setup reading worker
-            self.serial_worker = SerialWorker(self.port_text) # needs to be re defined
+            self.serial_worker = SerialWorker(self.port_text, self.model_manager, backend=SERIAL_BACKEND,
+                                              record=self.recording_path(),
+                                              background_inference=BACKGROUND_INFERENCE,
+                                              adaptive_baseline=ADAPTIVE_BASELINE,
+                                              profiles=self.profiles,
+                                              user=self.subject_widget.text().strip(),
+                                              calibration_tolerance=CALIBRATION_TOLERANCE) # needs to be re defined
             # connect worker signals to functions
             self.serial_worker.signals.status.connect(self.check_serialport_status)
             self.serial_worker.signals.device_port.connect(self.connected_device)
-            self.serial_worker.signals.data_ready.connect(self.add_data)
             self.serial_worker.signals.calibration.connect(self.calibration)
+            self.serial_worker.signals.baseline.connect(self.baseline)
             self.serial_worker.signals.sample.connect(self.sample)
-            self.serial_worker.signals.save.connect(self.save)
             self.serial_worker.signals.prediction.connect(self.prediction)
+            self.serial_worker.signals.profile.connect(self.profile)
             # execute the worker
-            self.threadpool.start(self.serial_worker)
+            if self.serial_worker.session.backend == 'asyncio':
+                self.serial_loop.submit(self.serial_worker.read())
+            else:
+                self.threadpool.start(self.serial_worker)
         else:
             # kill thread
-            global KILL
-            KILL = True
             self.serial_worker.killed()
             self.com_list_widget.setDisabled(False) # enable the possibility to change port
             self.conn_btn.setText(
                 "Connect to port {}".format(self.port_text)
             )
 
+    def recording_path(self):
+        """!
+        @brief File the session about to start is recorded to (None when not recording).
+        """
+        if not RECORD_SESSIONS or is_recording(self.port_text):
+            return None
+        os.makedirs(RECORDINGS_PATH, exist_ok=True)
+        device = os.path.basename(self.port_text) or 'device'
+        return os.path.join(RECORDINGS_PATH, "{}_{}{}".format(device, time.strftime('%Y%m%d-%H%M%S'), RECORDING_EXTENSION))
+
     def check_serialport_status(self, port_name, status):
         """!
         @brief Handle the status of the serial port connection.
@@ -613,7 +648,11 @@ class MainWindow(QMainWindow):
             self.conn_btn.setText(
                 "Disconnect from port {}".format(port_name)
             )
+            self.setWindowTitle("GUI - {}".format(port_name))
             logging.info("Connected to port {}".format(port_name))
+            # the saved calibration is checked on the first samples, 'Calibration' is needed if it does not agree
+            if not self.serial_worker.pipeline.calibrated and self.serial_worker.session.restore_calibration(fallback=False) is not None:
+                print("Checking the saved calibration, remain still...")
 
     def connected_device(self, port_name):
         """!
@@ -621,20 +660,32 @@ class MainWindow(QMainWindow):
         """
         logging.info("Port {} closed.".format(port_name))
 
+    def closeEvent(self, event):
+        # the other windows keep running: release only the port of this device
+        self.serial_worker.killed()
+        super().closeEvent(event)
+
     def ExitHandler(self):
         """!
         @brief Kill every possible running thread upon exiting application.
         """
-        global KILL
-        KILL = True
         self.serial_worker.killed()
+        self.serial_loop.stop()
+        self.model_manager.stop_watching()
 
 #############
 #  RUN APP  #
 #############
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    w = MainWindow()
-    app.aboutToQuit.connect(w.ExitHandler)
-    w.show()
+    # one window per device given on the command line (python acquisition_code.py COM3 COM4),
+    # all sharing the same model and store
+    model_manager = ModelManager(MODEL_PATH, background=FAST_START)
+    store = AcquisitionStore(STORE_PATH)
+    serial_loop = SerialLoop()
+    profiles = ProfileStore(PROFILES_PATH) if REUSE_CALIBRATION else None
+    windows = [MainWindow(model_manager, store, port_name, serial_loop, profiles) for port_name in sys.argv[1:] or [None]]
+    for w in windows:
+        app.aboutToQuit.connect(w.ExitHandler)
+        w.show()
     sys.exit(app.exec_())
@@ -0,0 +1,140 @@
+"""!
+@brief Per-window cost of the feature extraction: original GUI code against the vectorized one.
+
+Usage (from the top of the repository):
+
+    python benchmarks/bench_features.py --windows 2000
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from smartglasses.features import extract_features, FEATURE_NAMES
+
+
+def legacy_features(cap1, cap2, cap3, cap4):
+    """!
+    @brief Feature extraction of UserInterface.prediction before it was vectorized.
+
+    Kept verbatim (per-channel scipy.stats.mode and one-row DataFrame) as the reference.
+    """
+    from scipy import stats
+    import pandas as pd
+
+    array_cap2 = np.array(cap2)
+    mean_left = array_cap2.mean()
+    var_left = array_cap2.var()
+    mode_left = stats.mode(array_cap2, axis=None, keepdims=True)
+    mode_value_left = mode_left.mode[0]
+    max_left = array_cap2.max()
+    min_left = array_cap2.min()
+
+    array_cap3 = np.array(cap3)
+    mean_center = array_cap3.mean()
+    var_center = array_cap3.var()
+    mode_center = stats.mode(array_cap3, axis=None, keepdims=True)
+    mode_value_center = mode_center.mode[0]
+    max_center = array_cap3.max()
+    min_center = array_cap3.min()
+
+    array_cap4 = np.array(cap4)
+    mean_eyebrow = array_cap4.mean()
+    var_eyebrow = array_cap4.var()
+    mode_eyebrow = stats.mode(array_cap4, axis=None, keepdims=True)
+    mode_value_eyebrow = mode_eyebrow.mode[0]
+    max_eyebrow = array_cap4.max()
+    min_eyebrow = array_cap4.min()
+
+    array_cap1 = np.array(cap1)
+    mean_right = array_cap1.mean()
+    var_right = array_cap1.var()
+    mode_right = stats.mode(array_cap1, axis=None, keepdims=True)
+    mode_value_right = mode_right.mode[0]
+    max_right = array_cap1.max()
+    min_right = array_cap1.min()
+
+    return pd.DataFrame({
+        'Mean_Left': [mean_left],
+        'Var_Left': [var_left],
+        'Mode_Left': [mode_value_left],
+        'Max_Left': [max_left],
+        'Min_Left': [min_left],
+        'Mean_Center': [mean_center],
+        'Var_Center': [var_center],
+        'Mode_Center': [mode_value_center],
+        'Max_Center': [max_center],
+        'Min_Center': [min_center],
+        'Mean_Right': [mean_right],
+        'Var_Right': [var_right],
+        'Mode_Right': [mode_value_right],
+        'Max_Right': [max_right],
+        'Min_Right': [min_right],
+        'Mean_Eyebrow': [mean_eyebrow],
+        'Var_Eyebrow': [var_eyebrow],
+        'Mode_Eyebrow': [mode_value_eyebrow],
+        'Max_Eyebrow': [max_eyebrow],
+        'Min_Eyebrow': [min_eyebrow],
+    })
+
+
+def synthetic_windows(count, samples=50, seed=0):
+    """!
+    @brief Calibrated windows built like the GUI does: 2-decimal values minus a 2-decimal baseline.
+    """
+    rng = np.random.default_rng(seed)
+    baseline = np.round(rng.uniform(2.5, 3.5, size=(count, 4, 1)), 2)
+    offset = rng.choice([0.0, 0.3, -0.5, 0.7], size=(count, 4, 1))
+    raw = np.round(baseline + offset + rng.normal(0.0, 0.01, size=(count, 4, samples)), 2)
+    return raw - baseline
+
+
+def timed(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(windows=1000, samples=50, repeat=3):
+    """!
+    @brief Time the three implementations and check that they agree.
+
+    @return dict with the best time per window of each implementation, in seconds.
+    """
+    data = synthetic_windows(windows, samples)
+
+    legacy = np.vstack([legacy_features(*window).to_numpy() for window in data])
+    vectorized = extract_features(data)
+    if list(legacy_features(*data[0]).columns) != list(FEATURE_NAMES):
+        raise AssertionError("column order differs from the original code")
+    if not np.allclose(legacy, vectorized, rtol=0, atol=1e-12):
+        raise AssertionError("vectorized features differ from the original code")
+
+    return {
+        'legacy': timed(lambda: [legacy_features(*window) for window in data], repeat) / windows,
+        'single': timed(lambda: [extract_features(window) for window in data], repeat) / windows,
+        'batch': timed(lambda: extract_features(data), repeat) / windows,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the 20-feature extraction.")
+    parser.add_argument('--windows', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = run(args.windows, args.samples, args.repeat)
+    for name, seconds in results.items():
+        print("{:<8} {:10.1f} us/window  ({:.0f}x)".format(name, seconds * 1e6, results['legacy'] / seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
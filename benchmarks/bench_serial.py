@@ -0,0 +1,142 @@
+"""!
+@brief CPU usage and latency of the serial readers: a blocking thread per port against one asyncio loop.
+
+The 'thread' backend reads like the SerialWorker of the GUIs (blocking
+reads with a 0.1 s timeout, one thread per port); the 'asyncio' backend
+reads every port on one SerialLoop thread. Each run opens emulators of
+the glasses on pseudo-terminals of this process, reads them with
+DeviceSessions of one backend and reports:
+  - cpu: CPU time of the reading threads, in % of one core;
+  - latency: time from the write of a frame by the emulator to its SAMPLE
+    event, in ms (median, 95th percentile and maximum).
+The 'idle' scenario opens the ports without sending anything, to measure
+the cost of waiting.
+
+Usage (from the top of the repository, Linux only):
+
+    python benchmarks/bench_serial.py --devices 4 --duration 10
+    python benchmarks/bench_serial.py --devices 16 --rate 100 --json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from smartglasses.emulator import GlassesEmulator, open_pty
+from smartglasses.session import SessionManager, BACKENDS
+from smartglasses.pipeline import SAMPLE
+
+SCENARIOS = ('streaming', 'idle')
+
+
+def thread_cpu(ident):
+    """!
+    @brief CPU time used so far by a thread of this process, in seconds.
+    """
+    return time.clock_gettime(time.pthread_getcpuclockid(ident))
+
+
+def reader_threads(manager):
+    if manager.serial_loop.running:
+        return [manager.serial_loop.thread_id]
+    return [session.thread_id for session in manager if session.thread_id is not None]
+
+
+def measure(backend, scenario='streaming', devices=4, rate=10.0, duration=10.0):
+    """!
+    @brief Read devices emulators with one backend for duration seconds.
+
+    @return dict with the CPU usage of the readers and the latency statistics.
+    """
+    manager = SessionManager(backend=backend, protocol='ascii')
+    emulators = {}
+    ptys = []
+    for i in range(devices):
+        master, slave, name = open_pty()
+        ptys.append((master, slave))
+        emulators[name] = GlassesEmulator(rate=rate, pattern='idle:5,smile:5', banner=False,
+                                          seed=i, record_times=True)
+        manager.add(name)
+
+    latencies = []
+
+    def on_event(session, event):
+        if event.kind == SAMPLE:
+            sent = emulators[session.port_name].send_times.get(event.data.index)
+            if sent is not None:
+                latencies.append(time.monotonic() - sent)
+
+    manager.start(on_event)
+    # wait for the ports to be open before sending
+    while sum(session.connected for session in manager) < devices:
+        time.sleep(0.01)
+    threads = reader_threads(manager)
+    start_cpu = sum(thread_cpu(ident) for ident in threads)
+
+    writers = []
+    if scenario == 'streaming':
+        for (master, _), emulator in zip(ptys, emulators.values()):
+            writer = threading.Thread(target=emulator.run, args=(master, duration), daemon=True)
+            writer.start()
+            writers.append(writer)
+    time.sleep(duration)
+    for writer in writers:
+        writer.join()
+    # let the last frames be read
+    time.sleep(0.2)
+    cpu = sum(thread_cpu(ident) for ident in threads) - start_cpu
+
+    manager.stop()
+    for master, slave in ptys:
+        os.close(master)
+        os.close(slave)
+
+    latencies = np.asarray(latencies) * 1000
+    sent = sum(emulator.sent for emulator in emulators.values())
+    return {
+        'threads': len(threads),
+        'cpu': 100 * cpu / (duration + 0.2),
+        'samples': len(latencies),
+        'sent': sent,
+        'latency_median': float(np.median(latencies)) if len(latencies) else float('nan'),
+        'latency_p95': float(np.percentile(latencies, 95)) if len(latencies) else float('nan'),
+        'latency_max': float(latencies.max()) if len(latencies) else float('nan'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the thread and asyncio serial backends.")
+    parser.add_argument('--devices', type=int, default=4, help="emulated glasses read at once")
+    parser.add_argument('--rate', type=float, default=10.0, help="frames per second of each device")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of each run")
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    results = {scenario: {backend: measure(backend, scenario, args.devices, args.rate, args.duration)
+                          for backend in BACKENDS}
+               for scenario in scenarios}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print("{} devices at {:g} Hz, {:g} s per run".format(args.devices, args.rate, args.duration))
+    for scenario, backends in results.items():
+        print(scenario)
+        print("  {:<8}{:>8}{:>8}{:>10}{:>12}{:>10}{:>10}".format(
+            'backend', 'threads', 'cpu', 'samples', 'median', 'p95', 'max'))
+        for backend, result in backends.items():
+            print("  {:<8}{:>8}{:>7.2f}%{:>10}{:>10.2f}ms{:>8.2f}ms{:>8.2f}ms".format(
+                backend, result['threads'], result['cpu'], result['samples'],
+                result['latency_median'], result['latency_p95'], result['latency_max']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
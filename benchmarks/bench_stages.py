@@ -0,0 +1,367 @@
+"""!
+@brief Time each stage of the host code: parsing, calibration, features, inference and rendering.
+
+Every benchmark processes a batch of items (frames, samples, windows,
+rows or plot frames) several times and reports the median and the best
+time per item. Data is synthetic (frames of the emulator, random
+windows) unless a recording is given, in which case its bytes are used
+for the parsing and pipeline benchmarks. Results can be written as JSON,
+with the versions and the git commit they were measured on, and compared
+with an earlier run to spot regressions.
+
+Usage (from the top of the repository):
+
+    python benchmarks/bench_stages.py --output results.json
+    python benchmarks/bench_stages.py --recording session.sgrec --compare results.json
+    python benchmarks/bench_stages.py --filter parse. --filter inference.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(ROOT)
+from smartglasses.protocol import AsciiFrameDecoder, BinaryFrameDecoder, make_decoder
+from smartglasses.emulator import GlassesEmulator
+from smartglasses.calibration import Calibrator
+from smartglasses.features import extract_features, window_features, predict_rows
+from smartglasses.sliding import SlidingWindowFeatures
+from smartglasses.mlp import load_model
+from smartglasses.render import PlotRenderer
+from smartglasses.pipeline import InferencePipeline
+from smartglasses.recording import iter_chunks
+from smartglasses.ingest import Decimator, decimation_factor, read_size
+from bench_features import synthetic_windows
+
+MODEL_PATH = os.path.join(ROOT, 'GUI', 'mlp_1.npz')
+# Ratio of the new time to the baseline above which a benchmark is reported as slower
+THRESHOLD = 1.2
+
+
+def emulated_stream(frames, protocol, seed=0, rate=10):
+    """!
+    @brief Frames of the emulator, one chunk per frame like reads at 10 Hz.
+    """
+    emulator = GlassesEmulator(rate=rate, pattern='idle:5,smile:5,angry:5', protocol=protocol, banner=False, seed=seed)
+    stream = emulator.frames()
+    return [next(stream)[2] for _ in range(frames)]
+
+
+def high_rate_stream(frames, rate=400):
+    """!
+    @brief Binary frames of the emulator at a high rate, in chunks of the size of the serial reads.
+    """
+    data = b''.join(emulated_stream(frames, 'binary', rate=rate))
+    size = read_size(rate)
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def count_frames(chunks, protocol='auto'):
+    decoder = make_decoder(protocol)
+    return sum(len(decoder.feed(chunk)) for chunk in chunks)
+
+
+#########
+# CASES #
+#########
+# Each case prepares its data and returns (items, unit, function processing the items once).
+
+def case_parse_ascii(options):
+    chunks = emulated_stream(options.frames, 'ascii')
+    return len(chunks), 'frame', lambda: [AsciiFrameDecoder().feed(chunk) for chunk in chunks]
+
+
+def case_parse_binary(options):
+    chunks = emulated_stream(options.frames, 'binary')
+    return len(chunks), 'frame', lambda: [BinaryFrameDecoder().feed(chunk) for chunk in chunks]
+
+
+def case_parse_binary_400hz(options):
+    chunks = high_rate_stream(options.frames)
+
+    def parse():
+        decoder = BinaryFrameDecoder()
+        for chunk in chunks:
+            decoder.feed(chunk)
+    return count_frames(chunks, 'binary'), 'frame', parse
+
+
+def case_parse_recording(options):
+    if options.recording is None:
+        return None
+    chunks = [data for _, data in iter_chunks(options.recording)]
+
+    def parse():
+        decoder = make_decoder('auto')
+        for chunk in chunks:
+            decoder.feed(chunk)
+    return count_frames(chunks), 'frame', parse
+
+
+def case_calibration(options):
+    samples = np.round(3.0 + np.random.default_rng(0).normal(0.0, 0.01, size=(options.samples, 4)), 2)
+    calibrator = Calibrator()
+
+    def calibrate():
+        calibrator.reset()
+        for values in samples:
+            if calibrator.add(values):
+                calibrator.reset()
+    return len(samples), 'sample', calibrate
+
+
+def case_features_window(options):
+    windows = synthetic_windows(options.windows)
+    return len(windows), 'window', lambda: [window_features(window) for window in windows]
+
+
+def case_features_batch(options):
+    windows = synthetic_windows(options.windows)
+    return len(windows), 'window', lambda: extract_features(windows)
+
+
+def case_features_sliding(options):
+    samples = synthetic_windows(options.samples // 50 + 1).transpose(0, 2, 1).reshape(-1, 4)[:options.samples]
+
+    def slide():
+        sliding = SlidingWindowFeatures()
+        for values in samples:
+            sliding.add(values)
+    return len(samples), 'sample', slide
+
+
+def case_inference_single(options):
+    model = load_model(MODEL_PATH)
+    rows = extract_features(synthetic_windows(options.rows // 10))
+    return len(rows), 'row', lambda: [model.predict(row[None, :]) for row in rows]
+
+
+def case_inference_batch(options):
+    model = load_model(MODEL_PATH)
+    rows = extract_features(synthetic_windows(options.rows))
+    return len(rows), 'row', lambda: model.predict(rows)
+
+
+def case_inference_sklearn(options):
+    path = os.path.join(ROOT, 'GUI', 'mlp_1.pkl')
+    try:
+        import pickle
+        import warnings
+        with open(path, 'rb') as file, warnings.catch_warnings():
+            # the pickle may come from another sklearn version
+            warnings.simplefilter('ignore')
+            model = pickle.load(file)
+    except (ImportError, OSError):
+        return None
+    rows = extract_features(synthetic_windows(options.rows // 10))
+    return len(rows), 'row', lambda: [predict_rows(model, row[None, :]) for row in rows]
+
+
+class _Curve:
+    def setData(self, x=None, y=None):
+        pass
+
+
+def _render_case(options, span):
+    history = np.column_stack([np.arange(options.history) * 0.1,
+                               3.0 + np.random.default_rng(0).normal(0.0, 0.05, size=(options.history, 4))])
+    renderer = PlotRenderer([_Curve() for _ in range(4)], lambda _: (renderer.counter.frames, history), span)
+
+    def render():
+        for _ in range(options.plot_frames):
+            renderer.render()
+    return options.plot_frames, 'plot frame', render
+
+
+def case_render_5s(options):
+    return _render_case(options, 5.0)
+
+
+def case_render_1h(options):
+    return _render_case(options, 3600.0)
+
+
+def case_decimate(options):
+    rows = 3.0 + np.random.default_rng(0).normal(0.0, 0.005, size=(options.frames, 4))
+    blocks = np.array_split(rows, max(1, options.frames // 10))
+
+    def decimate():
+        decimator = Decimator(decimation_factor(400))
+        for block in blocks:
+            decimator.add_block(block)
+    return len(rows), 'frame', decimate
+
+
+def case_pipeline(options):
+    if options.recording is not None:
+        chunks = [data for _, data in iter_chunks(options.recording)]
+    else:
+        chunks = emulated_stream(options.frames, 'ascii')
+    from smartglasses.model_manager import ModelManager
+    model_manager = ModelManager(MODEL_PATH)
+
+    def run():
+        pipeline = InferencePipeline(model_manager)
+        pipeline.start_calibration()
+        pipeline.start_continuous()
+        for chunk in chunks:
+            pipeline.feed(chunk)
+    return count_frames(chunks), 'frame', run
+
+
+def case_pipeline_400hz(options):
+    chunks = high_rate_stream(options.frames)
+    from smartglasses.model_manager import ModelManager
+    model_manager = ModelManager(MODEL_PATH)
+
+    def run():
+        pipeline = InferencePipeline(model_manager, protocol='binary', input_rate=400)
+        pipeline.start_calibration()
+        pipeline.start_continuous()
+        for chunk in chunks:
+            pipeline.feed(chunk)
+    return count_frames(chunks, 'binary'), 'frame', run
+
+
+CASES = {
+    'parse.ascii': case_parse_ascii,
+    'parse.binary': case_parse_binary,
+    'parse.binary.400hz': case_parse_binary_400hz,
+    'parse.recording': case_parse_recording,
+    'calibration': case_calibration,
+    'decimate': case_decimate,
+    'features.window': case_features_window,
+    'features.batch': case_features_batch,
+    'features.sliding': case_features_sliding,
+    'inference.single': case_inference_single,
+    'inference.batch': case_inference_batch,
+    'inference.sklearn': case_inference_sklearn,
+    'render.5s': case_render_5s,
+    'render.1h': case_render_1h,
+    'pipeline.continuous': case_pipeline,
+    'pipeline.400hz': case_pipeline_400hz,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(function, items, repeat):
+    """!
+    @brief Median and best time per item over repeat runs, after one warm-up run.
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) / items)
+    return statistics.median(times), min(times)
+
+
+def run(options, names=None):
+    """!
+    @brief Run the benchmarks (all of them if names is None).
+
+    @return dict with the 'meta' data of the run and the 'results' of each benchmark
+        (items, unit, repeat, median and min in seconds per item).
+    """
+    results = {}
+    for name, case in CASES.items():
+        if names is not None and name not in names:
+            continue
+        prepared = case(options)
+        if prepared is None:
+            continue
+        items, unit, function = prepared
+        median, best = measure(function, items, options.repeat)
+        results[name] = {'items': items, 'unit': unit, 'repeat': options.repeat, 'median': median, 'min': best}
+    meta = {
+        'time': time.time(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'recording': options.recording,
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """!
+    @brief Ratio of the median of each benchmark to the one of a baseline run.
+
+    @return (rows of (name, baseline, current, ratio), names of the benchmarks slower than threshold).
+    """
+    rows = []
+    slower = []
+    for name, result in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        ratio = result['median'] / before['median']
+        rows.append((name, before['median'], result['median'], ratio))
+        if ratio > threshold:
+            slower.append(name)
+    return rows, slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the host code.")
+    parser.add_argument('--filter', action='append', default=None, metavar='PREFIX',
+                        help="run only the benchmarks starting with PREFIX (repeatable): {}".format(', '.join(CASES)))
+    parser.add_argument('--recording', default=None, help=".sgrec recording used for the parsing and pipeline benchmarks")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--frames', type=int, default=2000, help="frames of the synthetic streams")
+    parser.add_argument('--samples', type=int, default=5000, help="samples of the calibration and sliding benchmarks")
+    parser.add_argument('--windows', type=int, default=1000, help="windows of the feature benchmarks")
+    parser.add_argument('--rows', type=int, default=10000, help="rows of the batch inference benchmark")
+    parser.add_argument('--history', type=int, default=36000, help="samples in the plotted history")
+    parser.add_argument('--plot-frames', type=int, default=50, help="frames drawn per render benchmark run")
+    parser.add_argument('--output', default=None, help="write the results to this JSON file")
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help="compare with the results of an earlier run")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="slowdown ratio reported as a regression")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    names = None
+    if args.filter:
+        names = [name for name in CASES if any(name.startswith(prefix) for prefix in args.filter)]
+    results = run(args, names)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results['results'].items():
+            print("{:<20} {:>10.2f} us/{} (min {:.2f}, {} items)".format(
+                name, result['median'] * 1e6, result['unit'], result['min'] * 1e6, result['items']))
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        rows, slower = compare(results, baseline, args.threshold)
+        print("\ncompared with {} ({})".format(args.compare, baseline['meta'].get('commit')))
+        for name, before, after, ratio in rows:
+            print("{:<20} {:>10.2f} -> {:>10.2f} us  {:>5.2f}x{}".format(
+                name, before * 1e6, after * 1e6, ratio, "  SLOWER" if name in slower else ""))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""!
+@brief Startup time of the GUIs, with and without the fast-start mode.
+
+Each run starts a new interpreter, imports the GUI module, creates the
+main window and shows it. The times reported, from the launch of the
+interpreter, are:
+  - interpreter: the benchmark code starts running;
+  - import: the GUI module is imported;
+  - first_frame: the window receives its first paint event;
+  - plot_ready: the capacitance plot exists;
+  - model_ready: the classifier is loaded.
+
+Usage (from the top of the repository):
+
+    python benchmarks/bench_startup.py --repeat 5
+    python benchmarks/bench_startup.py --app acquisition --json
+
+Without a display, run it with QT_QPA_PLATFORM=offscreen.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Module file and main window class of each GUI
+APPS = {
+    'gui': (os.path.join('GUI', 'GUI.py'), 'UserInterface'),
+    'acquisition': (os.path.join('SAMPLE CODE', 'acquisition_code.py'), 'MainWindow'),
+}
+
+STEPS = ('interpreter', 'import', 'first_frame', 'plot_ready', 'model_ready')
+
+
+def child(app, fast, launched, timeout=30.0):
+    """!
+    @brief Start one GUI in this process and print the time of each step as JSON.
+    """
+    times = {'interpreter': time.time()}
+    import importlib.util
+
+    path, window_class = APPS[app]
+    path = os.path.abspath(os.path.join(ROOT, path))
+    # the GUIs load their images and model relative to their folder
+    os.chdir(os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location('startup_target', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.FAST_START = fast
+    times['import'] = time.time()
+
+    from PyQt5.QtCore import QObject, QEvent, QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    class FirstFrame(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Paint and 'first_frame' not in times:
+                times['first_frame'] = time.time()
+            return False
+
+    application = QApplication([])
+    window = getattr(module, window_class)()
+    first_frame = FirstFrame()
+    window.installEventFilter(first_frame)
+    window.show()
+
+    def poll():
+        if 'plot_ready' not in times and window.graphWidget is not None:
+            times['plot_ready'] = time.time()
+        if 'model_ready' not in times and window.model_manager.ready:
+            times['model_ready'] = time.time()
+        if all(step in times for step in STEPS) or time.time() - launched > timeout:
+            application.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(poll)
+    timer.start(1)
+    application.exec_()
+    window.ExitHandler()
+    print(json.dumps({step: times[step] - launched for step in STEPS if step in times}), flush=True)
+
+
+def measure(app, fast):
+    """!
+    @brief Launch a new interpreter running one GUI and return the time of each step in seconds.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--app', app]
+    if not fast:
+        command.append('--standard')
+    launched = time.time()
+    output = subprocess.run(command + ['--launched', repr(launched)], check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(apps=('gui',), repeat=5):
+    """!
+    @brief Median time of each step over repeat runs of each GUI and mode.
+
+    @return dict {app: {'fast': {step: seconds}, 'standard': {step: seconds}}}.
+    """
+    results = {}
+    for app in apps:
+        results[app] = {}
+        for mode, fast in (('standard', False), ('fast', True)):
+            runs = [measure(app, fast) for _ in range(repeat)]
+            results[app][mode] = {step: statistics.median(run[step] for run in runs)
+                                  for step in STEPS if all(step in run for run in runs)}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the startup of the GUIs.")
+    parser.add_argument('--app', choices=sorted(APPS) + ['all'], default='gui')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--standard', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--launched', type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.app, not args.standard, args.launched)
+        return 0
+
+    apps = sorted(APPS) if args.app == 'all' else [args.app]
+    results = run(apps, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    for app, modes in results.items():
+        print(app)
+        print("  {:<12}".format('') + ''.join("{:>10}".format(mode) for mode in modes))
+        for step in STEPS:
+            print("  {:<12}".format(step) + ''.join("{:>8.0f}ms".format(modes[mode].get(step, float('nan')) * 1000) for mode in modes))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+"""!
+@brief Host-side code shared by the GUI and the acquisition code.
+
+The modules in this package are kept free of module-level imports of
+PyQt5, pyqtgraph, pandas and scipy, so that they can be used from
+scripts and services without a display server.
+"""
@@ -0,0 +1,221 @@
+"""!
+@brief Serial reading with asyncio: bytes are processed when they arrive, many ports on one thread.
+
+SerialSource reads with a 0.1 s timeout in a loop, holding one thread per
+port and waking up ten times per second even when nothing arrives.
+AsyncSerialSource instead registers the file descriptor of the port with
+the asyncio event loop and is woken up by the kernel only when bytes are
+available. SerialLoop runs such an event loop in a single thread, so any
+number of devices can be read without one thread each; the GUIs hand it
+their sessions and receive the events through their Qt signals, which
+are safe to emit from that thread.
+
+Where the event loop cannot watch serial handles (Windows), the reads
+fall back to blocking reads in the default executor of the loop.
+"""
+import asyncio
+import logging
+import threading
+
+
+#######################
+# ASYNC_SERIAL_SOURCE #
+#######################
+class AsyncSerialSource:
+    """!
+    @brief Asynchronous iterable over the chunks of bytes received on a serial port.
+    """
+
+    def __init__(self, port_name, baudrate=9600, timeout=0.1, metrics=None):
+        """!
+        @param timeout read timeout of the executor fallback only, in seconds.
+        @param metrics MetricsRegistry receiving the bytes waiting in the port buffer ('serial_backlog')
+            and the chunks waiting to be processed ('read_queue').
+        """
+        self.port_name = port_name
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.metrics = metrics
+        self.port = None
+        self.closing = False
+        self._loop = None
+        self._queue = None
+        self._fd = None
+
+    def open(self):
+        """!
+        @brief Open the serial port (raises serial.SerialException on failure).
+        """
+        import serial
+
+        self.closing = False
+        # non-blocking: the event loop tells when there is something to read
+        self.port = serial.Serial(port=self.port_name, baudrate=self.baudrate,
+                                  write_timeout=0, timeout=0)
+        return self.port.is_open
+
+    def close(self):
+        """!
+        @brief Close the port and end the iteration, from any thread.
+        """
+        self.closing = True
+        loop = self._loop
+        if loop is not None and loop.is_running() and not self._in_loop():
+            loop.call_soon_threadsafe(self._close)
+        else:
+            self._close()
+
+    def __aiter__(self):
+        return self.chunks()
+
+    async def chunks(self):
+        """!
+        @brief Asynchronous generator of the chunks of bytes, until the port is closed.
+        """
+        self._loop = asyncio.get_running_loop()
+        if self.port is None or not self.port.is_open:
+            self.open()
+        self._queue = asyncio.Queue()
+        try:
+            self._fd = self.port.fileno()
+            self._loop.add_reader(self._fd, self._readable)
+        except (AttributeError, NotImplementedError):
+            self._fd = None
+
+        if self._fd is None:
+            async for data in self._executor_chunks():
+                yield data
+            return
+
+        try:
+            while True:
+                data = await self._queue.get()
+                if data is None:
+                    return
+                if isinstance(data, Exception):
+                    raise data
+                yield data
+        finally:
+            self._remove_reader()
+
+    async def _executor_chunks(self):
+        import serial
+
+        self.port.timeout = self.timeout
+        while self.port.is_open and not self.closing:
+            try:
+                data = await self._loop.run_in_executor(None, self._blocking_read)
+            except (serial.SerialException, OSError, TypeError):
+                if self.closing:
+                    return
+                raise
+            if data:
+                yield data
+
+    def _blocking_read(self):
+        return self.port.read(self.port.in_waiting or 1)
+
+    def _readable(self):
+        import serial
+
+        try:
+            waiting = self.port.in_waiting
+            data = self.port.read(waiting or 1)
+        except (serial.SerialException, OSError, TypeError) as error:
+            # a device that reports readiness without data has been unplugged
+            self._remove_reader()
+            self._queue.put_nowait(None if self.closing else error)
+            return
+        if data:
+            self._queue.put_nowait(data)
+            if self.metrics is not None:
+                self.metrics.gauge('serial_backlog', waiting)
+                self.metrics.gauge('read_queue', self._queue.qsize())
+
+    def _remove_reader(self):
+        if self._fd is not None and self._loop is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+
+    def _close(self):
+        self._remove_reader()
+        if self.port is not None:
+            self.port.close()
+        if self._queue is not None:
+            self._queue.put_nowait(None)
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+
+###############
+# SERIAL_LOOP #
+###############
+class SerialLoop:
+    """!
+    @brief An asyncio event loop in one background thread, running the readers of any number of ports.
+    """
+
+    def __init__(self, name="SerialLoop"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def thread_id(self):
+        """!
+        @brief Identifier of the thread of the loop (None if not running), e.g. to measure its CPU time.
+        """
+        return self._thread.ident if self.running else None
+
+    def start(self):
+        if self.running:
+            return
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,), name=self.name, daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def submit(self, coroutine):
+        """!
+        @brief Run a coroutine on the loop, from any thread.
+
+        @return a concurrent.futures.Future with its result.
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self, timeout=1.0):
+        """!
+        @brief Cancel the readers still running and stop the thread.
+        """
+        if not self.running:
+            return
+        self.loop.call_soon_threadsafe(self._cancel)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(self.loop)
+            if tasks:
+                self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+            logging.info("{} stopped".format(self.name))
+
+    def _cancel(self):
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+        self.loop.stop()
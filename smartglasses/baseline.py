@@ -0,0 +1,124 @@
+"""!
+@brief Baseline of each channel that follows the slow drift of the capacitance at rest.
+
+The calibration averages the first 50 samples into a fixed baseline, but
+the capacitance at rest drifts with the skin contact and the temperature
+of the electrodes. BaselineTracker starts from that baseline and moves
+it towards every sample taken at rest with an exponential moving average
+(O(1) per sample). As soon as a channel departs from the baseline by
+more than the expression threshold, the baseline is frozen, and it stays
+frozen for a short hold time after the signal comes back, so a held
+expression never leaks into it. If the signal settles away from the
+baseline for much longer than any expression is held (e.g. the glasses
+were moved), that level is taken as the new baseline.
+"""
+import numpy as np
+
+# Time constant of the tracking at rest, in samples (10 s at 10 Hz): lags a drift
+# of 0.1 pF/min by less than 0.02 pF
+TRACKING_SAMPLES = 100
+# Departure from the baseline on any channel, in pF, taken as an expression
+# (noise is ~0.005 pF, the expression templates move a channel by 0.3 pF or more)
+EXPRESSION_THRESHOLD = 0.1
+# Samples the baseline stays frozen after the signal comes back within the threshold (1 s)
+HOLD_SAMPLES = 10
+# Samples the signal must stay steady away from the baseline to become the new baseline (60 s, None = never)
+REBASE_SAMPLES = 600
+# Time constant of the short-term level used to tell a steady signal, in samples
+LEVEL_SAMPLES = 10
+# The baseline is given with 2 decimals, like the calibration and the values sent by the PSoC
+BASELINE_DECIMALS = 2
+
+
+####################
+# BASELINE_TRACKER #
+####################
+class BaselineTracker:
+    """!
+    @brief Per-channel baseline tracking the drift at rest and frozen during expressions.
+    """
+
+    def __init__(self, means=None, tracking_samples=TRACKING_SAMPLES, threshold=EXPRESSION_THRESHOLD,
+                 hold_samples=HOLD_SAMPLES, rebase_samples=REBASE_SAMPLES):
+        """!
+        @param means starting baseline (e.g. the calibration means), None to set it later with reset().
+        @param tracking_samples time constant of the tracking at rest, in samples.
+        @param threshold departure from the baseline on any channel, in pF, that freezes the baseline.
+        @param hold_samples samples the baseline stays frozen after the signal comes back.
+        @param rebase_samples samples of steady signal away from the baseline before it becomes the new
+            baseline (None to keep the baseline frozen until the signal comes back).
+        """
+        self.alpha = 1.0 / tracking_samples
+        self.threshold = threshold
+        self.hold_samples = hold_samples
+        self.rebase_samples = rebase_samples
+        self.rebases = 0
+        self.reset(means)
+
+    @property
+    def ready(self):
+        return self._baseline is not None
+
+    @property
+    def means(self):
+        """!
+        @brief Current baseline of each channel, rounded to BASELINE_DECIMALS (None before reset()).
+        """
+        return self._means
+
+    def reset(self, means):
+        """!
+        @brief Start again from a new baseline (e.g. after a calibration).
+        """
+        self.frozen = False
+        self._hold = 0
+        self._steady = 0
+        if means is None:
+            self._baseline = None
+            self._level = None
+            self._means = None
+            return
+        self._baseline = np.array(means, dtype=float)
+        self._level = self._baseline.copy()
+        self._means = self._rounded()
+
+    def add(self, values):
+        """!
+        @brief Update the baseline with a raw sample.
+
+        @return the current baseline (see means).
+        """
+        values = np.asarray(values, dtype=float)
+        self._level += (values - self._level) / LEVEL_SAMPLES
+        if np.max(np.abs(values - self._baseline)) > self.threshold:
+            # an expression (or a new rest level): the baseline does not move
+            self.frozen = True
+            self._hold = self.hold_samples
+            self._check_rebase(values)
+            return self._means
+        self._steady = 0
+        if self._hold > 0:
+            self._hold -= 1
+            return self._means
+        self.frozen = False
+        self._baseline += self.alpha * (values - self._baseline)
+        self._means = self._rounded()
+        return self._means
+
+    def _check_rebase(self, values):
+        if self.rebase_samples is None:
+            return
+        if np.max(np.abs(values - self._level)) < self.threshold / 2:
+            self._steady = self._steady + 1
+        else:
+            self._steady = 0
+        if self._steady >= self.rebase_samples:
+            self._baseline = self._level.copy()
+            self._means = self._rounded()
+            self._steady = 0
+            self._hold = 0
+            self.frozen = False
+            self.rebases = self.rebases + 1
+
+    def _rounded(self):
+        return tuple(float(mean) for mean in np.round(self._baseline, BASELINE_DECIMALS))
@@ -0,0 +1,335 @@
+"""!
+@brief Classify many windows or feature rows at once, in chunks and over several processes.
+
+InferencePipeline classifies one window at a time as the samples arrive.
+The functions of this module take N windows (N, 4, samples) or N feature
+rows (N, 20), or an iterable of such chunks for inputs that do not fit in
+memory, and return the predicted class and the class probabilities of
+each of them with one vectorized call of the model per chunk. Chunks can
+be spread over a process pool, each worker receiving the model once.
+
+The command line scores whole recorded sessions (.sgrec), re-evaluates
+the trials of acquisition stores and feature tables (Dataset.xlsx)
+against one or more models, and reports their accuracy.
+
+Usage (from the top of the repository):
+
+    python -m smartglasses.batch "SAMPLE CODE/acquisitions" --model GUI/mlp_1.npz --model new.npz
+    python -m smartglasses.batch session.sgrec --hop 10 --output scores.csv
+"""
+import os
+import sys
+import csv
+import time
+import logging
+import argparse
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from smartglasses.features import FEATURE_NAMES, extract_features, check_feature_names, predict_rows
+from smartglasses.calibration import Calibrator, CALIBRATION_SAMPLES
+from smartglasses.protocol import make_decoder
+from smartglasses.recording import iter_chunks, is_recording
+from smartglasses.store import AcquisitionStore
+from smartglasses.dataset import target_name
+
+# Windows or rows classified at once
+CHUNK_ROWS = 1000
+# Samples in a window (5 s at 10 Hz, like the pipeline)
+WINDOW_SAMPLES = 50
+# Class names of the labels 0..4 of the trained models: the notebook numbers
+# the Target names in sorted order (pandas Categorical codes)
+CLASS_NAMES = ('Angry', 'Default', 'Head Down', 'Head Up', 'Smile')
+
+# labels: predicted class of each row; probabilities: (rows, classes) in the order of model.classes_
+BatchResult = namedtuple('BatchResult', ['labels', 'probabilities'])
+
+# Model of the worker processes, received once when they start
+_worker_model = None
+
+
+def feature_rows(data, ddof=0):
+    """!
+    @brief Feature rows of windows or rows.
+
+    @param data (windows, 4, samples) calibrated windows, (rows, 20) feature rows or a single (20,) row.
+    @return (rows, 20) array in the order of FEATURE_NAMES.
+    """
+    values = np.asarray(data, dtype=float)
+    if values.ndim == 3:
+        return extract_features(values, ddof=ddof)
+    if values.ndim == 1:
+        values = values.reshape(1, -1)
+    if values.ndim != 2 or values.shape[1] != len(FEATURE_NAMES):
+        raise ValueError("Expected (windows, 4, samples) windows or (rows, {}) feature rows, got the shape {}".format(
+            len(FEATURE_NAMES), np.shape(data)))
+    return values
+
+
+def predict_batch(model, data, ddof=0):
+    """!
+    @brief Classes and class probabilities of windows or feature rows, in one call of the model.
+
+    @param model fitted classifier with predict_proba() and classes_ (NumpyMLP or sklearn MLPClassifier).
+    @param data windows or feature rows (see feature_rows).
+    @return BatchResult.
+    """
+    check_feature_names(model)
+    rows = feature_rows(data, ddof)
+    classes = np.asarray(model.classes_)
+    if not len(rows):
+        return BatchResult(classes[:0], np.empty((0, len(classes))))
+    probabilities = np.asarray(predict_rows(model, rows, 'predict_proba'))
+    return BatchResult(classes[np.argmax(probabilities, axis=1)], probabilities)
+
+
+def split_chunks(data, chunk_rows=CHUNK_ROWS):
+    """!
+    @brief Iterate over consecutive slices of at most chunk_rows windows or rows of an array.
+    """
+    for start in range(0, len(data), chunk_rows):
+        yield data[start:start + chunk_rows]
+
+
+def iter_predict(model, data, chunk_rows=CHUNK_ROWS, jobs=1, ddof=0):
+    """!
+    @brief Classify windows or rows chunk by chunk, yielding one BatchResult per chunk in order.
+
+    @param data array of windows or rows (split into chunks of chunk_rows), or an iterable of such arrays.
+    @param jobs worker processes (1 = in this process, None = one per CPU). At most two chunks per
+        worker are in flight, so the iterable is read only as fast as it is classified.
+    """
+    chunks = split_chunks(data, chunk_rows) if isinstance(data, np.ndarray) else data
+    if jobs == 1:
+        for chunk in chunks:
+            yield predict_batch(model, chunk, ddof)
+        return
+
+    check_feature_names(model)
+    workers = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model,)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_predict_chunk, chunk, ddof))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def predict_all(model, data, chunk_rows=CHUNK_ROWS, jobs=1, ddof=0):
+    """!
+    @brief Classify all the windows or rows of an array or iterable of chunks (see iter_predict).
+
+    @return BatchResult of all the rows.
+    """
+    results = list(iter_predict(model, data, chunk_rows, jobs, ddof))
+    if not results:
+        return predict_batch(model, np.empty((0, len(FEATURE_NAMES))))
+    return BatchResult(np.concatenate([result.labels for result in results]),
+                       np.concatenate([result.probabilities for result in results]))
+
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+
+def _predict_chunk(chunk, ddof):
+    return predict_batch(_worker_model, chunk, ddof)
+
+
+def class_codes(names, classes=CLASS_NAMES):
+    """!
+    @brief Labels of the trained models of class names ('Head-down' or 'Head Down' -> 2).
+
+    Raises ValueError naming the names that are not classes of the models.
+    """
+    index = {name: code for code, name in enumerate(classes)}
+    names = [target_name(name) for name in names]
+    unknown = sorted(set(name for name in names if name not in index))
+    if unknown:
+        raise ValueError("Unknown classes {} (expected one of {})".format(
+            ', '.join(repr(name) for name in unknown), ', '.join(classes)))
+    return np.array([index[name] for name in names], dtype=int)
+
+
+def recording_samples(path, protocol='auto'):
+    """!
+    @brief Decode all the samples of a recording.
+
+    @return (samples, 4) raw values and the time in seconds since the start of the recording each
+        sample arrived.
+    """
+    decoder = make_decoder(protocol)
+    values = []
+    offsets = []
+    for offset, data in iter_chunks(path):
+        for frame in decoder.feed(data):
+            values.append(frame.values)
+            offsets.append(offset)
+    return np.array(values, dtype=float).reshape(-1, 4), np.array(offsets)
+
+
+def recording_windows(path, window_samples=WINDOW_SAMPLES, hop=WINDOW_SAMPLES,
+                      calibration_samples=CALIBRATION_SAMPLES, protocol='auto'):
+    """!
+    @brief Calibrated windows of a recording, like the pipeline calibrating at the start of the session.
+
+    The first calibration_samples samples give the baseline; windows of window_samples samples start
+    every hop samples after them.
+    @return (windows, 4, window_samples) array (a view of the samples) and the time of the last sample
+        of each window since the start of the recording.
+    """
+    values, offsets = recording_samples(path, protocol)
+    calibrator = Calibrator(calibration_samples)
+    for sample in values[:calibration_samples]:
+        calibrator.add(sample)
+    if not calibrator.done:
+        raise ValueError("{} holds {} samples, fewer than the {} of the calibration".format(
+            path, len(values), calibration_samples))
+    calibrated = values[calibration_samples:] - np.asarray(calibrator.means)
+    if len(calibrated) < window_samples:
+        return np.empty((0, 4, window_samples)), np.empty(0)
+    # (windows, samples, channels) -> (windows, channels, samples), without copying the samples
+    windows = np.lib.stride_tricks.sliding_window_view(calibrated, window_samples, axis=0)[::hop]
+    ends = offsets[calibration_samples + window_samples - 1::hop][:len(windows)]
+    return windows, ends
+
+
+def table_chunks(path, chunk_rows=CHUNK_ROWS):
+    """!
+    @brief Iterate over the feature rows and Target names of a table written by smartglasses.dataset.
+
+    @return (rows, 20) arrays and the Target of each row, chunk_rows rows at a time.
+    """
+    import pandas as pd
+
+    if path.lower().endswith('.csv'):
+        frames = pd.read_csv(path, index_col=0, chunksize=chunk_rows)
+    else:
+        # Excel files cannot be read in chunks, they are split after reading
+        frames = split_chunks(pd.read_excel(path, index_col=0), chunk_rows)
+    for frame in frames:
+        yield frame[list(FEATURE_NAMES)].to_numpy(dtype=float), frame['Target'].to_numpy()
+
+
+def accuracy_report(targets, labels, classes=CLASS_NAMES):
+    """!
+    @brief Accuracy over all the rows and per class.
+
+    @param targets expected labels (codes of classes).
+    @param labels predicted labels.
+    @return dict with the rows, the overall accuracy and {class name: (rows, accuracy)}.
+    """
+    targets = np.asarray(targets)
+    correct = targets == np.asarray(labels)
+    per_class = {}
+    for code, name in enumerate(classes):
+        selected = targets == code
+        if selected.any():
+            per_class[name] = (int(selected.sum()), float(correct[selected].mean()))
+    return {'rows': len(targets), 'accuracy': float(correct.mean()) if len(targets) else 0.0, 'classes': per_class}
+
+
+def _class_code(value):
+    # the tables hold the class codes (after the notebook renames Target_Num) or the class names
+    if isinstance(value, str):
+        return class_codes([value])[0]
+    return int(value)
+
+
+def labelled_chunks(path, chunk_rows=CHUNK_ROWS, subjects=None):
+    """!
+    @brief Iterate over the windows or rows of an acquisition store or a feature table and their expected labels.
+
+    @param subjects keep only the trials of these subjects (stores only; None = all).
+    @return (windows or rows, labels) arrays of at most chunk_rows rows.
+    """
+    if AcquisitionStore.exists(path):
+        windows, names = AcquisitionStore(path).windows(subject=subjects)
+        targets = class_codes(names)
+        for start in range(0, len(windows), chunk_rows):
+            yield windows[start:start + chunk_rows], targets[start:start + chunk_rows]
+    else:
+        for rows, values in table_chunks(path, chunk_rows):
+            yield rows, np.array([_class_code(value) for value in values], dtype=int)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify recordings, acquisition stores and feature tables in batch.")
+    parser.add_argument('inputs', nargs='+',
+                        help=".sgrec recordings, folders holding acquisition stores, or feature tables (.csv, .xlsx)")
+    parser.add_argument('--model', action='append', default=None,
+                        help="trained classifier (.npz export or sklearn pickle), repeatable (default GUI/mlp_1.npz)")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default one per CPU, 1 = no pool)")
+    parser.add_argument('--chunk', type=int, default=CHUNK_ROWS, help="windows classified at once")
+    parser.add_argument('--hop', type=int, default=WINDOW_SAMPLES, help="samples between two windows of a recording")
+    parser.add_argument('--protocol', choices=('ascii', 'binary', 'auto'), default='auto')
+    parser.add_argument('--subject', action='append', default=None, help="keep only this subject of the stores (repeatable)")
+    parser.add_argument('--output', default=None, help="write the class and probabilities of each recording window to this CSV")
+    args = parser.parse_args(argv)
+
+    from smartglasses.model_manager import default_loader
+
+    logging.basicConfig(level=logging.INFO)
+    models = {}
+    for path in args.model or ['GUI/mlp_1.npz']:
+        with open(path, 'rb') as file:
+            models[path] = default_loader(path)(file)
+
+    writer = None
+    if args.output:
+        output = open(args.output, 'w', newline='')
+        writer = csv.writer(output)
+        writer.writerow(['input', 'model', 'end', 'label', 'class']
+                        + ['p_{}'.format(name) for name in CLASS_NAMES])
+
+    for path in args.inputs:
+        if is_recording(path):
+            windows, ends = recording_windows(path, hop=args.hop, protocol=args.protocol)
+            for model_path, model in models.items():
+                start = time.perf_counter()
+                result = predict_all(model, windows, args.chunk, args.jobs)
+                elapsed = time.perf_counter() - start
+                counts = {CLASS_NAMES[label]: int(count) for label, count in zip(*np.unique(result.labels, return_counts=True))}
+                logging.info("{} with {}: {} windows in {:.2f} s, {}".format(path, model_path, len(windows), elapsed, counts))
+                if writer is not None:
+                    for end, label, probabilities in zip(ends, result.labels, result.probabilities):
+                        writer.writerow([path, model_path, '{:.3f}'.format(end), label, CLASS_NAMES[label]]
+                                        + ['{:.6f}'.format(p) for p in probabilities])
+            continue
+
+        if not (AcquisitionStore.exists(path) or os.path.isfile(path)):
+            logging.warning("Skipping {}: not a recording, an acquisition store or a feature table".format(path))
+            continue
+        for model_path, model in models.items():
+            targets = []
+
+            def chunks():
+                for data, expected in labelled_chunks(path, args.chunk, args.subject):
+                    targets.append(expected)
+                    yield data
+
+            start = time.perf_counter()
+            try:
+                result = predict_all(model, chunks(), args.chunk, args.jobs)
+            except ValueError as error:
+                # e.g. trials of a class the models do not know: the other inputs are still classified
+                logging.error("Skipping {}: {}".format(path, error))
+                break
+            elapsed = time.perf_counter() - start
+            report = accuracy_report(np.concatenate(targets) if targets else [], result.labels)
+            logging.info("{} with {}: accuracy {:.1%} on {} windows in {:.2f} s ({})".format(
+                path, model_path, report['accuracy'], report['rows'], elapsed,
+                ", ".join("{} {:.1%}".format(name, accuracy) for name, (_, accuracy) in report['classes'].items())))
+
+    if writer is not None:
+        output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import numpy as np
+
+# Samples averaged by the calibration step (5 s at 10 Hz), the most with a tolerance
+CALIBRATION_SAMPLES = 50
+# Samples collected at least before a calibration with a tolerance can stop (1 s at 10 Hz)
+CALIBRATION_MIN_SAMPLES = 10
+# Half-width of the confidence interval of each mean that stops the calibration, in pF
+# (half the 0.01 pF resolution of the values sent by the PSoC)
+CALIBRATION_TOLERANCE = 0.005
+# Normal quantile of the confidence interval (95 %)
+CONFIDENCE_Z = 1.96
+
+
+##############
+# CALIBRATOR #
+##############
+class Calibrator:
+    """!
+    @brief Average the first samples acquired at rest into the per-channel baseline.
+
+    The baseline is rounded to 2 decimals, like the values sent by the PSoC.
+    The variance of each channel at rest is kept with it (e.g. to save a
+    calibration profile).
+
+    With a tolerance, the mean and variance of each channel are updated at
+    every sample (Welford) and the calibration stops as soon as the
+    confidence interval of every mean is narrower than the tolerance, after
+    min_samples and at the latest after samples. A quiet signal is then
+    calibrated in about 1 s instead of 5 s; a user moving keeps the variance
+    high, so the calibration runs longer.
+    """
+
+    def __init__(self, samples=CALIBRATION_SAMPLES, channels=4, tolerance=None, min_samples=CALIBRATION_MIN_SAMPLES):
+        """!
+        @param samples samples averaged (the most with a tolerance).
+        @param tolerance half-width of the 95 % confidence interval of each mean that ends the
+            calibration, in pF (None to always average samples).
+        @param min_samples samples collected at least before stopping early.
+        """
+        self.samples = samples
+        self.channels = channels
+        self.tolerance = tolerance
+        self.min_samples = min(min_samples, samples)
+        self._values = np.zeros((samples, channels))
+        self._mean = np.zeros(channels)
+        self._m2 = np.zeros(channels)
+        self.count = 0
+        self.means = None
+        self.variances = None
+        self.restored = False
+
+    @property
+    def done(self):
+        return self.means is not None
+
+    @property
+    def saved(self):
+        """!
+        @brief Samples the calibration did not need compared with a fixed calibration of samples.
+        """
+        return self.samples - self.count if self.done else 0
+
+    def interval(self):
+        """!
+        @brief Half-width of the 95 % confidence interval of the mean of each channel, in pF.
+        """
+        if self.count < 2:
+            return np.full(self.channels, np.inf)
+        return CONFIDENCE_Z * np.sqrt(self._m2 / (self.count - 1) / self.count)
+
+    def reset(self):
+        """!
+        @brief Forget the collected samples and the baseline.
+        """
+        self.count = 0
+        self._mean[:] = 0.0
+        self._m2[:] = 0.0
+        self.means = None
+        self.variances = None
+        self.restored = False
+
+    def restore(self, means, variances=None):
+        """!
+        @brief Use a baseline obtained otherwise (e.g. a saved profile) without collecting samples.
+        """
+        self.count = self.samples
+        self.means = tuple(float(mean) for mean in means)
+        self.variances = None if variances is None else tuple(float(variance) for variance in variances)
+        self.restored = True
+
+    def add(self, values):
+        """!
+        @brief Add a raw sample.
+
+        @return True when the sample completes the calibration.
+        """
+        if self.done:
+            return False
+        self._values[self.count] = values
+        self.count = self.count + 1
+        if self.tolerance is not None:
+            delta = self._values[self.count - 1] - self._mean
+            self._mean += delta / self.count
+            self._m2 += delta * (self._values[self.count - 1] - self._mean)
+        if self.count >= self.samples or self._stable():
+            values = self._values[:self.count]
+            self.means = tuple(float(mean) for mean in np.round(values.mean(axis=0), decimals=2))
+            self.variances = tuple(float(variance) for variance in values.var(axis=0))
+            return True
+        return False
+
+    def _stable(self):
+        if self.tolerance is None or self.count < self.min_samples:
+            return False
+        return bool(np.all(self.interval() <= self.tolerance))
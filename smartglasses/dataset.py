@@ -0,0 +1,211 @@
+"""!
+@brief Build the training feature table from the acquisition files.
+
+Acquisitions are stored one file per class and channel, named
+"<Class> <Channel>.<ext>" (e.g. "Smile/Smile Left.xlsx", or the
+"Default Left.csv" written by the acquisition code), with one window of
+calibrated samples per row. The builder finds every complete set of four
+channel files under the given folders, extracts the 20 features of each
+window with the code used by the GUI, in parallel over a process pool and
+in chunks of rows, and writes one table with the columns of
+Dataset.xlsx (FEATURE_NAMES and Target). Folders holding an acquisition
+store (smartglasses.store) are read from the store instead, optionally
+keeping only some subjects.
+
+Usage (from the top of the repository):
+
+    python -m smartglasses.dataset "MACHINE LEARNING" --output "MACHINE LEARNING/Dataset.xlsx"
+"""
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from smartglasses.features import CHANNEL_NAMES, FEATURE_NAMES, extract_features
+from smartglasses.store import AcquisitionStore
+
+# Extensions of the acquisition files
+EXTENSIONS = ('.csv', '.xlsx', '.xls')
+# Windows read and processed at once by a worker
+CHUNK_ROWS = 1000
+# The training notebook computes the variance with pandas (ddof=1)
+DATASET_DDOF = 1
+
+_FILE_NAME = re.compile(r'^(?P<label>.+?)[ _](?P<channel>{})$'.format('|'.join(CHANNEL_NAMES)), re.IGNORECASE)
+
+Acquisition = namedtuple('Acquisition', ['label', 'files'])
+
+
+def target_name(label):
+    """!
+    @brief Class name used in the Target column ('Head-down' -> 'Head Down', like the notebook).
+    """
+    return ' '.join(word.capitalize() for word in re.split(r'[-_ ]+', label.strip()))
+
+
+def find_acquisitions(roots):
+    """!
+    @brief Find the sets of four channel files of each class.
+
+    Files of the same class in different folders (e.g. two acquisition
+    campaigns) are separate acquisitions. Incomplete sets are skipped
+    with a warning.
+    @return list of Acquisition with the files in the PSoC channel order, sorted by class and folder.
+    """
+    groups = {}
+    for root in roots:
+        for folder, _, names in os.walk(root):
+            if AcquisitionStore.exists(folder):
+                continue
+            for name in names:
+                stem, extension = os.path.splitext(name)
+                match = _FILE_NAME.match(stem)
+                if extension.lower() not in EXTENSIONS or match is None or name.startswith('~$'):
+                    continue
+                label = target_name(match.group('label'))
+                channel = match.group('channel').capitalize()
+                groups.setdefault((label, folder), {})[channel] = os.path.join(folder, name)
+
+    acquisitions = []
+    for (label, folder), files in sorted(groups.items()):
+        missing = [channel for channel in CHANNEL_NAMES if channel not in files]
+        if missing:
+            logging.warning("Skipping {} in {}: no file for {}".format(label, folder, ', '.join(missing)))
+            continue
+        acquisitions.append(Acquisition(label, tuple(files[channel] for channel in CHANNEL_NAMES)))
+    return acquisitions
+
+
+def read_windows(path, chunk_rows=CHUNK_ROWS):
+    """!
+    @brief Iterate over the windows of a file in arrays of at most chunk_rows rows.
+
+    CSV files are read as written by the acquisition code (no header);
+    Excel files as read by the notebook (first row is the header).
+    """
+    import pandas as pd
+
+    if path.lower().endswith('.csv'):
+        for chunk in pd.read_csv(path, header=None, chunksize=chunk_rows):
+            yield chunk.to_numpy(dtype=float)
+    else:
+        # Excel files cannot be read in chunks, they are split after reading
+        values = pd.read_excel(path).to_numpy(dtype=float)
+        for start in range(0, len(values), chunk_rows):
+            yield values[start:start + chunk_rows]
+
+
+def acquisition_features(acquisition, chunk_rows=CHUNK_ROWS, ddof=DATASET_DDOF):
+    """!
+    @brief Features of all the windows of an acquisition.
+
+    @return (windows, 20) array in the order of FEATURE_NAMES.
+    """
+    rows = []
+    readers = [read_windows(path, chunk_rows) for path in acquisition.files]
+    for chunks in zip(*readers):
+        if len({len(chunk) for chunk in chunks}) != 1 or len({chunk.shape[1] for chunk in chunks}) != 1:
+            raise ValueError("The channel files of {} have different shapes".format(acquisition.files[0]))
+        # (channels, windows, samples) -> (windows, channels, samples)
+        rows.append(extract_features(np.stack(chunks, axis=1), ddof=ddof))
+    # zip stops at the shortest file: any chunk left means different lengths
+    if any(next(reader, None) is not None for reader in readers):
+        raise ValueError("The channel files of {} have a different number of windows".format(acquisition.files[0]))
+    return np.concatenate(rows) if rows else np.empty((0, len(FEATURE_NAMES)))
+
+
+def find_stores(roots):
+    """!
+    @brief Folders under roots holding an acquisition store.
+    """
+    return sorted(folder for root in roots for folder, _, _ in os.walk(root) if AcquisitionStore.exists(folder))
+
+
+def store_features(path, subjects=None, chunk_rows=CHUNK_ROWS, ddof=DATASET_DDOF):
+    """!
+    @brief Features and class names of the trials of a store, one class at a time.
+
+    @param subjects keep only the trials of these subjects (None = all).
+    """
+    store = AcquisitionStore(path)
+    for label in store.labels():
+        windows, _ = store.windows(label=label, subject=subjects)
+        if not len(windows):
+            continue
+        rows = np.concatenate([extract_features(windows[start:start + chunk_rows], ddof=ddof)
+                               for start in range(0, len(windows), chunk_rows)])
+        yield target_name(label), rows
+
+
+def build_dataset(roots, jobs=None, chunk_rows=CHUNK_ROWS, ddof=DATASET_DDOF, subjects=None):
+    """!
+    @brief Feature table of all the acquisitions found under roots.
+
+    @param jobs worker processes (None = one per CPU, 1 = no pool).
+    @param subjects keep only the trials of these subjects (stores only; None = all).
+    @return DataFrame with the FEATURE_NAMES columns and the Target class name.
+    """
+    import pandas as pd
+
+    acquisitions = find_acquisitions(roots)
+    if jobs == 1 or len(acquisitions) < 2:
+        features = [acquisition_features(acquisition, chunk_rows, ddof) for acquisition in acquisitions]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            features = list(executor.map(acquisition_features, acquisitions,
+                                         [chunk_rows] * len(acquisitions), [ddof] * len(acquisitions)))
+
+    frames = []
+    for acquisition, rows in zip(acquisitions, features):
+        frame = pd.DataFrame(rows, columns=list(FEATURE_NAMES))
+        frame['Target'] = acquisition.label
+        frames.append(frame)
+        logging.info("{}: {} windows from {}".format(acquisition.label, len(rows), os.path.dirname(acquisition.files[0])))
+    for path in find_stores(roots):
+        for label, rows in store_features(path, subjects, chunk_rows, ddof):
+            frame = pd.DataFrame(rows, columns=list(FEATURE_NAMES))
+            frame['Target'] = label
+            frames.append(frame)
+            logging.info("{}: {} windows from the store {}".format(label, len(rows), path))
+    if not frames:
+        return pd.DataFrame(columns=list(FEATURE_NAMES) + ['Target'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_dataset(dataset, path):
+    """!
+    @brief Write the table like the notebook does (with the index as first column).
+    """
+    if path.lower().endswith('.csv'):
+        dataset.to_csv(path)
+    else:
+        dataset.to_excel(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the feature table from the acquisition files.")
+    parser.add_argument('roots', nargs='+', help="folders searched for '<Class> <Channel>' files")
+    parser.add_argument('--output', default='Dataset.xlsx', help="feature table (.xlsx or .csv)")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default one per CPU)")
+    parser.add_argument('--chunk', type=int, default=CHUNK_ROWS, help="windows processed at once by a worker")
+    parser.add_argument('--ddof', type=int, default=DATASET_DDOF, help="delta degrees of freedom of the variance")
+    parser.add_argument('--subject', action='append', default=None, help="keep only this subject of the stores (repeatable)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    dataset = build_dataset(args.roots, args.jobs, args.chunk, args.ddof, args.subject)
+    write_dataset(dataset, args.output)
+    logging.info("Wrote {} windows of {} classes to {} in {:.2f} s".format(
+        len(dataset), dataset['Target'].nunique(), args.output, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
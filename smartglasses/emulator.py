@@ -0,0 +1,288 @@
+"""!
+@brief Software emulator of the smart glasses (PSoC + FDC1004) on a pseudo-terminal.
+
+The emulator opens a Linux pty and writes exactly what the firmware sends
+over the UART: the boot banner and the I2C scan printed by main.c, the
+register dump, and then one frame per timer interrupt as printed by
+Custom_ISR_TIMER (or the binary frame when the binary protocol is used).
+
+Usage (from the top of the repository):
+
+    python -m smartglasses.emulator --rate 10 --pattern idle:5,smile:5 --link /tmp/ttyGLASSES
+
+then connect the GUI to the printed device path (or to the link).
+"""
+import os
+import sys
+import tty
+import time
+import random
+import logging
+import argparse
+import threading
+
+from smartglasses.protocol import (
+    PROTOCOLS,
+    RAW_SCALE,
+    CAPDAC_FACTOR,
+    DEFAULT_CAPDAC,
+    encode_ascii_frame,
+    encode_binary_frame
+)
+
+# Average offset from the calibration baseline of each expression in the
+# training dataset, in the firmware channel order (Right, Left, Center, Eyebrow)
+TEMPLATES = {
+    'idle':      (0.00, 0.00, 0.00, 0.00),
+    'smile':     (0.53, -0.26, 0.30, 0.06),
+    'angry':     (-0.01, -0.02, 0.69, 0.03),
+    'head-up':   (0.16, 0.61, 0.71, 0.11),
+    'head-down': (-0.10, -0.59, -0.16, -0.06),
+}
+
+DEFAULT_BASELINE = (3.25, 3.10, 2.95, 3.40)
+
+FDC1004Q_I2C_ADDR = 0x50
+
+# Registers printed by main.c after Setup_Channels (CONF_MEAS1..4, FDC_CONF and gains)
+REGISTER_DUMP = {
+    0x08: 0x1000, 0x09: 0x3000, 0x0A: 0x5000, 0x0B: 0x7000,
+    0x0C: 0x01F0,
+    0x11: 0x4000, 0x12: 0x4000, 0x13: 0x4000, 0x14: 0x4000,
+}
+
+
+def boot_banner():
+    """!
+    @brief Text printed by main.c before the timer interrupt is started.
+    """
+    message = "FDC1004Q found @ address 0xFF\r\n"
+    message += "**************\r\n"
+    message += "** I2C Scan **\r\n"
+    message += "**************\r\n"
+    message += "\n\n   "
+    message += ''.join("%02X " % i for i in range(0x10))
+    for i2caddress in range(0x80):
+        if i2caddress % 0x10 == 0:
+            message += "\n%02X " % i2caddress
+        message += "%02X " % i2caddress if i2caddress == FDC1004Q_I2C_ADDR else "-- "
+    message += "\n\n"
+    for reg in range(0x15):
+        message += "0x%02X: 0x%04x\n" % (reg, REGISTER_DUMP.get(reg, 0))
+    return message.encode()
+
+
+def parse_pattern(text):
+    """!
+    @brief Parse a schedule like "idle:5,smile:3" into (template, seconds) pairs.
+    """
+    schedule = []
+    for item in text.split(','):
+        name, _, seconds = item.partition(':')
+        name = name.strip()
+        if name not in TEMPLATES:
+            raise ValueError("Unknown template {!r}, expected one of {}".format(name, sorted(TEMPLATES)))
+        schedule.append((name, float(seconds) if seconds else 5.0))
+    return schedule
+
+
+############
+# EMULATOR #
+############
+class GlassesEmulator:
+    """!
+    @brief Generate the capacitance stream of the glasses and write it to a file descriptor.
+    """
+
+    def __init__(self, rate=10.0, pattern='idle:5', noise=0.005, baseline=DEFAULT_BASELINE,
+                 transition=0.3, dropout=0.0, malformed=0.0, protocol='ascii', banner=True,
+                 seed=None, capdac=DEFAULT_CAPDAC, record_times=False, drift=0.0):
+        """!
+        @param rate frames per second (the firmware timer runs at 10 Hz).
+        @param pattern schedule of templates, repeated forever (see parse_pattern).
+        @param noise standard deviation of the gaussian noise added to each channel, in pF.
+        @param baseline capacitance of each channel at rest, in pF.
+        @param transition time constant in seconds of the change between two templates.
+        @param dropout probability that a frame is not sent.
+        @param malformed probability that a frame is sent damaged.
+        @param protocol 'ascii' (SOS/EOS text frames) or 'binary'.
+        @param banner send the boot banner and I2C scan first.
+        @param seed seed of the random generator, for repeatable streams.
+        @param capdac CAPDAC setting of each channel, used to build binary frames.
+        @param record_times keep the monotonic time at which each frame was written, for latency measurements.
+        @param drift change of the rest capacitance of every channel, in pF per minute (skin contact, temperature).
+        """
+        if protocol not in PROTOCOLS or protocol == 'auto':
+            raise ValueError("protocol must be 'ascii' or 'binary', got {!r}".format(protocol))
+        self.rate = rate
+        self.schedule = parse_pattern(pattern) if isinstance(pattern, str) else list(pattern)
+        self.noise = noise
+        self.baseline = tuple(baseline)
+        self.transition = transition
+        self.dropout = dropout
+        self.malformed = malformed
+        self.protocol = protocol
+        self.banner = banner
+        self.capdac = tuple(capdac)
+        self.random = random.Random(seed)
+        self.record_times = record_times
+        self.drift = drift
+
+        self.seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self.damaged = 0
+        self.send_times = {}
+        self._level = [0.0, 0.0, 0.0, 0.0]
+        self._stop = threading.Event()
+
+    def template_at(self, t):
+        """!
+        @brief Name of the template active at time t since the start of the stream.
+        """
+        period = sum(seconds for _, seconds in self.schedule)
+        t = t % period
+        for name, seconds in self.schedule:
+            if t < seconds:
+                return name
+            t -= seconds
+        return self.schedule[-1][0]
+
+    def next_values(self, t):
+        """!
+        @brief Capacitance values of the four channels at time t, in pF.
+        """
+        target = TEMPLATES[self.template_at(t)]
+        alpha = 1.0 if self.transition <= 0 else min(1.0, 1.0 / (self.rate * self.transition))
+        drift = self.drift * t / 60.0
+        values = []
+        for ch in range(4):
+            self._level[ch] += alpha * (target[ch] - self._level[ch])
+            values.append(self.baseline[ch] + drift + self._level[ch] + self.random.gauss(0.0, self.noise))
+        return values
+
+    def encode(self, values):
+        """!
+        @brief Frame carrying the given values in the configured protocol.
+        """
+        if self.protocol == 'binary':
+            raw = [int(round((v - self.capdac[ch] * CAPDAC_FACTOR) * RAW_SCALE)) for ch, v in enumerate(values)]
+            return encode_binary_frame(self.seq, raw)
+        return encode_ascii_frame(values)
+
+    def damage(self, frame):
+        """!
+        @brief Corrupt a frame the way a noisy link would (truncation or flipped bytes).
+        """
+        if self.random.random() < 0.5:
+            return frame[:self.random.randrange(1, len(frame))]
+        frame = bytearray(frame)
+        pos = self.random.randrange(len(frame))
+        frame[pos] = frame[pos] ^ 0xFF
+        return bytes(frame)
+
+    def frames(self):
+        """!
+        @brief Infinite generator of (deadline, frame index, bytes), deadlines relative to the start.
+
+        The frame index is None for the boot banner.
+        """
+        if self.banner:
+            yield 0.0, None, boot_banner()
+        index = 0
+        while True:
+            t = index / self.rate
+            frame = self.encode(self.next_values(t))
+            index = index + 1
+            self.seq = (self.seq + 1) & 0xFFFF
+            if self.random.random() < self.dropout:
+                self.dropped = self.dropped + 1
+                continue
+            if self.random.random() < self.malformed:
+                self.damaged = self.damaged + 1
+                frame = self.damage(frame)
+            yield t, index - 1, frame
+
+    def run(self, fd, duration=None):
+        """!
+        @brief Write the stream to a file descriptor at the configured rate.
+
+        Frames are scheduled on absolute deadlines, so the rate does not
+        drift with the time spent writing.
+        @param fd file descriptor to write to (the master side of the pty).
+        @param duration stop after this many seconds (run forever if None).
+        """
+        start = time.monotonic()
+        for deadline, index, frame in self.frames():
+            if self._stop.is_set() or (duration is not None and deadline > duration):
+                break
+            delay = start + deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if self.record_times and index is not None:
+                self.send_times[index] = time.monotonic()
+            os.write(fd, frame)
+            if index is not None:
+                self.sent = self.sent + 1
+
+    def stop(self):
+        self._stop.set()
+
+
+def open_pty(link=None):
+    """!
+    @brief Open a pseudo-terminal in raw mode.
+
+    @param link optional path of a symbolic link to create to the device.
+    @return (master file descriptor, slave file descriptor, slave device path).
+    """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+    if link:
+        if os.path.islink(link):
+            os.unlink(link)
+        os.symlink(name, link)
+    return master, slave, name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emulate the smart glasses on a pseudo-terminal.")
+    parser.add_argument('--rate', type=float, default=10.0, help="frames per second (default 10)")
+    parser.add_argument('--pattern', default='idle:5', help="templates and durations, e.g. idle:5,smile:5 ({})".format(', '.join(TEMPLATES)))
+    parser.add_argument('--noise', type=float, default=0.005, help="gaussian noise in pF (default 0.005)")
+    parser.add_argument('--baseline', type=float, nargs=4, default=DEFAULT_BASELINE, help="rest capacitance of the 4 channels in pF")
+    parser.add_argument('--drift', type=float, default=0.0, help="drift of the rest capacitance in pF per minute")
+    parser.add_argument('--transition', type=float, default=0.3, help="time constant of the change between templates in s")
+    parser.add_argument('--dropout', type=float, default=0.0, help="probability of dropping a frame")
+    parser.add_argument('--malformed', type=float, default=0.0, help="probability of sending a damaged frame")
+    parser.add_argument('--protocol', choices=('ascii', 'binary'), default='ascii')
+    parser.add_argument('--no-banner', action='store_true', help="do not send the boot banner and I2C scan")
+    parser.add_argument('--duration', type=float, default=None, help="stop after this many seconds")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--link', default=None, help="create a symbolic link to the pty device")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    emulator = GlassesEmulator(rate=args.rate, pattern=args.pattern, noise=args.noise,
+                               baseline=args.baseline, transition=args.transition, drift=args.drift,
+                               dropout=args.dropout, malformed=args.malformed,
+                               protocol=args.protocol, banner=not args.no_banner, seed=args.seed)
+    master, slave, name = open_pty(args.link)
+    print(name, flush=True)
+    logging.info("Emulating the glasses on {} at {} Hz".format(args.link or name, args.rate))
+    try:
+        emulator.run(master, args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info("Sent {} frames ({} dropped, {} damaged)".format(emulator.sent, emulator.dropped, emulator.damaged))
+        os.close(master)
+        os.close(slave)
+        if args.link and os.path.islink(args.link):
+            os.unlink(args.link)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import warnings
+
+import numpy as np
+
+# Channels in the order they are sent by the PSoC (cap1..cap4)
+CHANNEL_NAMES = ('Right', 'Left', 'Center', 'Eyebrow')
+
+# Channels and statistics in the order of the columns the model was trained on
+FEATURE_CHANNELS = ('Left', 'Center', 'Right', 'Eyebrow')
+FEATURE_STATS = ('Mean', 'Var', 'Mode', 'Max', 'Min')
+FEATURE_NAMES = tuple('{}_{}'.format(stat, channel) for channel in FEATURE_CHANNELS for stat in FEATURE_STATS)
+
+# Position in the PSoC order of each channel in the feature order
+_CHANNEL_ORDER = [CHANNEL_NAMES.index(channel) for channel in FEATURE_CHANNELS]
+
+# The PSoC sends 2 decimals: the mode is taken over values rounded to 2 decimals
+MODE_DECIMALS = 2
+
+
+def window_mode(windows, decimals=MODE_DECIMALS):
+    """!
+    @brief Most frequent value along the last axis, the smallest one in case of ties.
+
+    Same result as scipy.stats.mode, computed for any number of leading
+    dimensions at once.
+    @param windows array of shape (..., samples).
+    @param decimals values are rounded to this many decimals before counting (None to count exact values).
+    """
+    values = np.asarray(windows, dtype=float)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    values = np.sort(values, axis=-1)
+    samples = values.shape[-1]
+    index = np.arange(samples)
+    # length of the run of equal values ending at each position
+    run_start = np.ones(values.shape, dtype=bool)
+    run_start[..., 1:] = values[..., 1:] != values[..., :-1]
+    start = np.maximum.accumulate(np.where(run_start, index, 0), axis=-1)
+    run_length = index - start + 1
+    # the first position reaching the longest run belongs to the smallest mode
+    longest = run_length.max(axis=-1, keepdims=True)
+    position = np.argmax(run_length == longest, axis=-1)
+    return np.take_along_axis(values, position[..., None], axis=-1)[..., 0]
+
+
+def extract_features(windows, ddof=0):
+    """!
+    @brief Compute the 20 features of one or more windows of calibrated samples.
+
+    @param windows array of shape (4, samples) or (windows, 4, samples) with the
+        channels in the PSoC order (Right, Left, Center, Eyebrow).
+    @param ddof delta degrees of freedom of the variance (0 like the GUI,
+        1 like the pandas code of the training notebook).
+    @return array of shape (20,) or (windows, 20) with the columns in the order of FEATURE_NAMES.
+    """
+    windows = np.asarray(windows, dtype=float)
+    ordered = windows[..., _CHANNEL_ORDER, :]
+    features = np.stack([
+        ordered.mean(axis=-1),
+        ordered.var(axis=-1, ddof=ddof),
+        window_mode(ordered),
+        ordered.max(axis=-1),
+        ordered.min(axis=-1),
+    ], axis=-1)
+    # (..., channels, stats) -> (..., channels * stats), channel-major like FEATURE_NAMES
+    return features.reshape(features.shape[:-2] + (len(FEATURE_NAMES),))
+
+
+def window_features(window):
+    """!
+    @brief Compute the 20 features of a single window of calibrated samples.
+
+    @param window (4, samples) array with the channels in the PSoC order.
+    @return array of 20 values in the order of FEATURE_NAMES.
+    """
+    return extract_features(window)
+
+
+def check_feature_names(model):
+    """!
+    @brief Check that a fitted model expects the columns in the order of FEATURE_NAMES.
+
+    Models fitted on a DataFrame remember their column names; models fitted
+    on arrays cannot be checked and are accepted.
+    """
+    names = getattr(model, 'feature_names_in_', None)
+    if names is not None and tuple(names) != FEATURE_NAMES:
+        raise ValueError("Model expects the features {}, the GUI computes {}".format(list(names), list(FEATURE_NAMES)))
+
+
+def predict_rows(model, rows, method='predict'):
+    """!
+    @brief Call a method of a fitted model (predict or predict_proba) on plain feature rows.
+
+    The columns are checked with check_feature_names, so the sklearn warning
+    about rows without feature names is ignored, during this call only.
+    @param rows (rows, 20) array with the columns in the order of FEATURE_NAMES.
+    """
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='X does not have valid feature names')
+        return getattr(model, method)(rows)
+
+
+def features_frame(rows):
+    """!
+    @brief Wrap feature rows in a DataFrame with the column names used in training.
+    """
+    import pandas as pd
+
+    return pd.DataFrame(np.asarray(rows, dtype=float).reshape(-1, len(FEATURE_NAMES)), columns=list(FEATURE_NAMES))
@@ -0,0 +1,188 @@
+"""!
+@brief Classification in a thread of its own, fed through a bounded queue of requests.
+
+By default the pipeline classifies a window on the thread that reads the
+device, so a slow model (a large sklearn pickle, the first call after a
+reload) delays the reading of the next bytes. An InferenceWorker runs
+the model in a dedicated thread instead: the pipeline submits the
+feature rows and goes on reading, and each result is passed to a
+callback from the worker thread (the GUIs turn it into a Qt signal, so
+it reaches the interface asynchronously). The queue is bounded: when the
+model falls behind, the oldest pending request is dropped, since a newer
+window of the same stream supersedes it. Requests that became stale (new
+calibration, reset, end of continuous mode) are cancelled, and the
+result of a request cancelled while it runs is discarded.
+"""
+import time
+import logging
+import threading
+from collections import deque
+
+# Feature rows waiting for the model at most (the oldest is dropped beyond)
+INFERENCE_QUEUE = 4
+
+
+#####################
+# INFERENCE_REQUEST #
+#####################
+class InferenceRequest:
+    """!
+    @brief A feature row waiting for the model, with what its callback needs.
+    """
+
+    def __init__(self, row, callback, context=None):
+        """!
+        @param callback function called with (request, result) from the worker thread.
+        @param context anything the callback needs (e.g. the stage times of the row).
+        """
+        self.row = row
+        self.callback = callback
+        self.context = context
+        self.submitted = time.monotonic()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+####################
+# INFERENCE_WORKER #
+####################
+class InferenceWorker:
+    """!
+    @brief Thread running a prediction function on the requests of a bounded queue, oldest first.
+
+    The thread is started by the first request. Metrics (when a registry
+    is given): 'inference_queue' gauge of the requests waiting,
+    'inference_wait' timer from submission to the start of the prediction,
+    'inference_dropped', 'inference_cancelled' and 'inference_errors'
+    counters.
+    """
+
+    def __init__(self, predict, maxsize=INFERENCE_QUEUE, metrics=None, name="InferenceWorker"):
+        """!
+        @param predict function called with a feature row, from the worker thread.
+        @param maxsize requests waiting at most.
+        @param metrics MetricsRegistry receiving the queue depth, waiting time and dropped requests.
+        """
+        self.predict = predict
+        self.maxsize = maxsize
+        self.metrics = metrics
+        self.name = name
+        self._queue = deque()
+        self._running = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stop = None
+        self._wait_timer = metrics.timer('inference_wait') if metrics is not None else None
+
+    @property
+    def pending(self):
+        """!
+        @brief Requests waiting for the model.
+        """
+        return len(self._queue)
+
+    @property
+    def busy(self):
+        return self._running is not None
+
+    def submit(self, row, callback, context=None):
+        """!
+        @brief Queue a feature row, dropping the oldest request if the queue is full.
+
+        @return the InferenceRequest, which can be cancelled.
+        """
+        request = InferenceRequest(row, callback, context)
+        with self._condition:
+            if self._thread is None:
+                self._start()
+            if len(self._queue) >= self.maxsize:
+                self._queue.popleft().cancel()
+                self._count('inference_dropped')
+            self._queue.append(request)
+            self._gauge()
+            self._condition.notify()
+        return request
+
+    def cancel(self):
+        """!
+        @brief Cancel the requests waiting and the one running, from any thread.
+
+        @return the number of requests cancelled.
+        """
+        with self._condition:
+            requests = list(self._queue)
+            self._queue.clear()
+            if self._running is not None:
+                requests.append(self._running)
+            self._gauge()
+        for request in requests:
+            request.cancel()
+        if requests:
+            self._count('inference_cancelled', len(requests))
+        return len(requests)
+
+    def stop(self, timeout=1.0):
+        """!
+        @brief Cancel the requests and stop the thread (a new request starts it again).
+        """
+        self.cancel()
+        with self._condition:
+            thread = self._thread
+            if thread is not None:
+                self._stop.set()
+                self._thread = None
+                self._condition.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def summary(self):
+        """!
+        @brief One-line summary for a status bar.
+        """
+        counters = self.metrics.counters if self.metrics is not None else {}
+        return "inference queue {}/{}, {} dropped, {} cancelled".format(
+            self.pending, self.maxsize, counters.get('inference_dropped', 0), counters.get('inference_cancelled', 0))
+
+    def _start(self):
+        # each thread has its own stop event, so that a thread started
+        # right after stop() does not race the one exiting
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name=self.name, daemon=True)
+        self._thread.start()
+
+    def _run(self, stop):
+        while True:
+            with self._condition:
+                while not self._queue and not stop.is_set():
+                    self._condition.wait()
+                if stop.is_set():
+                    return
+                request = self._running = self._queue.popleft()
+                self._gauge()
+            try:
+                if request.cancelled:
+                    continue
+                if self._wait_timer is not None:
+                    self._wait_timer.add(time.monotonic() - request.submitted)
+                try:
+                    result = self.predict(request.row)
+                except Exception as error:
+                    self._count('inference_errors')
+                    logging.warning("{}: prediction failed: {}".format(self.name, error))
+                    continue
+                if not request.cancelled:
+                    request.callback(request, result)
+            finally:
+                with self._condition:
+                    if self._running is request:
+                        self._running = None
+
+    def _count(self, name, value=1):
+        if self.metrics is not None:
+            self.metrics.count(name, value)
+
+    def _gauge(self):
+        if self.metrics is not None:
+            self.metrics.gauge('inference_queue', len(self._queue))
@@ -0,0 +1,198 @@
+"""!
+@brief High-rate ingest: streaming decimation to the model rate, link budget and headroom.
+
+The FDC driver of the PSoC can sample at 100, 200 or 400 Hz, while the
+classifiers were trained on the 10 Hz stream of the firmware timer. A
+Decimator brings a faster stream down to 10 Hz with a low-pass FIR
+filter (a windowed sinc), so that no fast noise aliases into the band of
+the expressions, and it works on blocks of frames: the pipeline decodes a
+whole chunk of bytes, filters the frames it contains at once and only
+processes the decimated samples one by one. The link budget tells
+whether a frame rate fits in a baud rate, and headroom() how far the
+host is from falling behind, from two snapshots of the pipeline metrics.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from smartglasses.protocol import FRAME_SIZE
+
+# Rates of the FDC driver of the firmware (FDC_100_Hz, FDC_200_Hz, FDC_400_Hz), in Hz
+FDC_RATES = (100, 200, 400)
+# Rate the classifiers were trained at (the firmware timer), in Hz
+MODEL_RATE = 10
+# Bytes of an ASCII frame: "SOS", four values like "12.34" and "EOS", each followed by \n
+ASCII_FRAME_SIZE = 32
+# Bits sent on the link per byte (8N1: start bit, 8 data bits, stop bit)
+LINK_BITS_PER_BYTE = 10
+# Share of the link a stream may use before it is reported as too close to the limit
+LINK_MARGIN = 0.8
+# Length of the decimation filter, in output samples (the delay is half of it: 0.4 s at 10 Hz)
+DECIMATION_SPAN = 8
+# Cutoff of the decimation filter, relative to the Nyquist frequency of the output (3 Hz at 10 Hz):
+# the expressions change the signal much more slowly, and the transition band ends before 5 Hz
+DECIMATION_CUTOFF = 0.6
+# Time the serial reads of a high-rate stream wait for more frames, in seconds (10 binary frames
+# at 400 Hz fed to the pipeline at once; small next to the delay of the decimation filter)
+READ_LATENCY = 0.025
+
+# frames: frames/s received; load: share of the time spent ingesting; capacity: frames/s the host
+# could ingest at this cost; link: share of the link used (None if the baud rate is not known)
+Headroom = namedtuple('Headroom', ['frames', 'load', 'capacity', 'link'])
+
+
+def decimation_factor(input_rate, output_rate=MODEL_RATE):
+    """!
+    @brief Number of input frames per output sample (raises ValueError if the rates are not multiples).
+    """
+    factor = input_rate / output_rate
+    if factor < 1 or abs(factor - round(factor)) > 1e-9:
+        raise ValueError("the input rate must be a multiple of {} Hz, got {} Hz".format(output_rate, input_rate))
+    return int(round(factor))
+
+
+def lowpass_taps(factor, span=DECIMATION_SPAN, cutoff=DECIMATION_CUTOFF):
+    """!
+    @brief Coefficients of the Hamming-windowed sinc filter decimating by factor, with unit gain at 0 Hz.
+
+    @param span length of the filter in output samples.
+    @param cutoff cutoff relative to the Nyquist frequency of the output.
+    """
+    length = span * factor + 1
+    # cutoff in cycles per input sample
+    frequency = cutoff * 0.5 / factor
+    offsets = np.arange(length) - (length - 1) / 2
+    taps = 2 * frequency * np.sinc(2 * frequency * offsets) * np.hamming(length)
+    return taps / taps.sum()
+
+
+#############
+# DECIMATOR #
+#############
+class Decimator:
+    """!
+    @brief Streaming low-pass filter keeping one sample out of factor, fed with blocks of frames.
+
+    The output is the same whatever the size of the blocks. Before the
+    first frame the filter is filled with that frame, so the stream starts
+    at its level instead of rising from zero (the calibration starts right
+    away). The outputs are delayed by delay output samples.
+    """
+
+    def __init__(self, factor, channels=4, span=DECIMATION_SPAN, cutoff=DECIMATION_CUTOFF):
+        """!
+        @param factor input frames per output sample.
+        """
+        self.factor = factor
+        self.channels = channels
+        self.taps = lowpass_taps(factor, span, cutoff)
+        self._history = None
+        self._phase = 0
+
+    @property
+    def delay(self):
+        """!
+        @brief Delay of the outputs, in output samples.
+        """
+        return (len(self.taps) - 1) / 2 / self.factor
+
+    def reset(self):
+        self._history = None
+        self._phase = 0
+
+    def add_block(self, rows):
+        """!
+        @brief Filter a block of frames.
+
+        @param rows (frames, channels) array of values.
+        @return (samples, channels) array of the decimated samples the block completed (may be empty).
+        """
+        rows = np.asarray(rows, dtype=float).reshape(-1, self.channels)
+        if not len(rows):
+            return np.empty((0, self.channels))
+        if self._history is None:
+            self._history = np.repeat(rows[:1], len(self.taps) - 1, axis=0)
+        data = np.concatenate((self._history, rows))
+        self._history = data[len(rows):]
+        # an output is produced with every factor-th frame, from the len(taps) frames ending there
+        ends = np.arange(self.factor - 1 - self._phase, len(rows), self.factor)
+        self._phase = (self._phase + len(rows)) % self.factor
+        if not len(ends):
+            return np.empty((0, self.channels))
+        windows = np.lib.stride_tricks.sliding_window_view(data, len(self.taps), axis=0)[ends]
+        # the filter is symmetric, no need to reverse it
+        return windows @ self.taps
+
+
+def frame_size(protocol):
+    """!
+    @brief Bytes of a frame of a protocol ('auto' counts the larger ASCII frames).
+    """
+    return FRAME_SIZE if protocol == 'binary' else ASCII_FRAME_SIZE
+
+
+def link_load(rate, protocol, baudrate):
+    """!
+    @brief Share of a serial link used by a stream of rate frames/s (above 1 it does not fit).
+    """
+    return rate * frame_size(protocol) * LINK_BITS_PER_BYTE / baudrate
+
+
+def min_baudrate(rate, protocol, margin=LINK_MARGIN, baudrates=(9600, 19200, 38400, 57600, 115200, 230400)):
+    """!
+    @brief Smallest standard baud rate carrying a stream within the margin (None if none does).
+    """
+    for baudrate in baudrates:
+        if link_load(rate, protocol, baudrate) <= margin:
+            return baudrate
+    return None
+
+
+def read_size(rate):
+    """!
+    @brief Bytes a serial read waits for at a frame rate, about READ_LATENCY of the smallest frames.
+
+    A read that ends in the middle of a frame waits for the next one, so the frames are batched only
+    when they come less than READ_LATENCY / 2 apart. Slower streams (e.g. the 10 Hz of the firmware
+    timer) are read as soon as a byte arrives.
+    """
+    frames = int(rate * READ_LATENCY)
+    return frames * FRAME_SIZE if frames >= 2 else 1
+
+
+def headroom(current, previous=None, baudrate=None):
+    """!
+    @brief Frame rate, host load and link load between two snapshots of the pipeline metrics.
+
+    The load is the time spent in InferencePipeline.feed() (the 'ingest'
+    timer: decoding, decimation and processing) per second; the capacity
+    is the frame rate at which it would reach 100%.
+    @return a Headroom.
+    """
+    if previous is None:
+        elapsed = current['uptime']
+        before = {'counters': {}, 'timers': {}}
+    else:
+        elapsed = current['time'] - previous['time']
+        before = previous
+    frames = current['counters'].get('frames', 0) - before['counters'].get('frames', 0)
+    received = current['counters'].get('bytes', 0) - before['counters'].get('bytes', 0)
+    timer = current['timers'].get('ingest')
+    spent = timer['total'] - before['timers'].get('ingest', {}).get('total', 0.0) if timer else 0.0
+    if elapsed <= 0:
+        return Headroom(0.0, 0.0, None, None)
+    link = received * LINK_BITS_PER_BYTE / elapsed / baudrate if baudrate else None
+    return Headroom(frames / elapsed, spent / elapsed, frames / spent if spent > 0 else None, link)
+
+
+def headroom_summary(current, previous=None, baudrate=None):
+    """!
+    @brief One-line headroom for a status bar.
+    """
+    result = headroom(current, previous, baudrate)
+    text = "ingest {:.1f}% CPU".format(result.load * 100)
+    if result.capacity is not None:
+        text = text + " (up to {:.0f} frames/s)".format(result.capacity)
+    if result.link is not None:
+        text = text + ", link {:.0f}%".format(result.link * 100)
+    return text
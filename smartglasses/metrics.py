@@ -0,0 +1,157 @@
+"""!
+@brief Counters, gauges and timers of the hot path, cheap enough to be always on.
+
+A MetricsRegistry is kept by each pipeline. The reading thread only adds
+to plain dictionaries and timers (no lock, no I/O); snapshots are taken
+from the GUI thread for the status bar, or written as JSON lines to a
+metrics file on demand. Statistics that other objects already keep (e.g.
+the frame counters of the decoders) are pulled at snapshot time through
+collect(), so they are not counted twice.
+"""
+import json
+import time
+
+
+#########
+# TIMER #
+#########
+class Timer:
+    """!
+    @brief Number, total and maximum of the durations of a stage.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, duration):
+        self.count = self.count + 1
+        self.total = self.total + duration
+        self.last = duration
+        if duration > self.max:
+            self.max = duration
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'last': self.last,
+        }
+
+
+####################
+# METRICS_REGISTRY #
+####################
+class MetricsRegistry:
+    """!
+    @brief Named counters, gauges and timers.
+
+    Each metric is meant to be written by a single thread (the one reading
+    the device); snapshot() can be called from any thread.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.started = time.time()
+        self._collectors = []
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def timer(self, name):
+        """!
+        @brief Timer of a stage, created the first time (keep it to call add() in a loop).
+        """
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer()
+        return timer
+
+    def collect(self, function):
+        """!
+        @brief Add the counters returned by function() ({name: value}) to every snapshot.
+        """
+        self._collectors.append(function)
+
+    def snapshot(self):
+        """!
+        @brief Copy of all the metrics.
+
+        @return dict with the wall time, the uptime in seconds, and the counters, gauges and timer statistics.
+        """
+        counters = dict(self.counters)
+        for function in self._collectors:
+            counters.update(function())
+        now = time.time()
+        return {
+            'time': now,
+            'uptime': now - self.started,
+            'counters': counters,
+            'gauges': dict(self.gauges),
+            'timers': {name: timer.stats() for name, timer in list(self.timers.items())},
+        }
+
+    def dump(self, path, **sections):
+        """!
+        @brief Append a snapshot to a metrics file, one JSON object per line.
+
+        @param sections other entries written with the snapshot (e.g. device=port name).
+        @return the snapshot written.
+        """
+        snapshot = self.snapshot()
+        snapshot.update(sections)
+        with open(path, 'a') as file:
+            file.write(json.dumps(snapshot) + '\n')
+        return snapshot
+
+
+def rates(current, previous=None):
+    """!
+    @brief Change per second of each counter between two snapshots (since the start if previous is None).
+    """
+    if previous is None:
+        elapsed = current['uptime']
+        before = {}
+    else:
+        elapsed = current['time'] - previous['time']
+        before = previous['counters']
+    if elapsed <= 0:
+        return {name: 0.0 for name in current['counters']}
+    return {name: (value - before.get(name, 0)) / elapsed for name, value in current['counters'].items()}
+
+
+def stage_means(current, previous=None):
+    """!
+    @brief Mean duration of each timer between two snapshots, in seconds.
+    """
+    means = {}
+    for name, stats in current['timers'].items():
+        before = previous['timers'].get(name) if previous is not None else None
+        count = stats['count'] - (before['count'] if before else 0)
+        total = stats['total'] - (before['total'] if before else 0.0)
+        means[name] = total / count if count else 0.0
+    return means
+
+
+def summary(current, previous=None):
+    """!
+    @brief One-line summary for a status bar: rates, errors and stage times since the previous snapshot.
+    """
+    per_second = rates(current, previous)
+    counters = current['counters']
+    text = "{:.1f} frames/s, {:.0f} B/s, {} errors, {} resyncs".format(
+        per_second.get('frames', 0.0), per_second.get('bytes', 0.0),
+        counters.get('corrupt', 0), counters.get('resyncs', 0))
+    means = stage_means(current, previous)
+    if means:
+        text = text + ", " + ", ".join("{} {:.2f} ms".format(name, mean * 1000) for name, mean in sorted(means.items()))
+    return text
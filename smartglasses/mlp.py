@@ -0,0 +1,169 @@
+"""!
+@brief Trained MLP classifier stored as plain arrays, with a NumPy-only forward pass.
+
+export_model() writes the weights, biases, activations, class labels and
+feature names of a fitted sklearn MLPClassifier to an uncompressed .npz
+file (no pickled objects). NumpyMLP loads it without importing sklearn
+and computes the same predict() and predict_proba() results.
+
+Usage (from the top of the repository):
+
+    python -m smartglasses.mlp GUI/mlp_1.pkl GUI/mlp_1.npz
+"""
+import sys
+import argparse
+
+import numpy as np
+
+# Version of the layout of the exported file
+FORMAT_VERSION = 1
+
+ACTIVATIONS = ('identity', 'logistic', 'tanh', 'relu', 'softmax')
+
+
+def _identity(values):
+    return values
+
+
+def _logistic(values):
+    # same formula as scipy.special.expit used by sklearn
+    return 1.0 / (1.0 + np.exp(-values))
+
+
+def _relu(values):
+    return np.maximum(values, 0, out=values)
+
+
+def _softmax(values):
+    values = values - values.max(axis=1)[:, None]
+    np.exp(values, out=values)
+    values /= values.sum(axis=1)[:, None]
+    return values
+
+
+_FUNCTIONS = {
+    'identity': _identity,
+    'logistic': _logistic,
+    'tanh': np.tanh,
+    'relu': _relu,
+    'softmax': _softmax,
+}
+
+
+#############
+# NUMPY_MLP #
+#############
+class NumpyMLP:
+    """!
+    @brief Forward pass of an exported MLPClassifier.
+
+    Exposes the attributes of the sklearn model used by the host code
+    (classes_, n_features_in_, feature_names_in_), so it can be used in
+    its place.
+    """
+
+    def __init__(self, coefs, intercepts, activation, out_activation, classes, feature_names=None):
+        if activation not in ACTIVATIONS or out_activation not in ACTIVATIONS:
+            raise ValueError("Unknown activation {} / {}".format(activation, out_activation))
+        self.coefs_ = [np.asarray(coef, dtype=float) for coef in coefs]
+        self.intercepts_ = [np.asarray(intercept, dtype=float) for intercept in intercepts]
+        self.activation = activation
+        self.out_activation_ = out_activation
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = self.coefs_[0].shape[0]
+        if feature_names is not None:
+            self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+
+    def predict_proba(self, rows):
+        """!
+        @brief Class probabilities of each row, shape (rows, classes).
+        """
+        values = np.asarray(rows, dtype=float)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+        hidden = _FUNCTIONS[self.activation]
+        last = len(self.coefs_) - 1
+        for i, (coef, intercept) in enumerate(zip(self.coefs_, self.intercepts_)):
+            values = values @ coef
+            values += intercept
+            if i != last:
+                values = hidden(values)
+        values = _FUNCTIONS[self.out_activation_](values)
+        if values.shape[1] == 1:
+            # binary problem: one logistic output for the second class
+            values = values.ravel()
+            return np.vstack([1 - values, values]).T
+        return values
+
+    def predict(self, rows):
+        """!
+        @brief Predicted class of each row.
+        """
+        probabilities = self.predict_proba(rows)
+        return self.classes_[np.argmax(probabilities, axis=1)]
+
+
+def export_model(model, path):
+    """!
+    @brief Write a fitted MLPClassifier to an .npz file.
+    """
+    if getattr(model, 'out_activation_', None) not in ('softmax', 'logistic') or np.ndim(model.classes_) != 1:
+        raise ValueError("Only single-label MLPClassifier models can be exported")
+    arrays = {
+        'format_version': np.array(FORMAT_VERSION),
+        'activation': np.array(model.activation),
+        'out_activation': np.array(model.out_activation_),
+        'classes': np.asarray(model.classes_),
+        'layers': np.array(len(model.coefs_)),
+    }
+    names = getattr(model, 'feature_names_in_', None)
+    if names is not None:
+        arrays['feature_names'] = np.asarray(names, dtype=str)
+    for i, (coef, intercept) in enumerate(zip(model.coefs_, model.intercepts_)):
+        arrays['coef_{}'.format(i)] = coef
+        arrays['intercept_{}'.format(i)] = intercept
+    with open(path, 'wb') as file:
+        np.savez(file, **arrays)
+
+
+def load_model(file):
+    """!
+    @brief Load a model written by export_model (path or open binary file).
+    """
+    with np.load(file, allow_pickle=False) as data:
+        version = int(data['format_version'])
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported model format version {}".format(version))
+        layers = int(data['layers'])
+        return NumpyMLP([data['coef_{}'.format(i)] for i in range(layers)],
+                        [data['intercept_{}'.format(i)] for i in range(layers)],
+                        str(data['activation']), str(data['out_activation']), data['classes'],
+                        data['feature_names'] if 'feature_names' in data else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a pickled MLPClassifier to the NumPy model format.")
+    parser.add_argument('source', help="pickled sklearn model")
+    parser.add_argument('destination', help="exported model (.npz)")
+    parser.add_argument('--check', type=int, default=10000, help="random rows compared after the export (0 = none)")
+    args = parser.parse_args(argv)
+
+    import pickle
+
+    with open(args.source, 'rb') as file:
+        model = pickle.load(file)
+    export_model(model, args.destination)
+    exported = load_model(args.destination)
+
+    if args.check:
+        rows = np.random.default_rng(0).normal(0.0, 0.3, size=(args.check, exported.n_features_in_))
+        if not (np.array_equal(model.predict_proba(rows), exported.predict_proba(rows))
+                and np.array_equal(model.predict(rows), exported.predict(rows))):
+            print("The exported model differs from {}".format(args.source))
+            return 1
+        print("Exported {} to {}: same predictions on {} rows".format(args.source, args.destination, args.check))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
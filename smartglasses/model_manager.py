@@ -0,0 +1,199 @@
+import io
+import os
+import time
+import pickle
+import hashlib
+import logging
+import threading
+
+
+def default_loader(path):
+    """!
+    @brief Loader of the model files with the extension of path.
+
+    Exported NumPy models (.npz) are read without importing sklearn.
+    """
+    if path.lower().endswith('.npz'):
+        from smartglasses.mlp import load_model
+        return load_model
+    return pickle.load
+
+
+#################
+# MODEL_MANAGER #
+#################
+class ModelManager:
+    """!
+    @brief Keep a trained classifier resident in memory.
+
+    The model is loaded once when the manager is created and kept in
+    memory. When the file on disk changes, a new model is loaded and
+    swapped in without restarting the application. Every load records
+    how long it took and which version of the file was loaded.
+    """
+
+    def __init__(self, path, check_interval=1.0, loader=None, on_reload=None, background=False):
+        """!
+        @brief Load the model stored in the given file.
+
+        @param path path of the model file.
+        @param check_interval minimum time in seconds between two checks of the file on disk.
+        @param loader function that takes an open binary file and returns the model
+            (by default smartglasses.mlp.load_model for .npz files, pickle.load otherwise).
+        @param on_reload optional function called with the manager after a new model is swapped in.
+        @param background load the model in a background thread; model waits for it the first time.
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.loader = loader if loader is not None else default_loader(path)
+        self.on_reload = on_reload
+
+        self.version = 0
+        self.digest = None
+        self.mtime = None
+        self.load_time = None
+        self.loaded_at = None
+
+        self._model = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._watcher = None
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+
+        if background:
+            threading.Thread(target=self._first_load, name="ModelLoader", daemon=True).start()
+        else:
+            self._first_load()
+
+    @property
+    def model(self):
+        """!
+        @brief Model currently in memory (waits for the first load to finish).
+        """
+        self._ready.wait()
+        with self._lock:
+            return self._model
+
+    @property
+    def ready(self):
+        """!
+        @brief True once the first load has finished (successfully or not).
+        """
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """!
+        @brief Wait for the first load to finish.
+
+        @return True if it finished within the timeout.
+        """
+        return self._ready.wait(timeout)
+
+    def load(self):
+        """!
+        @brief Load the model from disk and swap it in.
+
+        If the file cannot be read or unpickled the model in memory is kept. Failing
+        with no model in memory (the first load) is an error: no prediction can be made.
+        @return True if a new model was swapped in.
+        """
+        start = time.perf_counter()
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'rb') as file:
+                content = file.read()
+            model = self.loader(io.BytesIO(content))
+        except Exception as error:
+            if self._model is None:
+                logging.error("Could not load model {}, no prediction until it loads: {}".format(self.path, error))
+            else:
+                logging.info("Could not load model {}: {}".format(self.path, error))
+            return False
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._model = model
+            self.version = self.version + 1
+            self.digest = hashlib.sha1(content).hexdigest()[:12]
+            self.mtime = mtime
+            self.load_time = elapsed
+            self.loaded_at = time.time()
+
+        logging.info("Loaded model {} version {} ({}) in {:.1f} ms".format(
+            self.path, self.version, self.digest, elapsed * 1000))
+        if self.on_reload is not None and self.version > 1:
+            self.on_reload(self)
+        return True
+
+    def changed(self):
+        """!
+        @brief Check if the file on disk differs from the model in memory.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        return mtime != self.mtime
+
+    def reload_if_changed(self):
+        """!
+        @brief Reload the model if the file on disk changed since the last load.
+
+        Checks are skipped if the last one was less than check_interval seconds ago.
+        @return True if a new model was swapped in.
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        if self.changed():
+            return self.load()
+        return False
+
+    def start_watching(self):
+        """!
+        @brief Watch the file on disk from a background thread.
+
+        New models are loaded in the background thread, so the caller
+        only ever sees the swap of the reference.
+        """
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="ModelWatcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        """!
+        @brief Stop the background thread started by start_watching.
+        """
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def info(self):
+        """!
+        @brief Summary of the model in memory.
+        """
+        return {
+            'path': self.path,
+            'version': self.version,
+            'digest': self.digest,
+            'load_time': self.load_time,
+            'loaded_at': self.loaded_at,
+        }
+
+    def _first_load(self):
+        try:
+            self.load()
+        finally:
+            self._ready.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.check_interval):
+            if self.ready and self.changed():
+                self.load()
+
@@ -0,0 +1,664 @@
+"""!
+@brief Headless processing of the capacitance stream, from bytes to predictions.
+
+The pipeline decodes the frames sent by the PSoC, keeps the sample
+history, computes the calibration baseline, collects windows of
+calibrated samples, extracts their features and runs the classifier.
+It does not depend on Qt: the GUIs drive it from their serial worker and
+turn its events into signals, while scripts and services can iterate
+over it directly.
+
+Usage (from the top of the repository), e.g. against the emulator:
+
+    python -m smartglasses.pipeline /dev/pts/3 --model GUI/mlp_1.npz
+
+or, with the FDC sampling at 400 Hz and binary frames:
+
+    python -m smartglasses.pipeline /dev/pts/3 --rate 400 --protocol binary --baudrate 115200
+"""
+import sys
+import time
+import logging
+import argparse
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from smartglasses.protocol import make_decoder
+from smartglasses.ring_buffer import SampleRingBuffer
+from smartglasses.calibration import Calibrator, CALIBRATION_SAMPLES, CALIBRATION_TOLERANCE
+from smartglasses.baseline import BaselineTracker
+from smartglasses.profiles import ProfileCheck
+from smartglasses.features import window_features, check_feature_names, predict_rows
+from smartglasses.sliding import SlidingWindowFeatures
+from smartglasses.metrics import MetricsRegistry
+from smartglasses.tracing import LatencyTracker, Trace
+from smartglasses.inference import InferenceWorker
+from smartglasses.ingest import (Decimator, decimation_factor, headroom, link_load, min_baudrate, read_size,
+                                 LINK_MARGIN, MODEL_RATE)
+
+# Time between two samples sent by the PSoC timer, in seconds
+SAMPLE_PERIOD = 0.1
+# Samples in a prediction window (5 s at 10 Hz)
+WINDOW_SAMPLES = 50
+# Samples between two predictions in continuous mode
+CONTINUOUS_HOP = 1
+
+# Event kinds
+SAMPLE = 'sample'
+CALIBRATED = 'calibrated'
+BASELINE = 'baseline'
+PROFILE = 'profile'
+WINDOW = 'window'
+FEATURES = 'features'
+PREDICTION = 'prediction'
+
+# time: sample index times SAMPLE_PERIOD; received: host time.time() when the frame arrived;
+# arrived: time.monotonic() when its bytes were read, for latency measurements
+Sample = namedtuple('Sample', ['index', 'time', 'values', 'received', 'arrived'])
+# values: calibrated (channels, samples); raw: as received; times: host receive times; means: baseline
+Window = namedtuple('Window', ['values', 'raw', 'times', 'means'])
+Event = namedtuple('Event', ['kind', 'data'])
+
+
+#################
+# SERIAL_SOURCE #
+#################
+class SerialSource:
+    """!
+    @brief Iterable over the chunks of bytes received on a serial port.
+    """
+
+    def __init__(self, port_name, baudrate=9600, timeout=0.1, metrics=None, read_size=1):
+        """!
+        @param metrics MetricsRegistry receiving the bytes waiting in the port buffer ('serial_backlog').
+        @param read_size bytes a read waits for (at most timeout) when fewer are waiting: several frames
+            at high rates, so that they are decoded in blocks instead of a few bytes at a time.
+        """
+        self.port_name = port_name
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.metrics = metrics
+        self.read_size = read_size
+        self.port = None
+        self.closing = False
+
+    def open(self):
+        """!
+        @brief Open the serial port (raises serial.SerialException on failure).
+        """
+        import serial
+
+        self.closing = False
+        self.port = serial.Serial(port=self.port_name, baudrate=self.baudrate,
+                                  write_timeout=0, timeout=self.timeout)
+        return self.port.is_open
+
+    def close(self):
+        self.closing = True
+        if self.port is not None:
+            self.port.close()
+
+    def __iter__(self):
+        import serial
+
+        if self.port is None:
+            self.open()
+        while self.port.is_open:
+            try:
+                waiting = self.port.in_waiting
+                if self.metrics is not None:
+                    self.metrics.gauge('serial_backlog', waiting)
+                data = self.port.read(max(waiting, self.read_size))
+            except (serial.SerialException, OSError, TypeError):
+                # closing the port from another thread interrupts the read
+                # with any of these, depending on where pyserial was
+                if self.closing:
+                    return
+                raise
+            if data:
+                yield data
+
+
+####################
+# WINDOW_COLLECTOR #
+####################
+class WindowCollector:
+    """!
+    @brief Collect a fixed number of samples into a (channels, samples) window.
+    """
+
+    def __init__(self, length=WINDOW_SAMPLES, channels=4):
+        self.length = length
+        self._window = np.zeros((channels, length))
+        self._times = np.zeros(length)
+        self.count = 0
+
+    def reset(self):
+        self.count = 0
+
+    def add(self, values, timestamp=0.0):
+        """!
+        @brief Add a sample and the time it was received.
+
+        @return the complete window and its times (new arrays) or None if more samples are needed.
+        """
+        self._window[:, self.count] = values
+        self._times[self.count] = timestamp
+        self.count = self.count + 1
+        if self.count >= self.length:
+            self.count = 0
+            return self._window.copy(), self._times.copy()
+        return None
+
+
+######################
+# INFERENCE_PIPELINE #
+######################
+class InferencePipeline:
+    """!
+    @brief From raw frames to calibrated samples, windows, features and predictions.
+
+    Calibration and windows are requested with start_calibration() and
+    start_window(), which can be called from any thread: the request is
+    taken into account at the next sample. check_profile() replaces the
+    calibration by a check of the first samples against a saved profile.
+    In continuous mode (start_continuous()) overlapping windows are
+    classified every hop samples, with the features updated incrementally
+    at each sample.
+    Results are returned as events by run() and process(), and passed to
+    the callbacks registered with subscribe(). Throughput, decoding errors,
+    pending requests and the time spent parsing, extracting features and
+    predicting are kept in the metrics registry; the latency of each stage
+    of a prediction, from the arrival of its last sample, in the latency
+    tracker (last_trace holds the stage times of the last prediction).
+    With adaptive_baseline, the baseline set by the calibration then
+    follows the drift of the signal at rest (BaselineTracker) and a
+    BASELINE event is produced whenever it changes.
+    With a calibration_tolerance, the calibration stops as soon as the
+    baseline is stable (see Calibrator); the time it saved is kept in the
+    'calibration_saved' gauge, in seconds.
+    With background_inference, the classifier runs in an InferenceWorker
+    thread: the PREDICTION events are then only passed to the callbacks,
+    from that thread, and the pending predictions are cancelled by a new
+    calibration, a reset or a change of continuous mode.
+    With an input_rate above the 10 Hz of the models, the frames of each
+    chunk go through a Decimator and only the decimated samples are
+    processed, so the samples, windows and features stay at 10 Hz. The
+    'ingest' timer holds the whole time spent in feed() and 'decimate' the
+    time spent filtering (see smartglasses.ingest.headroom).
+    """
+
+    def __init__(self, model_manager=None, protocol='auto', history=50,
+                 calibration_samples=CALIBRATION_SAMPLES, window_samples=WINDOW_SAMPLES, background_inference=False,
+                 adaptive_baseline=False, calibration_tolerance=None, input_rate=None):
+        """!
+        @param model_manager ModelManager holding the classifier (None to only collect windows).
+        @param protocol frame format sent by the PSoC ('ascii', 'binary' or 'auto').
+        @param history number of samples kept in the history buffer.
+        @param calibration_samples samples averaged into the baseline.
+        @param window_samples samples in a prediction window.
+        @param background_inference classify the windows in a thread of their own instead of the calling one.
+        @param adaptive_baseline keep updating the baseline at rest after the calibration.
+        @param calibration_tolerance stop the calibration once the confidence interval of every mean is
+            narrower than this, in pF (None to always average calibration_samples).
+        @param input_rate frames per second sent by the device, a multiple of 10 Hz (None for 10 Hz).
+        """
+        self.model_manager = model_manager
+        self.decoder = make_decoder(protocol)
+        self.history = SampleRingBuffer(history)
+        self.calibrator = Calibrator(calibration_samples, tolerance=calibration_tolerance)
+        self.collector = WindowCollector(window_samples)
+        self.sliding = SlidingWindowFeatures(window_samples)
+        self.baseline = BaselineTracker() if adaptive_baseline else None
+        self.input_rate = MODEL_RATE if input_rate is None else input_rate
+        factor = decimation_factor(self.input_rate)
+        self.decimator = Decimator(factor) if factor > 1 else None
+
+        self.means = (0.0, 0.0, 0.0, 0.0)
+        self.sample_count = 0
+        self.calibrating = False
+        self.collecting = False
+        self.predict_window = False
+        self.continuous = False
+        self.checking = None
+        self._fallback = False
+        self._checked_model = None
+
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._history_lock = threading.Lock()
+        self._requests = []
+
+        self.metrics = MetricsRegistry()
+        self.metrics.collect(self.decoder.stats)
+        self._parse_timer = self.metrics.timer('parse')
+        self._features_timer = self.metrics.timer('features')
+        self._predict_timer = self.metrics.timer('predict')
+        self._decimate_timer = self.metrics.timer('decimate') if self.decimator is not None else None
+        self._ingest_timer = self.metrics.timer('ingest')
+        self.latency = LatencyTracker()
+        self.last_trace = None
+        self._stamps = None
+        self.inference = InferenceWorker(self._run_model, metrics=self.metrics) if background_inference else None
+
+    @property
+    def calibrated(self):
+        return self.calibrator.done
+
+    def subscribe(self, kind, callback):
+        """!
+        @brief Call callback(data) for every event of the given kind.
+        """
+        self._callbacks.setdefault(kind, []).append(callback)
+
+    def start_calibration(self):
+        """!
+        @brief Average the next samples into a new baseline.
+        """
+        self._request('calibration')
+
+    def check_profile(self, profile, fallback=False):
+        """!
+        @brief Compare the next samples with a saved calibration profile (smartglasses.profiles).
+
+        A PROFILE event gives the ProfileResult. If the profile is accepted the
+        baseline is the mean of the samples checked and a CALIBRATED event follows.
+        @param fallback start a full calibration if the profile is rejected.
+        """
+        self._request(('profile', profile, fallback))
+
+    def start_window(self, predict=True):
+        """!
+        @brief Collect the next samples into a window.
+
+        @param predict also extract the features of the window and classify it.
+        """
+        self._request('predict' if predict else 'window')
+
+    def start_continuous(self, hop=CONTINUOUS_HOP):
+        """!
+        @brief Classify the last window_samples samples every hop samples until stop_continuous().
+
+        The first prediction comes once a whole window has been collected.
+        """
+        self._request(('continuous', hop))
+
+    def stop_continuous(self):
+        self._request('stop')
+
+    def reset(self):
+        """!
+        @brief Cancel calibration, windows and continuous mode and forget the baseline.
+        """
+        self._request('reset')
+
+    def history_snapshot(self, span=None):
+        """!
+        @brief Copy of the latest samples of the history, safe to call from another thread.
+
+        @param span seconds of history (None for the whole history).
+        @return the number of samples processed so far and a (samples, 1 + channels) array of times and values.
+        """
+        with self._history_lock:
+            if span is None:
+                rows = self.history.view()
+            else:
+                rows = self.history.latest(int(np.ceil(span / SAMPLE_PERIOD)) + 1)
+            return self.sample_count, rows.copy()
+
+    def run(self, source):
+        """!
+        @brief Generator of the events produced by a source of bytes.
+
+        @param source iterable of chunks of bytes (e.g. a SerialSource).
+        """
+        for data in source:
+            yield from self.feed(data)
+
+    def feed(self, data, received=None, arrived=None):
+        """!
+        @brief Process a chunk of bytes and return the events of the samples it completed.
+
+        @param received host time the chunk arrived (time.time() if None).
+        @param arrived time.monotonic() when the chunk was read (now if None).
+        """
+        arrived = time.monotonic() if arrived is None else arrived
+        received = time.time() if received is None else received
+        self.metrics.count('bytes', len(data))
+        start = time.perf_counter()
+        frames = self.decoder.feed(data)
+        decoded = time.perf_counter()
+        self._parse_timer.add(decoded - start)
+        parsed = time.monotonic()
+        events = []
+        if self.decimator is None:
+            for frame in frames:
+                events.extend(self.process(frame.values, received, arrived, parsed))
+        elif frames:
+            samples = self.decimator.add_block([frame.values for frame in frames])
+            self._decimate_timer.add(time.perf_counter() - decoded)
+            for values in samples.tolist():
+                events.extend(self.process(tuple(values), received, arrived, parsed))
+        self._ingest_timer.add(time.perf_counter() - start)
+        return events
+
+    def consume(self, source):
+        """!
+        @brief Process a whole source, delivering the events only to the callbacks.
+        """
+        for _ in self.run(source):
+            pass
+
+    def process(self, values, received=None, arrived=None, parsed=None):
+        """!
+        @brief Process one raw sample (4 values in pF) and return the events it produced.
+
+        @param received host time the sample arrived (time.time() if None).
+        @param arrived time.monotonic() when its bytes were read (now if None).
+        @param parsed time.monotonic() when it was decoded (arrived if None).
+        """
+        self._handle_requests()
+        events = []
+
+        received = time.time() if received is None else received
+        arrived = time.monotonic() if arrived is None else arrived
+        self._stamps = (arrived, arrived if parsed is None else parsed)
+        sample = Sample(self.sample_count, self.sample_count * SAMPLE_PERIOD, values, received, arrived)
+        with self._history_lock:
+            self.history.append(sample.time, values)
+            self.sample_count = self.sample_count + 1
+        self._emit(events, SAMPLE, sample)
+
+        if self.checking is not None:
+            result = self.checking.add(values)
+            if result is not None:
+                self._checked(result, events)
+        elif self.calibrating and self.calibrator.add(values):
+            self.calibrating = False
+            self.means = self.calibrator.means
+            self.metrics.gauge('calibration_saved', self.calibrator.saved * SAMPLE_PERIOD)
+            if self.baseline is not None:
+                self.baseline.reset(self.means)
+            self._emit(events, CALIBRATED, self.means)
+        elif self.baseline is not None and self.baseline.ready and self.calibrated:
+            means = self.baseline.add(values)
+            if means != self.means:
+                self.means = means
+                self.metrics.count('baseline_shifts')
+                self._emit(events, BASELINE, means)
+
+        if self.collecting:
+            collected = self.collector.add(values, received)
+            if collected is not None:
+                raw, times = collected
+                window = Window(raw - np.reshape(self.means, (-1, 1)), raw, times, self.means)
+                self.collecting = False
+                self._emit(events, WINDOW, window)
+                if self.predict_window:
+                    self.classify(window.values, events)
+
+        if self.continuous:
+            start = time.perf_counter()
+            row = self.sliding.add(np.subtract(values, self.means))
+            self._features_timer.add(time.perf_counter() - start)
+            if row is not None:
+                self.predict(row, events)
+        self._stamps = None
+        return events
+
+    def classify(self, window, events=None):
+        """!
+        @brief Extract the features of a window and run the classifier on them.
+
+        @return the predicted class (None with background_inference: the PREDICTION event follows).
+        """
+        start = time.perf_counter()
+        row = window_features(window)
+        self._features_timer.add(time.perf_counter() - start)
+        return self.predict(row, events)
+
+    def predict(self, row, events=None):
+        """!
+        @brief Run the classifier on the 20 features of a window.
+
+        @return the predicted class (None with background_inference: the PREDICTION event follows).
+        """
+        events = [] if events is None else events
+        features = time.monotonic()
+        self._emit(events, FEATURES, row)
+        # called outside process(), the row has no sample to trace back to
+        arrived, parsed = self._stamps if self._stamps is not None else (features, features)
+        if self.inference is not None:
+            self.inference.submit(row, self._predicted, (arrived, parsed, features))
+            return None
+        label = self._run_model(row)
+        self._deliver(label, (arrived, parsed, features), events)
+        return label
+
+    def cancel_predictions(self):
+        """!
+        @brief Drop the predictions waiting in the background (their PREDICTION events never come).
+        """
+        if self.inference is not None:
+            self.inference.cancel()
+
+    def close(self):
+        """!
+        @brief Stop the inference thread (started again by the next prediction).
+        """
+        if self.inference is not None:
+            self.inference.stop()
+
+    def _run_model(self, row):
+        model = self.model_manager.model
+        if model is None:
+            raise RuntimeError("no model loaded from {}".format(self.model_manager.path))
+        if model is not self._checked_model:
+            check_feature_names(model)
+            self._checked_model = model
+        start = time.perf_counter()
+        label = predict_rows(model, row[None, :])[0]
+        self._predict_timer.add(time.perf_counter() - start)
+        return label
+
+    def _predicted(self, request, label):
+        self._deliver(label, request.context, [])
+
+    def _deliver(self, label, stamps, events):
+        self.last_trace = Trace(*stamps, time.monotonic())
+        self.latency.record_trace(self.last_trace)
+        self._emit(events, PREDICTION, label)
+
+    def _checked(self, result, events):
+        self.checking = None
+        self._emit(events, PROFILE, result)
+        if result.accepted:
+            self.calibrator.restore(result.means, result.profile.variances)
+            self.means = self.calibrator.means
+            if self.baseline is not None:
+                self.baseline.reset(self.means)
+            self._emit(events, CALIBRATED, self.means)
+        elif self._fallback:
+            self.calibrator.reset()
+            self.calibrating = True
+
+    def _request(self, request):
+        with self._lock:
+            self._requests.append(request)
+            self.metrics.gauge('requests', len(self._requests))
+
+    def _handle_requests(self):
+        if not self._requests:
+            return
+        with self._lock:
+            requests, self._requests = self._requests, []
+            self.metrics.gauge('requests', 0)
+        for request in requests:
+            if request in ('calibration', 'stop', 'reset') or isinstance(request, tuple):
+                # the windows classified in the background belong to the previous mode
+                self.cancel_predictions()
+            if request == 'calibration':
+                self.calibrator.reset()
+                self.calibrating = True
+                self.checking = None
+            elif request in ('window', 'predict'):
+                self.collector.reset()
+                self.collecting = True
+                self.predict_window = request == 'predict'
+            elif isinstance(request, tuple) and request[0] == 'profile':
+                self.calibrator.reset()
+                self.calibrating = False
+                self.checking = ProfileCheck(request[1])
+                self._fallback = request[2]
+            elif isinstance(request, tuple) and request[0] == 'continuous':
+                self.sliding.hop = request[1]
+                self.sliding.reset()
+                self.continuous = True
+            elif request == 'stop':
+                self.continuous = False
+            elif request == 'reset':
+                self.calibrator.reset()
+                if self.baseline is not None:
+                    self.baseline.reset(None)
+                self.collector.reset()
+                self.calibrating = False
+                self.checking = None
+                self.collecting = False
+                self.continuous = False
+                self.means = (0.0, 0.0, 0.0, 0.0)
+
+    def _emit(self, events, kind, data):
+        events.append(Event(kind, data))
+        for callback in self._callbacks.get(kind, ()):
+            callback(data)
+
+
+def log_latency(latency):
+    """!
+    @brief Log the latency percentiles of each stage of a LatencyTracker.
+    """
+    for stage, stats in latency.report().items():
+        logging.info("Latency {}: p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms ({} predictions)".format(
+            stage, stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000, stats['max'] * 1000, stats['count']))
+
+
+def log_link_budget(rate, protocol, baudrate):
+    """!
+    @brief Log the share of the serial link a frame rate needs, with a warning if it does not fit.
+    """
+    load = link_load(rate, protocol, baudrate)
+    if load <= LINK_MARGIN:
+        logging.info("Link: {} Hz of {} frames use {:.0f}% of {} baud".format(rate, protocol, load * 100, baudrate))
+        return
+    needed = min_baudrate(rate, protocol)
+    logging.warning("Link: {} Hz of {} frames need {:.0f}% of {} baud, frames will be lost ({})".format(
+        rate, protocol, load * 100, baudrate,
+        "use at least {} baud".format(needed) if needed else "use binary frames or a lower rate"))
+
+
+def log_headroom(metrics, baudrate=None):
+    """!
+    @brief Log the frame rate and the host and link load from a snapshot of the metrics.
+    """
+    result = headroom(metrics, baudrate=baudrate)
+    logging.info("Ingest: {:.0f} frames/s, {:.1f}% CPU, up to {} frames/s{}".format(
+        result.frames, result.load * 100, "{:.0f}".format(result.capacity) if result.capacity else "?",
+        ", link {:.0f}%".format(result.link * 100) if result.link is not None else ""))
+
+
+def dump_on_signal(dump):
+    """!
+    @brief Call dump() when the process receives SIGUSR1 (kill -USR1 <pid>), where the signal exists.
+    """
+    import signal
+
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dump())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate and classify the stream of the glasses without a GUI.")
+    parser.add_argument('port', help="serial port of the glasses (or of the emulator), or a .sgrec recording to replay")
+    parser.add_argument('--model', default='GUI/mlp_1.npz', help="trained classifier (.npz export or sklearn pickle)")
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--protocol', choices=('ascii', 'binary', 'auto'), default='auto')
+    parser.add_argument('--rate', type=int, default=MODEL_RATE, metavar='HZ',
+                        help="frames per second sent by the glasses, decimated to {} Hz (default {})".format(
+                            MODEL_RATE, MODEL_RATE))
+    parser.add_argument('--windows', type=int, default=0, help="stop after this many predictions (0 = run forever)")
+    parser.add_argument('--continuous', type=int, default=0, metavar='HOP',
+                        help="classify overlapping windows every HOP samples (0 = one window after the other)")
+    parser.add_argument('--metrics', default=None, metavar='FILE',
+                        help="append the metrics to FILE at exit and on SIGUSR1")
+    parser.add_argument('--record', default=None, metavar='FILE', help="record the bytes received to FILE (.sgrec)")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay speed of a recording (1 = original pace, 0 = as fast as possible)")
+    parser.add_argument('--adaptive-baseline', action='store_true',
+                        help="keep following the drift of the signal at rest after the calibration")
+    parser.add_argument('--calibration-tolerance', type=float, default=None, metavar='PF',
+                        help="stop the calibration once the baseline is known within PF (e.g. {})".format(
+                            CALIBRATION_TOLERANCE))
+    parser.add_argument('--background', action='store_true',
+                        help="classify in a thread of its own (windows may be dropped if the model falls behind)")
+    args = parser.parse_args(argv)
+
+    from smartglasses.model_manager import ModelManager
+    from smartglasses.recording import RecordingSource, ReplaySource, is_recording
+
+    logging.basicConfig(level=logging.INFO)
+    pipeline = InferencePipeline(ModelManager(args.model), protocol=args.protocol,
+                                 background_inference=args.background, adaptive_baseline=args.adaptive_baseline,
+                                 calibration_tolerance=args.calibration_tolerance, input_rate=args.rate)
+    log_link_budget(args.rate, args.protocol, args.baudrate)
+    predictions = []
+
+    def on_calibrated(means):
+        logging.info("Calibration done: {} ({:.1f} s saved)".format(means, pipeline.calibrator.saved * SAMPLE_PERIOD))
+        if args.continuous:
+            pipeline.start_continuous(args.continuous)
+        else:
+            pipeline.start_window()
+
+    def on_prediction(label):
+        predictions.append(label)
+        print(label, flush=True)
+        if args.windows and len(predictions) >= args.windows:
+            source.close()
+        elif not args.continuous:
+            pipeline.start_window()
+
+    pipeline.subscribe(CALIBRATED, on_calibrated)
+    pipeline.subscribe(PREDICTION, on_prediction)
+    pipeline.start_calibration()
+
+    if is_recording(args.port):
+        source = ReplaySource(args.port, args.speed)
+    else:
+        source = SerialSource(args.port, args.baudrate, metrics=pipeline.metrics, read_size=read_size(args.rate))
+    if args.record:
+        source = RecordingSource(source, args.record, port=args.port, baudrate=args.baudrate)
+    if args.metrics:
+        dump_on_signal(lambda: pipeline.metrics.dump(args.metrics, device=args.port, latency=pipeline.latency.report()))
+    start = time.perf_counter()
+    try:
+        pipeline.consume(source)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        pipeline.close()
+        elapsed = time.perf_counter() - start
+        frames = pipeline.decoder.stats()['frames']
+        logging.info("Processed {} frames in {:.2f} s ({:.0f} frames/s)".format(
+            frames, elapsed, frames / elapsed if elapsed > 0 else 0.0))
+        log_headroom(pipeline.metrics.snapshot(), args.baudrate)
+        if args.metrics:
+            pipeline.metrics.dump(args.metrics, device=args.port, latency=pipeline.latency.report())
+        log_latency(pipeline.latency)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
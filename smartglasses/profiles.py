@@ -0,0 +1,155 @@
+"""!
+@brief Calibration profiles saved per pair of glasses and user, reused after a quick check.
+
+Every full calibration is saved to a small JSON file with the means and
+variances of the four channels at rest, the time, the device and the
+user. When the same user reconnects the same glasses, the first samples
+are compared with the saved profile: if they are at rest and agree with
+it, the 5 s calibration is skipped and the baseline is the mean of those
+samples; otherwise a full calibration is needed. The device is
+identified by the USB serial number of the port when there is one (the
+port name changes between plugs), by the port name otherwise.
+"""
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from smartglasses.baseline import EXPRESSION_THRESHOLD
+
+PROFILES_VERSION = 1
+# Samples compared with a saved profile before reusing it (1 s at 10 Hz)
+CHECK_SAMPLES = 10
+# Largest difference between the mean of the check samples and the saved baseline, in pF
+CHECK_TOLERANCE = 0.05
+# Saved profiles older than this are not reused, in seconds (30 days)
+PROFILE_MAX_AGE = 30 * 24 * 3600
+
+Profile = namedtuple('Profile', ['device', 'user', 'means', 'variances', 'saved', 'port'])
+# accepted: the profile can be used; means: baseline from the check samples; deviation: largest
+# difference to the saved means and spread: largest range of a channel during the check, in pF
+ProfileResult = namedtuple('ProfileResult', ['accepted', 'profile', 'means', 'deviation', 'spread'])
+
+
+def device_id(port_name):
+    """!
+    @brief Stable identifier of the device on a port: USB ids and serial number, or the port name.
+    """
+    try:
+        from serial.tools import list_ports
+    except ImportError:
+        return port_name
+    for port in list_ports.comports():
+        if port_name not in (port.device, port.name):
+            continue
+        if port.vid is not None and port.serial_number:
+            return "{:04X}:{:04X}:{}".format(port.vid, port.pid, port.serial_number)
+        return port_name
+    return port_name
+
+
+#################
+# PROFILE_STORE #
+#################
+class ProfileStore:
+    """!
+    @brief The last calibration profile of each (device, user), in a JSON file.
+
+    The file is read again before every write, so windows and sessions
+    sharing it do not overwrite each other's profiles.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get(self, device, user='', max_age=PROFILE_MAX_AGE):
+        """!
+        @brief Saved profile of a device and user (None if there is none or it is older than max_age).
+        """
+        entry = self._read().get(self._key(device, user))
+        if entry is None:
+            return None
+        profile = Profile(**entry)
+        if max_age is not None and time.time() - profile.saved > max_age:
+            return None
+        return profile
+
+    def save(self, device, user, means, variances=None, port=None):
+        """!
+        @brief Save the calibration of a device and user, replacing the previous one.
+
+        @return the Profile saved.
+        """
+        profile = Profile(device, user, [float(mean) for mean in means],
+                          None if variances is None else [float(variance) for variance in variances],
+                          time.time(), port)
+        with self._lock:
+            profiles = self._read()
+            profiles[self._key(device, user)] = profile._asdict()
+            folder = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(folder, exist_ok=True)
+            # written next to the file and renamed, so a crash never leaves half a file
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as file:
+                json.dump({'version': PROFILES_VERSION, 'profiles': profiles}, file, indent=1)
+            os.replace(temporary, self.path)
+        return profile
+
+    def profiles(self):
+        return [Profile(**entry) for entry in self._read().values()]
+
+    def _read(self):
+        try:
+            with open(self.path) as file:
+                content = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if content.get('version') != PROFILES_VERSION:
+            return {}
+        return content.get('profiles', {})
+
+    @staticmethod
+    def _key(device, user):
+        return "{}|{}".format(device, user)
+
+
+#################
+# PROFILE_CHECK #
+#################
+class ProfileCheck:
+    """!
+    @brief Compare the first samples of a connection with a saved profile.
+    """
+
+    def __init__(self, profile, samples=CHECK_SAMPLES, tolerance=CHECK_TOLERANCE, threshold=EXPRESSION_THRESHOLD):
+        """!
+        @param samples samples collected before deciding.
+        @param tolerance largest difference to the saved means on any channel, in pF.
+        @param threshold largest range of a channel during the check, in pF (the user must be at rest).
+        """
+        self.profile = profile
+        self.tolerance = tolerance
+        self.threshold = threshold
+        self._values = np.zeros((samples, len(profile.means)))
+        self.count = 0
+
+    def add(self, values):
+        """!
+        @brief Add a raw sample.
+
+        @return the ProfileResult once enough samples were collected, None before.
+        """
+        self._values[self.count] = values
+        self.count = self.count + 1
+        if self.count < len(self._values):
+            return None
+        means = self._values.mean(axis=0)
+        deviation = float(np.max(np.abs(means - np.asarray(self.profile.means))))
+        spread = float(np.max(np.ptp(self._values, axis=0)))
+        accepted = deviation <= self.tolerance and spread <= self.threshold
+        return ProfileResult(accepted, self.profile, tuple(float(mean) for mean in np.round(means, 2)),
+                             deviation, spread)
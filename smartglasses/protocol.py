@@ -0,0 +1,361 @@
+import re
+import struct
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+# Binary frame sent by the PSoC when BINARY_PROTOCOL is enabled in the firmware:
+#   sync word   2 bytes  0xA5 0x5A
+#   sequence    2 bytes  uint16, little endian, wraps at 65536
+#   values     12 bytes  4 x signed 24-bit FDC1004 measurement, little endian
+#   crc         2 bytes  CRC-16/CCITT-FALSE of sequence and values, little endian
+SYNC = b'\xA5\x5A'
+HEADER_SIZE = 4
+PAYLOAD_SIZE = 12
+FRAME_SIZE = HEADER_SIZE + PAYLOAD_SIZE + 2
+CHANNELS = 4
+
+# Conversion of the raw measurement to pF (see FDC_ReadMeasurement in FDC1004Q.c)
+RAW_SCALE = 1 << 19
+CAPDAC_FACTOR = 3.125
+# CAPDAC configured for each channel by Setup_Values in FDC1004Q.c
+DEFAULT_CAPDAC = (0, 0, 0, 0)
+
+# ASCII frame sent by Custom_ISR_TIMER: "SOS\n" + 4 x "%.2f\n" + "EOS\n"
+ASCII_START = b'SOS'
+ASCII_END = b'EOS'
+MAX_LINE_LENGTH = 256
+# A well-formed ASCII frame, decoded with a single match instead of line by line
+_ASCII_FRAME = re.compile(rb'SOS\r?\n' + rb'(-?[0-9]+\.[0-9]+)\r?\n' * CHANNELS + rb'EOS\r?\n')
+
+# Complete binary frames in the buffer from which they are decoded at once with NumPy (below,
+# the fixed cost of the NumPy calls exceeds the decoding one by one), and the most decoded at
+# once (a damaged frame ends a batch early)
+BATCH_FRAMES = 32
+MAX_BATCH_FRAMES = 256
+
+PROTOCOLS = ('ascii', 'binary', 'auto')
+
+Frame = namedtuple('Frame', ['seq', 'values'])
+
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """!
+    @brief CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF).
+    """
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+_CRC16_ARRAY = np.array(_CRC16_TABLE, dtype=np.uint16)
+
+
+def raw_to_pf(raw, capdac=0):
+    """!
+    @brief Convert a signed 24-bit FDC1004 measurement to pF.
+    """
+    return raw / RAW_SCALE + capdac * CAPDAC_FACTOR
+
+
+def encode_binary_frame(seq, raw_values):
+    """!
+    @brief Build a binary frame from a sequence number and 4 raw measurements.
+    """
+    body = struct.pack('<H', seq & 0xFFFF)
+    for raw in raw_values:
+        body = body + (raw & 0xFFFFFF).to_bytes(3, 'little')
+    return SYNC + body + struct.pack('<H', crc16(body))
+
+
+def encode_ascii_frame(values):
+    """!
+    @brief Build an ASCII frame exactly as printed by Custom_ISR_TIMER.
+    """
+    return ('SOS\n' + ''.join('%.2f\n' % value for value in values) + 'EOS\n').encode()
+
+
+########################
+# BINARY_FRAME_DECODER #
+########################
+class BinaryFrameDecoder:
+    """!
+    @brief Streaming decoder of the binary capacitance frames.
+
+    Bytes can be fed in chunks of any size. Frames are located by their
+    sync word and validated with the CRC; after garbage or a corrupted
+    frame the decoder searches the next sync word. Gaps in the sequence
+    numbers are counted as dropped frames. At high frame rates a read
+    holds many frames back to back: runs of at least BATCH_FRAMES valid
+    frames are checked and converted with NumPy instead of one by one.
+    """
+
+    def __init__(self, capdac=DEFAULT_CAPDAC):
+        self.capdac = tuple(capdac)
+        self._buffer = bytearray()
+        self._expected_seq = None
+        # frames decoded one by one before trying a batch again, after a damaged frame
+        self._single = 0
+
+        self.frames = 0
+        self.corrupt = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.discarded_bytes = 0
+
+    def feed(self, data):
+        """!
+        @brief Add received bytes and return the list of complete frames.
+        """
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        pos = 0
+        while True:
+            start = buffer.find(SYNC, pos)
+            if start < 0:
+                # keep a possible first half of the sync word (not the last byte of a frame just decoded)
+                keep = 1 if len(buffer) > pos and buffer[-1:] == SYNC[:1] else 0
+                self._discard(len(buffer) - pos - keep)
+                pos = len(buffer) - keep
+                break
+            if start > pos:
+                self._discard(start - pos)
+            if len(buffer) - start < FRAME_SIZE:
+                pos = start
+                break
+            if self._single <= 0 and len(buffer) - start >= BATCH_FRAMES * FRAME_SIZE:
+                decoded = self._decode_run(buffer, start)
+                if len(decoded) < BATCH_FRAMES:
+                    self._single = MAX_BATCH_FRAMES
+                if decoded:
+                    frames.extend(decoded)
+                    pos = start + len(decoded) * FRAME_SIZE
+                    continue
+            self._single = self._single - 1
+            body = bytes(buffer[start + 2:start + FRAME_SIZE - 2])
+            (crc,) = struct.unpack_from('<H', buffer, start + FRAME_SIZE - 2)
+            if crc16(body) != crc:
+                # not a frame (or a damaged one): look for the next sync word
+                self.corrupt = self.corrupt + 1
+                self.resyncs = self.resyncs + 1
+                pos = start + 1
+                continue
+            frames.append(self._decode(body))
+            pos = start + FRAME_SIZE
+        del buffer[:pos]
+        return frames
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'corrupt': self.corrupt,
+            'dropped': self.dropped,
+            'resyncs': self.resyncs,
+            'discarded_bytes': self.discarded_bytes,
+        }
+
+    def _discard(self, count):
+        if count > 0:
+            self.discarded_bytes = self.discarded_bytes + count
+            self.resyncs = self.resyncs + 1
+
+    def _decode_run(self, buffer, start):
+        # frames back to back from start, up to the first one that is not valid
+        count = min((len(buffer) - start) // FRAME_SIZE, MAX_BATCH_FRAMES)
+        # copied: a NumPy view would prevent resizing the bytearray
+        data = np.frombuffer(bytes(buffer[start:start + count * FRAME_SIZE]), dtype=np.uint8).reshape(count, FRAME_SIZE)
+        crc = np.full(count, 0xFFFF, dtype=np.uint16)
+        for column in range(2, FRAME_SIZE - 2):
+            crc = (crc << 8) ^ _CRC16_ARRAY[(crc >> 8) ^ data[:, column]]
+        valid = (data[:, 0] == SYNC[0]) & (data[:, 1] == SYNC[1])
+        valid &= crc == (data[:, -2].astype(np.uint16) | (data[:, -1].astype(np.uint16) << 8))
+        count = int(np.argmin(valid)) if not valid.all() else count
+        if count == 0:
+            return []
+        data = data[:count]
+
+        seqs = data[:, 2].astype(np.int64) | (data[:, 3].astype(np.int64) << 8)
+        expected = np.empty(count, dtype=np.int64)
+        expected[0] = seqs[0] if self._expected_seq is None else self._expected_seq
+        expected[1:] = seqs[:-1] + 1
+        self.dropped = self.dropped + int(np.sum((seqs - expected) & 0xFFFF))
+        self._expected_seq = int(seqs[-1] + 1) & 0xFFFF
+        self.frames = self.frames + count
+
+        raw = data[:, 4:4 + PAYLOAD_SIZE].reshape(count, CHANNELS, 3).astype(np.int32)
+        raw = raw[:, :, 0] | (raw[:, :, 1] << 8) | (raw[:, :, 2] << 16)
+        raw = np.where(raw & 0x800000, raw - 0x1000000, raw)
+        values = raw / RAW_SCALE + np.array(self.capdac) * CAPDAC_FACTOR
+        return [Frame(seq, row) for seq, row in zip(seqs.tolist(), values.tolist())]
+
+    def _decode(self, body):
+        (seq,) = struct.unpack_from('<H', body)
+        values = []
+        for ch in range(CHANNELS):
+            raw = int.from_bytes(body[2 + 3 * ch:5 + 3 * ch], 'little', signed=True)
+            values.append(raw_to_pf(raw, self.capdac[ch]))
+        if self._expected_seq is not None and seq != self._expected_seq:
+            self.dropped = self.dropped + ((seq - self._expected_seq) & 0xFFFF)
+        self._expected_seq = (seq + 1) & 0xFFFF
+        self.frames = self.frames + 1
+        return Frame(seq, values)
+
+
+#######################
+# ASCII_FRAME_DECODER #
+#######################
+class AsciiFrameDecoder:
+    """!
+    @brief Streaming decoder of the SOS/values/EOS text frames.
+
+    Lines outside a frame (boot banner, I2C scan) are ignored. A frame
+    with a wrong number of values or a value that is not a number is
+    counted as corrupt and skipped instead of raising. Well-formed frames
+    are matched whole; anything else goes through the line by line path.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._lines = None
+        self._seq = 0
+
+        self.frames = 0
+        self.corrupt = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.discarded_bytes = 0
+
+    def feed(self, data):
+        """!
+        @brief Add received bytes and return the list of complete frames.
+        """
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        pos = 0
+        while True:
+            if self._lines is None:
+                match = _ASCII_FRAME.match(buffer, pos)
+                if match is not None:
+                    frames.append(self._decode(match.groups()))
+                    pos = match.end()
+                    continue
+            end = buffer.find(b'\n', pos)
+            if end < 0:
+                if len(buffer) - pos > MAX_LINE_LENGTH:
+                    # no line ending in sight: this is not an ASCII stream
+                    self.discarded_bytes = self.discarded_bytes + len(buffer) - pos
+                    pos = len(buffer)
+                break
+            line = bytes(buffer[pos:end]).strip()
+            size = end + 1 - pos
+            pos = end + 1
+            if line == ASCII_START:
+                if self._lines is not None:
+                    # a new frame started before the previous one ended
+                    self.corrupt = self.corrupt + 1
+                    self.resyncs = self.resyncs + 1
+                self._lines = []
+            elif self._lines is None:
+                self.discarded_bytes = self.discarded_bytes + size
+            elif line == ASCII_END:
+                frame = self._decode(self._lines)
+                if frame is not None:
+                    frames.append(frame)
+                self._lines = None
+            else:
+                self._lines.append(line)
+        del buffer[:pos]
+        return frames
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'corrupt': self.corrupt,
+            'dropped': self.dropped,
+            'resyncs': self.resyncs,
+            'discarded_bytes': self.discarded_bytes,
+        }
+
+    def _decode(self, lines):
+        try:
+            values = [float(line) for line in lines]
+        except ValueError:
+            values = []
+        if len(values) != CHANNELS:
+            self.corrupt = self.corrupt + 1
+            return None
+        seq = self._seq
+        self._seq = (self._seq + 1) & 0xFFFF
+        self.frames = self.frames + 1
+        return Frame(seq, values)
+
+
+######################
+# AUTO_FRAME_DECODER #
+######################
+class AutoFrameDecoder:
+    """!
+    @brief Decoder that detects which protocol the device is speaking.
+
+    Bytes are fed to both decoders until one of them returns a valid
+    frame, then the decoder locks to that protocol.
+    """
+
+    def __init__(self, capdac=DEFAULT_CAPDAC):
+        self._candidates = [AsciiFrameDecoder(), BinaryFrameDecoder(capdac)]
+        self.decoder = None
+
+    @property
+    def protocol(self):
+        if self.decoder is None:
+            return None
+        return 'binary' if isinstance(self.decoder, BinaryFrameDecoder) else 'ascii'
+
+    def feed(self, data):
+        if self.decoder is not None:
+            return self.decoder.feed(data)
+        for decoder in self._candidates:
+            frames = decoder.feed(data)
+            if frames:
+                self.decoder = decoder
+                self._candidates = []
+                logging.info("Detected {} protocol".format(self.protocol))
+                return frames
+        return []
+
+    def stats(self):
+        if self.decoder is None:
+            return self._candidates[0].stats()
+        return self.decoder.stats()
+
+
+def make_decoder(protocol='auto', capdac=DEFAULT_CAPDAC):
+    """!
+    @brief Create the streaming decoder for the given protocol name.
+
+    @param protocol one of 'ascii', 'binary' or 'auto'.
+    @param capdac CAPDAC setting of each channel, used to convert binary frames to pF.
+    """
+    if protocol == 'ascii':
+        return AsciiFrameDecoder()
+    if protocol == 'binary':
+        return BinaryFrameDecoder(capdac)
+    if protocol == 'auto':
+        return AutoFrameDecoder(capdac)
+    raise ValueError("Unknown protocol {!r}, expected one of {}".format(protocol, PROTOCOLS))
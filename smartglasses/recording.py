@@ -0,0 +1,232 @@
+"""!
+@brief Record the raw byte stream of the glasses and replay it through the pipeline.
+
+A recording (.sgrec) holds a small JSON header (port, baudrate, start
+time) followed by every chunk of bytes read from the port, each preceded
+by the time it arrived relative to the start. RecordingSource wraps a
+serial source and writes what it reads; ReplaySource reads a recording
+back, at the original pace (or faster) or as fast as possible, as a
+drop-in replacement for SerialSource. The bytes go through the unchanged
+decoding, calibration and prediction code, so a replay is a
+deterministic regression run of a real session and, at full speed, a
+measure of the throughput of the host pipeline.
+
+Usage (from the top of the repository):
+
+    python -m smartglasses.pipeline /dev/ttyACM0 --record session.sgrec
+    python -m smartglasses.pipeline session.sgrec --speed 0
+"""
+import json
+import time
+import struct
+import asyncio
+import threading
+
+RECORDING_EXTENSION = '.sgrec'
+RECORDING_VERSION = 1
+MAGIC = b'SGREC'
+
+# magic, version, length of the JSON metadata
+_HEADER = struct.Struct('<5sBI')
+# seconds since the start of the recording, length of the chunk
+_CHUNK = struct.Struct('<dI')
+
+
+def is_recording(path):
+    return isinstance(path, str) and path.lower().endswith(RECORDING_EXTENSION)
+
+
+####################
+# SESSION_RECORDER #
+####################
+class SessionRecorder:
+    """!
+    @brief Writer of a recording file.
+    """
+
+    def __init__(self, path, **metadata):
+        """!
+        @param metadata entries of the header (e.g. port and baudrate), the start time is added.
+        """
+        self.path = path
+        self.start = time.monotonic()
+        self.chunks = 0
+        self.bytes = 0
+        self.metadata = dict(metadata, started=time.time())
+        encoded = json.dumps(self.metadata).encode()
+        self.file = open(path, 'wb')
+        self.file.write(_HEADER.pack(MAGIC, RECORDING_VERSION, len(encoded)))
+        self.file.write(encoded)
+
+    def write(self, data, arrived=None):
+        """!
+        @brief Append a chunk of bytes and the time.monotonic() it arrived (now if None).
+        """
+        arrived = time.monotonic() if arrived is None else arrived
+        self.file.write(_CHUNK.pack(arrived - self.start, len(data)))
+        self.file.write(data)
+        self.chunks = self.chunks + 1
+        self.bytes = self.bytes + len(data)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_metadata(file):
+    """!
+    @brief Read the header of an open recording and return its metadata.
+    """
+    header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError("Not a recording: {}".format(file.name))
+    magic, version, length = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a recording: {}".format(file.name))
+    if version != RECORDING_VERSION:
+        raise ValueError("Unsupported recording version {}".format(version))
+    return json.loads(file.read(length).decode())
+
+
+def iter_chunks(path):
+    """!
+    @brief Iterate over the (seconds since the start, bytes) chunks of a recording.
+
+    A chunk cut by the end of the file (recording interrupted) is ignored.
+    """
+    with open(path, 'rb') as file:
+        read_metadata(file)
+        while True:
+            header = file.read(_CHUNK.size)
+            if len(header) < _CHUNK.size:
+                return
+            offset, length = _CHUNK.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield offset, data
+
+
+####################
+# RECORDING_SOURCE #
+####################
+class RecordingSource:
+    """!
+    @brief Source wrapper writing every chunk read to a recording.
+
+    The file is created when the port is opened and closed at the end of the
+    stream.
+    """
+
+    def __init__(self, source, path, **metadata):
+        """!
+        @param source SerialSource or AsyncSerialSource to record.
+        @param path recording file to write.
+        """
+        self.source = source
+        self.path = path
+        self.metadata = metadata
+        self.recorder = None
+
+    @property
+    def port(self):
+        return self.source.port
+
+    def open(self):
+        opened = self.source.open()
+        if self.recorder is None:
+            self.recorder = SessionRecorder(self.path, **self.metadata)
+        return opened
+
+    def close(self):
+        self.source.close()
+
+    def __iter__(self):
+        if self.recorder is None:
+            self.recorder = SessionRecorder(self.path, **self.metadata)
+        try:
+            for data in self.source:
+                self.recorder.write(data)
+                yield data
+        finally:
+            self.recorder.close()
+
+    async def _chunks(self):
+        if self.recorder is None:
+            self.recorder = SessionRecorder(self.path, **self.metadata)
+        try:
+            async for data in self.source:
+                self.recorder.write(data)
+                yield data
+        finally:
+            self.recorder.close()
+
+    def __aiter__(self):
+        return self._chunks()
+
+
+#################
+# REPLAY_SOURCE #
+#################
+class ReplaySource:
+    """!
+    @brief Iterable over the chunks of a recording, in place of a SerialSource.
+    """
+
+    def __init__(self, path, speed=1.0):
+        """!
+        @param path recording file.
+        @param speed replay speed relative to the recording (2 = twice as fast); 0 or None to replay
+            as fast as possible.
+        """
+        self.port_name = path
+        self.path = path
+        self.speed = speed
+        self.port = None
+        self.metadata = None
+        self._closed = threading.Event()
+
+    def open(self):
+        """!
+        @brief Check the recording and read its metadata.
+        """
+        self._closed.clear()
+        with open(self.path, 'rb') as file:
+            self.metadata = read_metadata(file)
+        return True
+
+    def close(self):
+        self._closed.set()
+
+    def _delay(self, start, offset):
+        return start + offset / self.speed - time.monotonic()
+
+    def __iter__(self):
+        start = time.monotonic()
+        for offset, data in iter_chunks(self.path):
+            if self.speed:
+                delay = self._delay(start, offset)
+                if delay > 0 and self._closed.wait(delay):
+                    return
+            if self._closed.is_set():
+                return
+            yield data
+
+    async def _chunks(self):
+        start = time.monotonic()
+        for offset, data in iter_chunks(self.path):
+            delay = self._delay(start, offset) if self.speed else 0
+            # yield to the other readers of the loop even at full speed
+            await asyncio.sleep(max(delay, 0))
+            if self._closed.is_set():
+                return
+            yield data
+
+    def __aiter__(self):
+        return self._chunks()
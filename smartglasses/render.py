@@ -0,0 +1,191 @@
+"""!
+@brief Plot rendering decoupled from the sample rate.
+
+PlotRenderer is called by a timer of the GUI at a fixed frame rate. At
+each frame it takes the latest snapshot of the sample history, keeps the
+requested time span, reduces it with min/max decimation to a bounded
+number of points and updates the curves. Redraw cost therefore depends
+neither on the sample rate nor on the length of the history shown.
+FrameCounter records the frame times so that it can be checked that the
+plot keeps up with the stream.
+"""
+import time
+from collections import deque
+
+import numpy as np
+
+# Frames drawn per second
+FRAME_RATE = 20
+# Maximum points drawn per curve (two per decimation bucket)
+MAX_POINTS = 2000
+
+
+def minmax_decimate(x, y, max_points=MAX_POINTS):
+    """!
+    @brief Reduce curves to the minimum and maximum of equal buckets of samples.
+
+    The envelope of the signal is preserved whatever the reduction, so
+    spikes stay visible in a long history.
+    @param x (samples,) shared x coordinates.
+    @param y (samples,) or (curves, samples) values.
+    @return x and y with at most max_points samples.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    samples = x.shape[0]
+    if samples <= max_points:
+        return x, y
+    buckets = max(max_points // 2, 1)
+    starts = np.linspace(0, samples, buckets + 1).astype(np.intp)
+    ends = starts[1:] - 1
+    starts = starts[:-1]
+
+    decimated_x = np.empty(2 * buckets, dtype=x.dtype)
+    decimated_x[0::2] = x[starts]
+    decimated_x[1::2] = x[ends]
+    decimated_y = np.empty(y.shape[:-1] + (2 * buckets,), dtype=y.dtype)
+    decimated_y[..., 0::2] = np.minimum.reduceat(y, starts, axis=-1)
+    decimated_y[..., 1::2] = np.maximum.reduceat(y, starts, axis=-1)
+    return decimated_x, decimated_y
+
+
+#################
+# FRAME_COUNTER #
+#################
+class FrameCounter:
+    """!
+    @brief Statistics of the time spent drawing frames and of the time between them.
+
+    A frame is late when it starts more than half a period after it was
+    due, i.e. when the GUI thread could not keep up with the frame rate.
+    """
+
+    def __init__(self, frame_rate=FRAME_RATE, window=100):
+        self.period = 1.0 / frame_rate
+        self.frames = 0
+        self.skipped = 0
+        self.late = 0
+        self.durations = deque(maxlen=window)
+        self.intervals = deque(maxlen=window)
+        self._last_start = None
+
+    def tick(self, start):
+        """!
+        @brief Record the start of a timer tick.
+        """
+        if self._last_start is not None:
+            interval = start - self._last_start
+            self.intervals.append(interval)
+            if interval > 1.5 * self.period:
+                self.late = self.late + 1
+        self._last_start = start
+
+    def pause(self):
+        """!
+        @brief Forget the last tick, so that the next one after a pause is not counted as late.
+        """
+        self._last_start = None
+
+    def drawn(self, duration):
+        self.frames = self.frames + 1
+        self.durations.append(duration)
+
+    def skip(self):
+        """!
+        @brief Record a tick without new data to draw.
+        """
+        self.skipped = self.skipped + 1
+
+    def stats(self):
+        """!
+        @brief Frames drawn and skipped, late ticks, actual rate and frame times (mean and max, in s).
+        """
+        intervals = np.asarray(self.intervals)
+        durations = np.asarray(self.durations)
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'late': self.late,
+            'fps': float(1.0 / intervals.mean()) if len(intervals) else 0.0,
+            'frame_mean': float(durations.mean()) if len(durations) else 0.0,
+            'frame_max': float(durations.max()) if len(durations) else 0.0,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return "Plot {:.1f} fps, frame {:.1f} ms (max {:.1f} ms), {} late".format(
+            stats['fps'], stats['frame_mean'] * 1000, stats['frame_max'] * 1000, stats['late'])
+
+
+#################
+# PLOT_RENDERER #
+#################
+class PlotRenderer:
+    """!
+    @brief Draw the latest samples of the history on a set of curves.
+    """
+
+    def __init__(self, curves, history, span=None, max_points=MAX_POINTS, frame_rate=FRAME_RATE):
+        """!
+        @param curves one object per channel with a setData(x=, y=) method (e.g. pyqtgraph PlotDataItem).
+        @param history function taking the span in seconds (None for the whole history) and returning
+            (version, rows): a number that changes when samples are added and a
+            (samples, 1 + channels) array of times and values covering at least the span.
+        @param span seconds of history shown (None for the whole history).
+        @param max_points maximum points drawn per curve.
+        @param frame_rate frames per second the renderer is called at.
+        """
+        self.curves = curves
+        self.history = history
+        self.span = span
+        self.max_points = max_points
+        self.offset = np.zeros(len(curves))
+        self.counter = FrameCounter(frame_rate)
+        self._drawn = None
+
+    def set_offset(self, offset):
+        """!
+        @brief Values subtracted from the channels (the calibration means).
+        """
+        self.offset = np.asarray(offset, dtype=float)
+
+    def set_span(self, span):
+        self.span = span
+
+    def pause(self):
+        """!
+        @brief Call instead of render() while the plot is not updated.
+        """
+        self.counter.pause()
+
+    def clear(self):
+        self._drawn = None
+        for curve in self.curves:
+            curve.setData(x=[], y=[])
+
+    def render(self):
+        """!
+        @brief Draw a frame if there is something new to show.
+
+        @return True if the curves were updated.
+        """
+        start = time.perf_counter()
+        self.counter.tick(start)
+        version, rows = self.history(self.span)
+        key = (version, tuple(self.offset), self.span)
+        if key == self._drawn or not len(rows):
+            self.counter.skip()
+            return False
+
+        times = rows[:, 0]
+        if self.span is not None:
+            rows = rows[np.searchsorted(times, times[-1] - self.span):]
+            times = rows[:, 0]
+        values = rows[:, 1:].T - self.offset[:, None]
+        x, y = minmax_decimate(times, values, self.max_points)
+        for curve, curve_y in zip(self.curves, y):
+            curve.setData(x=x, y=curve_y)
+
+        self._drawn = key
+        self.counter.drawn(time.perf_counter() - start)
+        return True
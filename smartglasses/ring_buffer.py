@@ -0,0 +1,101 @@
+import numpy as np
+
+
+######################
+# SAMPLE_RING_BUFFER #
+######################
+class SampleRingBuffer:
+    """!
+    @brief Fixed-capacity history of capacitance samples.
+
+    Each row holds a timestamp followed by one value per channel. The rows
+    are stored twice, at index i and i + capacity, so the most recent
+    samples are always a contiguous slice of the array: appending is O(1)
+    and ordered views never copy.
+    """
+
+    def __init__(self, capacity=50, channels=4, dtype=np.float64):
+        """!
+        @brief Allocate the buffer.
+
+        @param capacity number of samples kept in the history.
+        @param channels number of capacitance channels per sample.
+        @param dtype data type of the stored values.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1, got {}".format(capacity))
+        self.capacity = capacity
+        self.channels = channels
+        self._data = np.zeros((2 * capacity, channels + 1), dtype=dtype)
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def full(self):
+        return self._count == self.capacity
+
+    def append(self, timestamp, values):
+        """!
+        @brief Add a sample, dropping the oldest one if the buffer is full.
+
+        @param timestamp time of the sample.
+        @param values sequence with one value per channel.
+        """
+        row = self._data[self._head]
+        row[0] = timestamp
+        row[1:] = values
+        self._data[self._head + self.capacity] = row
+        self._head = (self._head + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count = self._count + 1
+
+    def clear(self):
+        """!
+        @brief Drop every sample without releasing the memory.
+        """
+        self._head = 0
+        self._count = 0
+
+    def view(self):
+        """!
+        @brief Samples from the oldest to the newest as a (samples, 1 + channels) view.
+
+        The view shares memory with the buffer, so it is only valid until
+        the next append. Use snapshot() to keep the data.
+        """
+        start = self._head - self._count + self.capacity
+        return self._data[start:start + self._count]
+
+    def snapshot(self):
+        """!
+        @brief Copy of view() that stays valid after further appends.
+        """
+        return self.view().copy()
+
+    def times(self):
+        """!
+        @brief Ordered view of the timestamp column.
+        """
+        return self.view()[:, 0]
+
+    def values(self):
+        """!
+        @brief Ordered (samples, channels) view of the capacitance values.
+        """
+        return self.view()[:, 1:]
+
+    def channel(self, index):
+        """!
+        @brief Ordered view of a single channel (0 is the first capacitance channel).
+        """
+        return self.view()[:, index + 1]
+
+    def latest(self, count):
+        """!
+        @brief View of the last count samples (or fewer if not available yet).
+        """
+        view = self.view()
+        return view[max(len(view) - count, 0):]
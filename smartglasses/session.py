@@ -0,0 +1,364 @@
+"""!
+@brief One session per pair of glasses, so that several devices can be followed at once.
+
+A DeviceSession owns everything about one device: the serial source, the
+pipeline with its calibration, buffers and prediction state, and the
+thread reading the port. Sessions share nothing but the (read-only)
+model, and each one reads and processes its own stream in its own
+thread, so a slow or stalled device does not delay the others. With the
+'asyncio' backend the sessions are instead read together by one
+SerialLoop thread, woken up only when bytes arrive.
+
+Usage (from the top of the repository), e.g. against two emulators:
+
+    python -m smartglasses.session /tmp/glasses1 /tmp/glasses2 --model GUI/mlp_1.npz
+    python -m smartglasses.session /tmp/glasses1 /tmp/glasses2 --backend asyncio
+"""
+import sys
+import logging
+import argparse
+import threading
+import concurrent.futures
+
+from smartglasses.async_serial import AsyncSerialSource, SerialLoop
+from smartglasses.recording import RecordingSource, ReplaySource, is_recording
+from smartglasses.profiles import ProfileStore, device_id
+from smartglasses.calibration import CALIBRATION_TOLERANCE
+from smartglasses.ingest import read_size, MODEL_RATE
+from smartglasses.pipeline import (
+    InferencePipeline,
+    SerialSource,
+    Event,
+    dump_on_signal,
+    log_latency,
+    log_link_budget,
+    log_headroom,
+    CALIBRATED,
+    PREDICTION,
+    PROFILE
+)
+
+# Ways of reading the ports: one blocking thread per device, or one asyncio loop for all
+BACKENDS = ('thread', 'asyncio')
+
+
+##################
+# DEVICE_SESSION #
+##################
+class DeviceSession:
+    """!
+    @brief Serial connection, pipeline and reader thread of one device.
+    """
+
+    def __init__(self, port_name, model_manager=None, baudrate=9600, protocol='auto', history=50, name=None,
+                 backend='thread', record=None, replay_speed=1.0, background_inference=False,
+                 adaptive_baseline=False, profiles=None, user='', calibration_tolerance=None, input_rate=None):
+        """!
+        @param port_name serial port of the device, or a recording (.sgrec) to replay.
+        @param model_manager ModelManager shared by the sessions (None to only collect windows).
+        @param name label of the session in logs (the port name by default).
+        @param backend 'thread' to read the port in a thread of its own, 'asyncio' to read it on a SerialLoop.
+        @param record recording file to write the bytes received to (None not to record).
+        @param replay_speed speed of the replay of a recording (0 = as fast as possible).
+        @param background_inference classify in an inference thread of the session, so that reading the
+            device never waits for the model; the predictions reach the callback of start() from that thread.
+        @param adaptive_baseline keep updating the baseline at rest after the calibration (BASELINE events).
+        @param profiles ProfileStore the calibrations of the device are saved to and restored from.
+        @param user user wearing the glasses, the profiles are kept per device and user.
+        @param calibration_tolerance stop the calibration as soon as the baseline is known within this, in pF.
+        @param input_rate frames per second sent by the device, decimated to the 10 Hz of the models (None for 10 Hz).
+        """
+        if backend not in BACKENDS:
+            raise ValueError("backend must be one of {}, got {!r}".format(BACKENDS, backend))
+        self.port_name = port_name
+        self.name = name if name is not None else port_name
+        self.backend = backend
+        self.pipeline = InferencePipeline(model_manager, protocol=protocol, history=history,
+                                          background_inference=background_inference,
+                                          adaptive_baseline=adaptive_baseline,
+                                          calibration_tolerance=calibration_tolerance, input_rate=input_rate)
+        if is_recording(port_name):
+            self.source = ReplaySource(port_name, replay_speed)
+        elif backend == 'asyncio':
+            self.source = AsyncSerialSource(port_name, baudrate, metrics=self.pipeline.metrics)
+        else:
+            self.source = SerialSource(port_name, baudrate, metrics=self.pipeline.metrics,
+                                       read_size=read_size(self.pipeline.input_rate))
+        if record is not None:
+            self.source = RecordingSource(self.source, record, port=port_name, baudrate=baudrate)
+        self.connected = False
+        self.error = None
+        self._thread = None
+        self._future = None
+        self._callback = None
+        self.profiles = profiles
+        self.user = user
+        self._device = None
+        if profiles is not None:
+            self.pipeline.subscribe(CALIBRATED, self._save_profile)
+        if background_inference:
+            self.pipeline.subscribe(PREDICTION, self._background_prediction)
+
+    @property
+    def thread_id(self):
+        """!
+        @brief Identifier of the thread reading the device (thread backend, None if not running).
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return None
+        return self._thread.ident
+
+    @property
+    def device(self):
+        """!
+        @brief Stable identifier of the device (see smartglasses.profiles.device_id).
+        """
+        if self._device is None:
+            self._device = self.port_name if is_recording(self.port_name) else device_id(self.port_name)
+        return self._device
+
+    def restore_calibration(self, fallback=True):
+        """!
+        @brief Check the first samples against the saved profile of the device and user instead of calibrating.
+
+        @param fallback start a full calibration if the samples do not agree with the profile.
+        @return the Profile checked, None if there is none (a calibration is needed).
+        """
+        if self.profiles is None:
+            return None
+        profile = self.profiles.get(self.device, self.user)
+        if profile is not None:
+            self.pipeline.check_profile(profile, fallback)
+        return profile
+
+    def open(self):
+        """!
+        @brief Open the serial port (raises serial.SerialException on failure).
+        """
+        self.error = None
+        self.connected = self.source.open()
+        return self.connected
+
+    def close(self):
+        self.source.close()
+        self.connected = False
+
+    def events(self):
+        """!
+        @brief Generator of the events of the device, until the port is closed.
+        """
+        try:
+            yield from self.pipeline.run(self.source)
+        finally:
+            self.connected = False
+
+    async def aevents(self):
+        """!
+        @brief Asynchronous generator of the events of the device (asyncio backend).
+        """
+        try:
+            async for data in self.source:
+                for event in self.pipeline.feed(data):
+                    yield event
+        finally:
+            self.connected = False
+
+    def start(self, callback, serial_loop=None):
+        """!
+        @brief Open the port and process the stream in a dedicated thread (or on the SerialLoop).
+
+        @param callback function called with (session, event) for every event, from the reading thread
+            (from the inference thread for the predictions made in the background).
+        @param serial_loop SerialLoop running the asyncio sessions.
+        """
+        self._callback = callback
+        if self.backend == 'asyncio':
+            if self._future is None or self._future.done():
+                self._future = serial_loop.submit(self.read(callback))
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, args=(callback,),
+                                        name="Session-{}".format(self.name), daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """!
+        @brief Close the port and wait for the session to finish.
+        """
+        self.close()
+        self.pipeline.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._future is not None:
+            try:
+                self._future.result(timeout)
+            except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+                pass
+            self._future = None
+
+    async def read(self, callback):
+        """!
+        @brief Coroutine opening the port and processing the stream (asyncio backend).
+        """
+        try:
+            self.open()
+            async for event in self.aevents():
+                callback(self, event)
+        except Exception as error:
+            self.error = error
+            logging.info("Session {} stopped: {}".format(self.name, error))
+
+    def _save_profile(self, means):
+        # only the full calibrations are saved, not the ones restored from a profile
+        calibrator = self.pipeline.calibrator
+        if calibrator.restored:
+            return
+        try:
+            self.profiles.save(self.device, self.user, means, calibrator.variances, self.port_name)
+        except OSError as error:
+            logging.info("Could not save the calibration of {}: {}".format(self.name, error))
+
+    def _background_prediction(self, label):
+        # the events of the inference thread are not returned by events()
+        if self._callback is not None:
+            self._callback(self, Event(PREDICTION, label))
+
+    def _run(self, callback):
+        try:
+            self.open()
+            for event in self.events():
+                callback(self, event)
+        except Exception as error:
+            self.error = error
+            logging.info("Session {} stopped: {}".format(self.name, error))
+
+
+###################
+# SESSION_MANAGER #
+###################
+class SessionManager:
+    """!
+    @brief The sessions of the devices followed by one application.
+    """
+
+    def __init__(self, model_manager=None, **options):
+        """!
+        @param options default DeviceSession options (baudrate, protocol, history, backend, background_inference,
+            adaptive_baseline, profiles, user, calibration_tolerance, input_rate).
+        """
+        self.model_manager = model_manager
+        self.options = options
+        self.sessions = {}
+        # reads the ports of the asyncio sessions, started with the first one
+        self.serial_loop = SerialLoop()
+
+    def add(self, port_name, **options):
+        """!
+        @brief Create the session of a device (or return the existing one).
+        """
+        if port_name not in self.sessions:
+            settings = dict(self.options, **options)
+            self.sessions[port_name] = DeviceSession(port_name, self.model_manager, **settings)
+        return self.sessions[port_name]
+
+    def remove(self, port_name):
+        session = self.sessions.pop(port_name, None)
+        if session is not None:
+            session.stop()
+        return session
+
+    def __iter__(self):
+        return iter(list(self.sessions.values()))
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def start(self, callback):
+        for session in self:
+            session.start(callback, self.serial_loop)
+
+    def stop(self):
+        for session in self:
+            session.stop()
+        self.serial_loop.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate and classify the streams of several glasses at once.")
+    parser.add_argument('ports', nargs='+', help="serial ports of the glasses (or of the emulators, or .sgrec recordings)")
+    parser.add_argument('--model', default='GUI/mlp_1.npz', help="trained classifier (.npz export or sklearn pickle)")
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--protocol', choices=('ascii', 'binary', 'auto'), default='auto')
+    parser.add_argument('--rate', type=int, default=MODEL_RATE, metavar='HZ',
+                        help="frames per second sent by the glasses, decimated to {} Hz (default {})".format(
+                            MODEL_RATE, MODEL_RATE))
+    parser.add_argument('--backend', choices=BACKENDS, default='thread',
+                        help="one reading thread per device, or one asyncio loop for all")
+    parser.add_argument('--adaptive-baseline', action='store_true',
+                        help="keep following the drift of the signal at rest after the calibration")
+    parser.add_argument('--calibration-tolerance', type=float, default=None, metavar='PF',
+                        help="stop the calibration once the baseline is known within PF (e.g. {})".format(
+                            CALIBRATION_TOLERANCE))
+    parser.add_argument('--background', action='store_true', help="classify in an inference thread per device")
+    parser.add_argument('--profiles', default=None, metavar='FILE',
+                        help="save the calibrations to FILE and reuse them when the first samples agree")
+    parser.add_argument('--user', default='', help="user wearing the glasses (profiles are kept per device and user)")
+    parser.add_argument('--duration', type=float, default=None, help="stop after this many seconds")
+    parser.add_argument('--metrics', default=None, metavar='FILE',
+                        help="append the metrics of every device to FILE at exit and on SIGUSR1")
+    args = parser.parse_args(argv)
+
+    from smartglasses.model_manager import ModelManager
+
+    logging.basicConfig(level=logging.INFO)
+    manager = SessionManager(ModelManager(args.model), baudrate=args.baudrate, protocol=args.protocol,
+                             backend=args.backend, background_inference=args.background,
+                             adaptive_baseline=args.adaptive_baseline,
+                             profiles=ProfileStore(args.profiles) if args.profiles else None, user=args.user,
+                             calibration_tolerance=args.calibration_tolerance, input_rate=args.rate)
+    log_link_budget(args.rate, args.protocol, args.baudrate)
+    for port in args.ports:
+        session = manager.add(port)
+        if session.restore_calibration() is None:
+            session.pipeline.start_calibration()
+
+    def on_event(session, event):
+        if event.kind == PROFILE:
+            result = event.data
+            logging.info("{}: saved calibration {} (difference {:.3f} pF, range {:.3f} pF)".format(
+                session.name, "reused" if result.accepted else "rejected, calibrating", result.deviation, result.spread))
+        elif event.kind == CALIBRATED:
+            logging.info("{}: calibration done {} ({:.1f} s saved)".format(
+                session.name, event.data, session.pipeline.metrics.gauges.get('calibration_saved', 0.0)))
+            session.pipeline.start_window()
+        elif event.kind == PREDICTION:
+            print("{}: {}".format(session.name, event.data), flush=True)
+            session.pipeline.start_window()
+
+    def dump_metrics():
+        for session in manager:
+            session.pipeline.metrics.dump(args.metrics, device=session.name, latency=session.pipeline.latency.report())
+
+    if args.metrics:
+        dump_on_signal(dump_metrics)
+    manager.start(on_event)
+    stop = threading.Event()
+    try:
+        stop.wait(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.stop()
+        if args.metrics:
+            dump_metrics()
+        for session in manager:
+            logging.info("{}:".format(session.name))
+            log_headroom(session.pipeline.metrics.snapshot(), args.baudrate)
+            log_latency(session.pipeline.latency)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import heapq
+from collections import deque
+
+import numpy as np
+
+from smartglasses.features import (
+    CHANNEL_NAMES,
+    FEATURE_CHANNELS,
+    FEATURE_NAMES,
+    MODE_DECIMALS
+)
+
+
+##################
+# RUNNING_WINDOW #
+##################
+class RunningWindow:
+    """!
+    @brief Mean, variance, min, max and mode of the last values of one channel.
+
+    Every statistic is updated when a value enters and when one leaves the
+    window, so the cost per value does not depend on the window length:
+      - mean and variance with the add/remove form of Welford's update,
+        recomputed exactly once per window length to stop rounding drift;
+      - min and max with monotonic deques (amortized O(1));
+      - the mode with a count per 2-decimal value, the number of values
+        with each count, so the highest count is always known, and a heap
+        of the values of each count, so the smallest value with the
+        highest count is found without scanning them (O(log n) when every
+        value of the window is distinct, instead of O(n)).
+    """
+
+    def __init__(self, length, ddof=0, decimals=MODE_DECIMALS):
+        self.length = length
+        self.ddof = ddof
+        self.scale = 10 ** decimals
+        self.values = deque()
+        self.count = 0
+
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._since_exact = 0
+
+        self._minima = deque()
+        self._maxima = deque()
+
+        self._counts = {}
+        self._sizes = {}
+        # values pushed with each count: an entry is stale once the count of its value changed,
+        # and is dropped when it reaches the top of the heap or when the heap is rebuilt
+        self._heaps = {}
+        self._top = 0
+
+    def add(self, value):
+        """!
+        @brief Add a value, removing the oldest one if the window is full.
+        """
+        index = self.count
+        self.count = self.count + 1
+        self.values.append((index, value))
+        self._add_moments(value)
+        self._add_extremes(index, value)
+        self._add_mode(value)
+
+        if len(self.values) > self.length:
+            old_index, old_value = self.values.popleft()
+            self._remove_moments(old_value)
+            self._remove_extremes(old_index)
+            self._remove_mode(old_value)
+
+        self._since_exact = self._since_exact + 1
+        if self._since_exact >= self.length:
+            self._exact_moments()
+
+    @property
+    def full(self):
+        return len(self.values) >= self.length
+
+    def var(self):
+        n = len(self.values)
+        return max(self._m2, 0.0) / (n - self.ddof) if n > self.ddof else 0.0
+
+    def min(self):
+        return self._minima[0][1]
+
+    def max(self):
+        return self._maxima[0][1]
+
+    def mode(self):
+        """!
+        @brief Most frequent 2-decimal value, the smallest one in case of ties.
+        """
+        heap = self._heaps[self._top]
+        while self._counts.get(heap[0]) != self._top:
+            heapq.heappop(heap)
+        return heap[0] / self.scale
+
+    def _add_moments(self, value):
+        n = len(self.values)
+        delta = value - self.mean
+        self.mean = self.mean + delta / n
+        self._m2 = self._m2 + delta * (value - self.mean)
+
+    def _remove_moments(self, value):
+        n = len(self.values)
+        delta = value - self.mean
+        self.mean = self.mean - delta / n
+        self._m2 = self._m2 - delta * (value - self.mean)
+
+    def _exact_moments(self):
+        values = np.fromiter((value for _, value in self.values), dtype=float, count=len(self.values))
+        self.mean = float(values.mean())
+        self._m2 = float(((values - self.mean) ** 2).sum())
+        self._since_exact = 0
+
+    def _add_extremes(self, index, value):
+        while self._minima and self._minima[-1][1] >= value:
+            self._minima.pop()
+        self._minima.append((index, value))
+        while self._maxima and self._maxima[-1][1] <= value:
+            self._maxima.pop()
+        self._maxima.append((index, value))
+
+    def _remove_extremes(self, index):
+        if self._minima[0][0] == index:
+            self._minima.popleft()
+        if self._maxima[0][0] == index:
+            self._maxima.popleft()
+
+    def _add_mode(self, value):
+        key = int(round(value * self.scale))
+        count = self._counts.get(key, 0)
+        if count:
+            self._sizes[count] = self._sizes[count] - 1
+        self._set_count(key, count + 1)
+        if count + 1 > self._top:
+            self._top = count + 1
+
+    def _remove_mode(self, value):
+        key = int(round(value * self.scale))
+        count = self._counts[key]
+        self._sizes[count] = self._sizes[count] - 1
+        if count > 1:
+            self._set_count(key, count - 1)
+        else:
+            del self._counts[key]
+        if not self._sizes[self._top]:
+            self._top = self._top - 1
+
+    def _set_count(self, key, count):
+        self._counts[key] = count
+        self._sizes[count] = self._sizes.get(count, 0) + 1
+        heap = self._heaps.setdefault(count, [])
+        heapq.heappush(heap, key)
+        if len(heap) > 2 * self._sizes[count] + 16:
+            # mostly stale entries: rebuilt in O(len(heap)), at most once every len(heap) / 2 pushes
+            heap[:] = [key for key in set(heap) if self._counts.get(key) == count]
+            heapq.heapify(heap)
+
+
+###########################
+# SLIDING_WINDOW_FEATURES #
+###########################
+class SlidingWindowFeatures:
+    """!
+    @brief The 20 features of the last samples, updated at every sample.
+
+    Features are returned every hop samples once the window is full, so
+    overlapping windows can be classified continuously.
+    """
+
+    def __init__(self, length=50, hop=1, ddof=0):
+        """!
+        @param length samples in a window.
+        @param hop samples between two consecutive windows.
+        @param ddof delta degrees of freedom of the variance (see extract_features).
+        """
+        self.length = length
+        self.hop = hop
+        self.ddof = ddof
+        self.reset()
+
+    def reset(self):
+        self.channels = [RunningWindow(self.length, self.ddof) for _ in CHANNEL_NAMES]
+        self._since_last = 0
+
+    def add(self, values):
+        """!
+        @brief Add a calibrated sample (4 values in the PSoC order).
+
+        @return the features of the current window every hop samples once the window is full, else None.
+        """
+        for channel, value in zip(self.channels, values):
+            channel.add(float(value))
+        if not self.channels[0].full:
+            return None
+        self._since_last = self._since_last + 1
+        if self._since_last < self.hop:
+            return None
+        self._since_last = 0
+        return self.features()
+
+    def features(self):
+        """!
+        @brief Features of the current window in the order of FEATURE_NAMES.
+        """
+        row = np.empty(len(FEATURE_NAMES))
+        for i, name in enumerate(FEATURE_CHANNELS):
+            channel = self.channels[CHANNEL_NAMES.index(name)]
+            row[5 * i:5 * i + 5] = (channel.mean, channel.var(), channel.mode(), channel.max(), channel.min())
+        return row
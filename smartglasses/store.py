@@ -0,0 +1,225 @@
+"""!
+@brief Append-only store of acquisition trials.
+
+A store is a folder with three binary files and a small description:
+
+    store.json      format version and channel names
+    samples.f4      raw samples of all the trials, float32 (samples, channels);
+                    enough for the 2^-19 pF step of the FDC1004 at a few pF
+    times.f8        host receive time of each sample, float64
+    trials.rec      one fixed-size record per trial (RECORD_DTYPE)
+
+Each trial record holds the label, subject and session, the calibration
+means, the trial start time and the position of its samples in
+samples.f4. Appending a trial writes its samples first and its record
+last, so a trial interrupted half way is never visible. Reading maps the
+files in memory: filtering by label or subject only looks at the small
+record table, and only the selected samples are loaded.
+"""
+import os
+import json
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from smartglasses.features import CHANNEL_NAMES
+
+STORE_VERSION = 1
+
+SAMPLES_FILE = 'samples.f4'
+TIMES_FILE = 'times.f8'
+TRIALS_FILE = 'trials.rec'
+INFO_FILE = 'store.json'
+
+SAMPLE_DTYPE = np.dtype('<f4')
+TIME_DTYPE = np.dtype('<f8')
+RECORD_DTYPE = np.dtype([
+    ('offset', '<u8'),          # first sample of the trial in samples.f4
+    ('length', '<u4'),          # samples in the trial
+    ('label', 'U24'),
+    ('subject', 'U32'),
+    ('session', 'U32'),
+    ('means', '<f8', (len(CHANNEL_NAMES),)),
+    ('start', '<f8'),           # host time of the first sample
+    ('saved', '<f8'),           # host time the trial was appended
+])
+
+# Text fields of a record, at most as many characters as their width in RECORD_DTYPE
+TEXT_FIELDS = ('label', 'subject', 'session')
+
+Trial = namedtuple('Trial', ['label', 'subject', 'session', 'means', 'times', 'raw'])
+
+
+def text_width(field):
+    """!
+    @brief Most characters of a text field of the trial records ('label', 'subject' or 'session').
+    """
+    return RECORD_DTYPE[field].itemsize // np.dtype('U1').itemsize
+
+
+#####################
+# ACQUISITION_STORE #
+#####################
+class AcquisitionStore:
+    """!
+    @brief Trials of the four channels with their label, subject, session and calibration.
+    """
+
+    def __init__(self, path):
+        """!
+        @brief Open the store in the given folder, creating it if needed.
+        """
+        self.path = path
+        self.channels = len(CHANNEL_NAMES)
+        info_path = os.path.join(path, INFO_FILE)
+        if os.path.exists(info_path):
+            with open(info_path) as file:
+                info = json.load(file)
+            if info.get('version') != STORE_VERSION:
+                raise ValueError("Unsupported store version {} in {}".format(info.get('version'), path))
+            if tuple(info.get('channels', ())) != CHANNEL_NAMES:
+                raise ValueError("Store {} has the channels {}, expected {}".format(path, info.get('channels'), list(CHANNEL_NAMES)))
+        else:
+            os.makedirs(path, exist_ok=True)
+            with open(info_path, 'w') as file:
+                json.dump({'version': STORE_VERSION, 'channels': list(CHANNEL_NAMES)}, file)
+            for name in (SAMPLES_FILE, TIMES_FILE, TRIALS_FILE):
+                open(os.path.join(path, name), 'ab').close()
+        self._records = None
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, INFO_FILE))
+
+    def append(self, raw, label, subject='', session='', means=None, times=None):
+        """!
+        @brief Append one trial.
+
+        @param raw (channels, samples) values in pF as received, in the PSoC channel order.
+        @param means calibration baseline of the trial (zeros if None).
+        @param times host receive time of each sample (NaN if None).
+        @return index of the new trial.
+
+        Raises ValueError if the label, subject or session is longer than its field
+        (NumPy would silently cut it, and the trial would not be found by that name).
+        """
+        for name, text in zip(TEXT_FIELDS, (label, subject, session)):
+            width = text_width(name)
+            if len(text) > width:
+                raise ValueError("The {} {!r} is longer than {} characters".format(name, text, width))
+        raw = np.asarray(raw, dtype=float)
+        if raw.ndim != 2 or raw.shape[0] != self.channels:
+            raise ValueError("Expected a ({}, samples) array, got shape {}".format(self.channels, raw.shape))
+        length = raw.shape[1]
+        times = np.full(length, np.nan) if times is None else np.asarray(times, dtype=float)
+        if times.shape != (length,):
+            raise ValueError("Expected {} times, got {}".format(length, times.shape))
+
+        samples_path = os.path.join(self.path, SAMPLES_FILE)
+        offset = os.path.getsize(samples_path) // (SAMPLE_DTYPE.itemsize * self.channels)
+        with open(samples_path, 'ab') as file:
+            file.write(raw.T.astype(SAMPLE_DTYPE).tobytes())
+        # samples left behind by an interrupted append are skipped by the offsets
+        with open(os.path.join(self.path, TIMES_FILE), 'r+b') as file:
+            file.seek(offset * TIME_DTYPE.itemsize)
+            file.write(times.astype(TIME_DTYPE).tobytes())
+
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record['offset'] = offset
+        record['length'] = length
+        record['label'] = label
+        record['subject'] = subject
+        record['session'] = session
+        record['means'] = np.zeros(self.channels) if means is None else means
+        record['start'] = times[0] if length else np.nan
+        record['saved'] = time.time()
+        with open(os.path.join(self.path, TRIALS_FILE), 'ab') as file:
+            file.write(record.tobytes())
+        self._records = None
+        return len(self) - 1
+
+    @property
+    def records(self):
+        """!
+        @brief Table of the trial records (memory-mapped, read only).
+        """
+        if self._records is None:
+            path = os.path.join(self.path, TRIALS_FILE)
+            count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+            if count:
+                self._records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+            else:
+                self._records = np.zeros(0, dtype=RECORD_DTYPE)
+        return self._records
+
+    def __len__(self):
+        return len(self.records)
+
+    def labels(self):
+        return sorted(set(self.records['label'].tolist()))
+
+    def subjects(self):
+        return sorted(set(self.records['subject'].tolist()))
+
+    def select(self, label=None, subject=None, session=None):
+        """!
+        @brief Indices of the trials matching the given label, subject and session.
+
+        Each filter can be a single value or a list of values; None matches everything.
+        """
+        records = self.records
+        mask = np.ones(len(records), dtype=bool)
+        for field, wanted in (('label', label), ('subject', subject), ('session', session)):
+            if wanted is not None:
+                wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+                mask &= np.isin(records[field], wanted)
+        return np.flatnonzero(mask)
+
+    def trial(self, index):
+        """!
+        @brief One trial with its metadata, raw values (channels, samples) and times.
+        """
+        record = self.records[index]
+        start, stop = int(record['offset']), int(record['offset']) + int(record['length'])
+        return Trial(str(record['label']), str(record['subject']), str(record['session']),
+                     tuple(float(mean) for mean in record['means']),
+                     np.array(self._times()[start:stop]),
+                     np.array(self._samples()[start:stop].T, dtype=float))
+
+    def windows(self, label=None, subject=None, session=None, calibrated=True):
+        """!
+        @brief Stack the selected trials into a (trials, channels, samples) array for training.
+
+        All the selected trials must have the same length.
+        @param calibrated subtract the calibration means of each trial.
+        @return the windows and the labels of the selected trials.
+        """
+        indices = self.select(label, subject, session)
+        records = self.records[indices]
+        lengths = set(records['length'].tolist())
+        if len(lengths) > 1:
+            raise ValueError("The selected trials have different lengths: {}".format(sorted(lengths)))
+        length = lengths.pop() if lengths else 0
+
+        samples = self._samples()
+        # (trials, samples) indices into samples.f4, gathered in one pass
+        rows = records['offset'].astype(np.int64)[:, None] + np.arange(length)
+        windows = np.asarray(samples[rows], dtype=float).transpose(0, 2, 1)
+        if calibrated:
+            windows = windows - records['means'].astype(float)[:, :, None]
+        return windows, records['label'].astype(str)
+
+    def _samples(self):
+        path = os.path.join(self.path, SAMPLES_FILE)
+        count = os.path.getsize(path) // (SAMPLE_DTYPE.itemsize * self.channels)
+        if not count:
+            return np.zeros((0, self.channels), dtype=SAMPLE_DTYPE)
+        return np.memmap(path, dtype=SAMPLE_DTYPE, mode='r', shape=(count, self.channels))
+
+    def _times(self):
+        path = os.path.join(self.path, TIMES_FILE)
+        count = os.path.getsize(path) // TIME_DTYPE.itemsize
+        if not count:
+            return np.zeros(0, dtype=TIME_DTYPE)
+        return np.memmap(path, dtype=TIME_DTYPE, mode='r', shape=(count,))
@@ -0,0 +1,142 @@
+"""!
+@brief Latency of each stage, from the arrival of a frame to the request shown on screen.
+
+Every sample carries the monotonic time its bytes arrived. When a
+prediction is made, the pipeline builds a Trace with the time the last
+sample of the window arrived, was decoded, had its features extracted
+and was classified; the GUI adds the time the request was displayed.
+LatencyTracker keeps the recent durations of each stage and reports
+their percentiles, so that a latency budget can be set and checked.
+
+Stages:
+  - parse: bytes read -> frame decoded;
+  - features: frame decoded -> features extracted;
+  - predict: features -> class predicted;
+  - pipeline: bytes read -> class predicted;
+  - display: class predicted -> request shown (GUI only);
+  - end_to_end: bytes read -> request shown (GUI only).
+
+LoopLag measures how late a periodic timer of the interface fires, i.e.
+how long its event loop was kept from handling the screen and the input.
+"""
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+STAGES = ('parse', 'features', 'predict', 'pipeline', 'display', 'end_to_end')
+PERCENTILES = (50, 95, 99)
+
+# Monotonic times (time.monotonic()) of the last sample of a prediction window
+Trace = namedtuple('Trace', ['arrived', 'parsed', 'features', 'predicted'])
+
+
+###################
+# LATENCY_TRACKER #
+###################
+class LatencyTracker:
+    """!
+    @brief Recent durations of each stage and their percentiles.
+    """
+
+    def __init__(self, window=1000):
+        """!
+        @param window durations kept per stage for the percentiles.
+        """
+        self.window = window
+        self.durations = {stage: deque(maxlen=window) for stage in STAGES}
+
+    def record(self, stage, duration):
+        self.durations[stage].append(duration)
+
+    def record_trace(self, trace):
+        """!
+        @brief Record the stages of the pipeline from the times of a Trace.
+        """
+        self.record('parse', trace.parsed - trace.arrived)
+        self.record('features', trace.features - trace.parsed)
+        self.record('predict', trace.predicted - trace.features)
+        self.record('pipeline', trace.predicted - trace.arrived)
+
+    def record_display(self, trace, displayed=None):
+        """!
+        @brief Record the display of the prediction of a Trace (time.monotonic() if displayed is None).
+        """
+        displayed = time.monotonic() if displayed is None else displayed
+        self.record('display', displayed - trace.predicted)
+        self.record('end_to_end', displayed - trace.arrived)
+
+    def percentiles(self, stage, percentiles=PERCENTILES):
+        """!
+        @return {percentile: seconds} of the recent durations of a stage (empty if none).
+        """
+        durations = self.durations[stage]
+        if not durations:
+            return {}
+        values = np.percentile(np.fromiter(list(durations), dtype=float), percentiles)
+        return {percentile: float(value) for percentile, value in zip(percentiles, values)}
+
+    def report(self):
+        """!
+        @brief Count, p50, p95, p99 and max of each stage that has durations, in seconds.
+        """
+        report = {}
+        for stage in STAGES:
+            durations = list(self.durations[stage])
+            if not durations:
+                continue
+            stats = {'count': len(durations), 'max': float(max(durations))}
+            stats.update(('p{}'.format(percentile), value)
+                         for percentile, value in self.percentiles(stage).items())
+            report[stage] = stats
+        return report
+
+    def over_budget(self, budget, stage='end_to_end', percentile=95):
+        """!
+        @brief Whether a percentile of a stage exceeds a budget in seconds (False without durations).
+        """
+        value = self.percentiles(stage, (percentile,)).get(percentile)
+        return value is not None and value > budget
+
+    def summary(self, stage='end_to_end'):
+        """!
+        @brief One-line summary of the percentiles of a stage, in ms (empty without durations).
+        """
+        values = self.percentiles(stage)
+        if not values:
+            return ""
+        return "{} p50 {:.1f} / p95 {:.1f} / p99 {:.1f} ms".format(
+            stage, values[50] * 1000, values[95] * 1000, values[99] * 1000)
+
+
+############
+# LOOP_LAG #
+############
+class LoopLag:
+    """!
+    @brief Lateness of a periodic timer, i.e. the time its event loop was busy with something else.
+    """
+
+    def __init__(self, interval):
+        """!
+        @param interval period of the timer in seconds.
+        """
+        self.interval = interval
+        self.last = None
+        self.max = 0.0
+
+    def beat(self, now=None):
+        """!
+        @brief Called by the timer at every period (now is time.monotonic() if None).
+        """
+        now = time.monotonic() if now is None else now
+        if self.last is not None:
+            self.max = max(self.max, now - self.last - self.interval)
+        self.last = now
+
+    def take_max(self):
+        """!
+        @brief Largest lateness since the previous call, in seconds.
+        """
+        value, self.max = self.max, 0.0
+        return value
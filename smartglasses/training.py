@@ -0,0 +1,574 @@
+"""!
+@brief Headless, cached and resumable hyperparameter search of the classifiers of the notebook.
+
+Replaces the GridSearchCV cells of the training notebook. The feature
+table is built from feature tables (Dataset.xlsx), acquisition folders
+or acquisition stores, and cached under a hash of the content of the
+input files. The rows are split like in the notebook (80/20, stratified,
+seed 250) and every candidate of every classifier is scored by 3-fold
+cross-validation on the training rows (macro F1, like
+GridSearchCV(cv=3)). Each fold fitted is appended to a journal in the
+cache folder as soon as it completes: an interrupted search resumes from
+the folds already done, and a search over unchanged data and grids only
+reads the journal. With the 'halving' search, the candidates of each
+classifier are first scored on a stratified subsample of the training
+rows and only the best 1/3 go on to the next round, with three times
+more rows, up to all the rows.
+
+The best candidate of each classifier is refitted on all the training
+rows (cached as well) and scored on the test rows. All the scores are
+written to a leaderboard (CSV), best first, and the best candidate of a
+classifier can be exported for the GUI (.npz for an MLP, or a pickle).
+
+Usage (from the top of the repository):
+
+    python -m smartglasses.training "MACHINE LEARNING/Dataset.xlsx" --leaderboard leaderboard.csv
+    python -m smartglasses.training acquisitions --search halving --export GUI/mlp_1.npz
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import signal
+import hashlib
+import logging
+import argparse
+import warnings
+import importlib
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from smartglasses.batch import class_codes, labelled_chunks
+from smartglasses.dataset import DATASET_DDOF, build_dataset
+from smartglasses.features import FEATURE_NAMES, features_frame
+
+# Folder of the cached features, fold scores and refitted models
+CACHE_PATH = '.training_cache'
+# Version of the layout of the cache, part of every key
+CACHE_VERSION = 1
+# Cross-validation folds of each candidate (GridSearchCV(cv=3) in the notebook)
+CV_FOLDS = 3
+# Test rows held out and seed of the split, as in the notebook
+TEST_SIZE = 0.2
+SPLIT_SEED = 250
+# sklearn scorer of the folds and of the test rows
+SCORING = 'f1_macro'
+# Successive halving keeps 1 / HALVING_FACTOR of the candidates after each round,
+# which are then given HALVING_FACTOR times more training rows
+HALVING_FACTOR = 3
+# Training rows of each fold in the first round of successive halving, at least
+HALVING_MIN_ROWS = 50
+
+# Classifiers of the notebook: estimator class and parameter grid (the MLP grid is the
+# one of the notebook; a JSON file given with --config replaces the grids it names)
+SEARCH_SPACE = {
+    'MLP': ('sklearn.neural_network.MLPClassifier',
+            {'hidden_layer_sizes': [(10, 5), (100, 20, 5)], 'max_iter': [1000], 'alpha': [0.001, 0.01, 0.1]}),
+    'KNN': ('sklearn.neighbors.KNeighborsClassifier',
+            {'n_neighbors': [3, 5, 7, 9, 15], 'weights': ['uniform', 'distance']}),
+    'DecisionTree': ('sklearn.tree.DecisionTreeClassifier',
+                     {'criterion': ['gini', 'entropy'], 'max_depth': [None, 5, 10, 20]}),
+    'LogisticRegression': ('sklearn.linear_model.LogisticRegression',
+                           {'C': [0.01, 0.1, 1.0, 10.0, 100.0], 'max_iter': [1000]}),
+    'SVC': ('sklearn.svm.SVC', {'C': [0.1, 1.0, 10.0, 100.0], 'kernel': ['linear', 'rbf']}),
+    'RandomForest': ('sklearn.ensemble.RandomForestClassifier',
+                     {'n_estimators': [50, 100, 200], 'max_depth': [None, 10]}),
+}
+
+Candidate = namedtuple('Candidate', ['model', 'estimator', 'params'])
+# score: mean of the folds; rows: training rows of each fold; cached: no fold had to be fitted
+Score = namedtuple('Score', ['candidate', 'rows', 'score', 'std', 'fit_time', 'cached'])
+
+# training rows, labels and folds of the worker processes
+_worker_data = None
+
+
+def file_digest(path, digest=None):
+    """!
+    @brief Add the content of a file to a hash (a new sha256 if digest is None).
+    """
+    digest = digest if digest is not None else hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest
+
+
+def data_digest(inputs, ddof=DATASET_DDOF):
+    """!
+    @brief Hash of the content of the input files and folders and of the feature settings.
+
+    Files are hashed by name and content, folders by the relative path and
+    content of every file under them, so renaming or moving the inputs does
+    not invalidate the cache but changing a single sample does.
+    """
+    digest = hashlib.sha256(json.dumps([CACHE_VERSION, ddof, list(FEATURE_NAMES)]).encode())
+    for path in inputs:
+        if os.path.isdir(path):
+            for folder, folders, names in os.walk(path):
+                folders.sort()
+                for name in sorted(names):
+                    digest.update(os.path.relpath(os.path.join(folder, name), path).encode())
+                    file_digest(os.path.join(folder, name), digest)
+        else:
+            digest.update(os.path.basename(path).encode())
+            file_digest(path, digest)
+    return digest.hexdigest()
+
+
+def read_features(inputs, ddof=DATASET_DDOF, jobs=None):
+    """!
+    @brief Feature rows and class codes of feature tables and of acquisition folders or stores.
+    """
+    rows = []
+    labels = []
+    for path in inputs:
+        if os.path.isdir(path):
+            dataset = build_dataset([path], jobs=jobs, ddof=ddof)
+            rows.append(dataset[list(FEATURE_NAMES)].to_numpy(dtype=float))
+            labels.append(class_codes(dataset['Target']))
+        else:
+            for chunk, targets in labelled_chunks(path):
+                rows.append(chunk)
+                labels.append(targets)
+    if not rows:
+        return np.empty((0, len(FEATURE_NAMES))), np.empty(0, dtype=int)
+    return np.concatenate(rows), np.concatenate(labels).astype(int)
+
+
+def candidates(space):
+    """!
+    @brief Every combination of the parameter grid of each classifier.
+
+    @param space {model: (estimator class path, {parameter: values})}.
+    """
+    result = []
+    for model, (estimator, grid) in space.items():
+        names = sorted(grid)
+        for values in itertools.product(*(grid[name] for name in names)):
+            result.append(Candidate(model, estimator, dict(zip(names, (_parameter(value) for value in values)))))
+    return result
+
+
+def _parameter(value):
+    # the grids read from JSON hold lists where sklearn expects tuples (hidden_layer_sizes)
+    return tuple(value) if isinstance(value, list) else value
+
+
+def make_estimator(candidate):
+    """!
+    @brief Unfitted estimator of a candidate, with a fixed random_state so that the fits can be cached.
+    """
+    module, name = candidate.estimator.rsplit('.', 1)
+    estimator = getattr(importlib.import_module(module), name)(**candidate.params)
+    if 'random_state' in estimator.get_params() and 'random_state' not in candidate.params:
+        estimator.set_params(random_state=SPLIT_SEED)
+    return estimator
+
+
+def subsample(indices, labels, rows):
+    """!
+    @brief Stratified subsample of rows of the indices (all of them if rows is None or too large).
+    """
+    if rows is None or rows >= len(indices):
+        return indices
+    from sklearn.model_selection import train_test_split
+
+    return train_test_split(indices, train_size=rows, stratify=labels[indices], random_state=SPLIT_SEED)[0]
+
+
+def fit_and_score(candidate, train_rows, train_labels, test_rows, test_labels):
+    """!
+    @brief Fit a candidate and score it with SCORING.
+
+    @return (fitted estimator, score, fit time in seconds).
+    """
+    from sklearn.metrics import get_scorer
+    from sklearn.exceptions import ConvergenceWarning
+
+    estimator = make_estimator(candidate)
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        # the notebook grids include MLPs that stop at max_iter
+        warnings.simplefilter('ignore', ConvergenceWarning)
+        # MLPClassifier returns a half-trained model on Ctrl+C: interrupt rather than cache its score
+        warnings.filterwarnings('error', message='Training interrupted by user')
+        try:
+            estimator.fit(train_rows, train_labels)
+        except UserWarning:
+            raise KeyboardInterrupt from None
+    fit_time = time.perf_counter() - start
+    return estimator, float(get_scorer(SCORING)(estimator, test_rows, test_labels)), fit_time
+
+
+def _init_worker(rows, labels, folds):
+    global _worker_data
+    _worker_data = (rows, labels, folds)
+
+
+def _init_pool_worker(rows, labels, folds):
+    # Ctrl+C is handled by the main process, which stops the search
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(rows, labels, folds)
+
+
+def _fit_fold(candidate, fold, rows):
+    features, labels, folds = _worker_data
+    train, validation = folds[fold]
+    train = subsample(train, labels, rows)
+    _, score, fit_time = fit_and_score(candidate, features[train], labels[train],
+                                       features[validation], labels[validation])
+    return score, fit_time
+
+
+##################
+# TRAINING_CACHE #
+##################
+class TrainingCache:
+    """!
+    @brief Cached feature tables, fold scores and refitted models of the searches.
+
+    The folder holds features-<hash>.npz files, models/<key>.pkl files
+    and folds.jsonl, the journal of the folds fitted (one JSON object per
+    line, appended and flushed as soon as a fold completes). A line cut by
+    an interruption is ignored when the journal is read again.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.join(path, 'models'), exist_ok=True)
+        self._journal = os.path.join(path, 'folds.jsonl')
+        self._folds = {}
+        if os.path.exists(self._journal):
+            with open(self._journal) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._folds[entry['key']] = (entry['score'], entry['fit_time'])
+
+    def features(self, digest):
+        """!
+        @brief Cached (rows, labels) of the data with this hash, None if there are none.
+        """
+        path = os.path.join(self.path, 'features-{}.npz'.format(digest))
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data['rows'], data['labels']
+
+    def save_features(self, digest, rows, labels):
+        path = os.path.join(self.path, 'features-{}.npz'.format(digest))
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, rows=rows, labels=labels)
+        os.replace(temporary, path)
+
+    def fold(self, key):
+        """!
+        @brief (score, fit time) of a fold already fitted, None otherwise.
+        """
+        return self._folds.get(key)
+
+    def add_fold(self, key, score, fit_time):
+        self._folds[key] = (score, fit_time)
+        with open(self._journal, 'a') as file:
+            file.write(json.dumps({'key': key, 'score': score, 'fit_time': fit_time}) + '\n')
+
+    def model(self, key):
+        """!
+        @brief Cached (estimator, score) of a refit, None if there is none.
+        """
+        path = os.path.join(self.path, 'models', key + '.pkl')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+    def save_model(self, key, estimator, score):
+        path = os.path.join(self.path, 'models', key + '.pkl')
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump((estimator, score), file)
+        os.replace(path + '.tmp', path)
+
+
+def cache_key(*parts):
+    """!
+    @brief Key of a cached result from the data hash, the candidate and the settings it depends on.
+    """
+    import sklearn
+
+    text = json.dumps([CACHE_VERSION, sklearn.__version__, SCORING, SPLIT_SEED] + list(parts),
+                      sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _candidate_parts(candidate):
+    return [candidate.model, candidate.estimator, candidate.params]
+
+
+############
+# SEARCHER #
+############
+class Searcher:
+    """!
+    @brief Cross-validated scores of candidates on the training rows, fitted only when not cached.
+    """
+
+    def __init__(self, rows, labels, digest, cache, jobs=None):
+        """!
+        @param rows, labels training rows and their class codes.
+        @param digest hash of the data the rows come from (see data_digest).
+        @param jobs worker processes (None = one per CPU, 1 = no pool).
+        """
+        from sklearn.model_selection import StratifiedKFold
+
+        self.rows = rows
+        self.labels = labels
+        self.digest = digest
+        self.cache = cache
+        self.jobs = jobs
+        # like GridSearchCV(cv=3) for a classifier: stratified folds, not shuffled
+        self.folds = list(StratifiedKFold(CV_FOLDS).split(rows, labels))
+        self.fitted = 0
+        self.reused = 0
+
+    def fold_rows(self):
+        """!
+        @brief Training rows of each fold.
+        """
+        return min(len(train) for train, _ in self.folds)
+
+    def score(self, candidates, rows=None):
+        """!
+        @brief Scores of candidates trained on rows rows of each fold (None = all the rows).
+
+        @return list of Score, in the order of candidates.
+        """
+        results = {}
+        tasks = []
+        for index, candidate in enumerate(candidates):
+            for fold in range(len(self.folds)):
+                key = cache_key(self.digest, _candidate_parts(candidate), CV_FOLDS, fold, rows)
+                cached = self.cache.fold(key)
+                if cached is not None:
+                    results[index, fold] = cached
+                    self.reused = self.reused + 1
+                else:
+                    tasks.append((index, fold, key))
+        if tasks:
+            logging.info("Fitting {} folds ({} cached)".format(len(tasks), len(results)))
+            for (index, fold, key), (score, fit_time) in self._run(candidates, tasks, rows):
+                self.cache.add_fold(key, score, fit_time)
+                results[index, fold] = (score, fit_time)
+                self.fitted = self.fitted + 1
+
+        fitted = {index for index, _, _ in tasks}
+        scores = []
+        for index, candidate in enumerate(candidates):
+            folds = [results[index, fold] for fold in range(len(self.folds))]
+            values = [score for score, _ in folds]
+            scores.append(Score(candidate, rows if rows is not None else self.fold_rows(), float(np.mean(values)),
+                                float(np.std(values)), float(sum(fit_time for _, fit_time in folds)),
+                                index not in fitted))
+        return scores
+
+    def _run(self, candidates, tasks, rows):
+        # yields the tasks as they complete, so that each fold is journaled at once
+        if self.jobs == 1 or len(tasks) < 2:
+            _init_worker(self.rows, self.labels, self.folds)
+            for task in tasks:
+                yield task, _fit_fold(candidates[task[0]], task[1], rows)
+            return
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_pool_worker,
+                                 initargs=(self.rows, self.labels, self.folds)) as executor:
+            futures = {executor.submit(_fit_fold, candidates[task[0]], task[1], rows): task for task in tasks}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+
+def grid_search(searcher, candidates):
+    """!
+    @brief Score every candidate on all the training rows.
+    """
+    return searcher.score(candidates)
+
+
+def halving_search(searcher, candidates, factor=HALVING_FACTOR, min_rows=HALVING_MIN_ROWS):
+    """!
+    @brief Successive halving over the candidates of each classifier.
+
+    Every round scores the remaining candidates of a classifier and keeps
+    the best 1/factor of them; the rows grow by factor at each round, so
+    that the last round uses all the training rows of the folds.
+    @return the Score of every round, the last round of each classifier last.
+    """
+    total = searcher.fold_rows()
+    scores = []
+    for model in dict.fromkeys(candidate.model for candidate in candidates):
+        remaining = [candidate for candidate in candidates if candidate.model == model]
+        rounds = int(np.ceil(np.log(len(remaining)) / np.log(factor))) if len(remaining) > 1 else 0
+        for step in range(rounds + 1):
+            rows = int(total / factor ** (rounds - step))
+            if step < rounds and rows < min_rows:
+                # too few rows to tell the candidates apart, wait for a later round
+                continue
+            last = step == rounds
+            round_scores = searcher.score(remaining, None if last else rows)
+            scores.extend(round_scores)
+            if last:
+                break
+            round_scores.sort(key=lambda score: score.score, reverse=True)
+            remaining = [score.candidate for score in round_scores[:max(1, int(np.ceil(len(remaining) / factor)))]]
+    return scores
+
+
+def refit_best(scores, train, test, digest, cache):
+    """!
+    @brief Refit the best candidate of each classifier on all the training rows and score it on the test rows.
+
+    The refits are fitted on a DataFrame, like in the notebook, so that they
+    remember the names of the features (see check_feature_names).
+
+    @param train, test (rows, labels) of the training and test sets.
+    @return {model: (Score, fitted estimator, test score, test accuracy)}, best cross-validation score first.
+    """
+    full = max(score.rows for score in scores)
+    best = {}
+    for score in scores:
+        if score.rows == full and (score.candidate.model not in best or score.score > best[score.candidate.model].score):
+            best[score.candidate.model] = score
+    train_frame, test_frame = features_frame(train[0]), features_frame(test[0])
+    result = {}
+    for model, score in sorted(best.items(), key=lambda item: item[1].score, reverse=True):
+        key = cache_key(digest, _candidate_parts(score.candidate), 'refit', TEST_SIZE)
+        cached = cache.model(key)
+        if cached is None:
+            estimator, test_score, _ = fit_and_score(score.candidate, train_frame, train[1], test_frame, test[1])
+            cache.save_model(key, estimator, test_score)
+        else:
+            estimator, test_score = cached
+        accuracy = float(np.mean(estimator.predict(test_frame) == test[1]))
+        result[model] = (score, estimator, test_score, accuracy)
+    return result
+
+
+def write_leaderboard(path, scores, refits):
+    """!
+    @brief Write every score to a CSV file, the candidates trained on the most rows and the best first.
+    """
+    import csv
+
+    tested = {id(score): (test_score, accuracy) for score, _, test_score, accuracy in refits.values()}
+    ordered = sorted(scores, key=lambda score: (-score.rows, -score.score))
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['rank', 'model', 'params', 'rows', 'cv_' + SCORING, 'cv_std', 'fit_time',
+                         'test_' + SCORING, 'test_accuracy'])
+        for rank, score in enumerate(ordered, 1):
+            test_score, accuracy = tested.get(id(score), ('', ''))
+            writer.writerow([rank, score.candidate.model, json.dumps(score.candidate.params, default=str),
+                             score.rows, round(score.score, 4), round(score.std, 4), round(score.fit_time, 3),
+                             test_score if test_score == '' else round(test_score, 4),
+                             accuracy if accuracy == '' else round(accuracy, 4)])
+
+
+def export(estimator, path):
+    """!
+    @brief Save a fitted estimator for the GUI: .npz for an MLP (smartglasses.mlp), a pickle otherwise.
+    """
+    if path.lower().endswith('.npz'):
+        from smartglasses.mlp import export_model
+
+        export_model(estimator, path)
+    else:
+        with open(path, 'wb') as file:
+            pickle.dump(estimator, file)
+
+
+def load_space(config=None, models=None):
+    """!
+    @brief SEARCH_SPACE with the grids of a JSON file ({model: {parameter: values}}), limited to models.
+    """
+    space = dict(SEARCH_SPACE)
+    if config is not None:
+        with open(config) as file:
+            for model, grid in json.load(file).items():
+                if model not in space:
+                    raise ValueError("Unknown classifier {!r} in {}, expected one of {}".format(
+                        model, config, ', '.join(SEARCH_SPACE)))
+                space[model] = (space[model][0], grid)
+    if models:
+        unknown = [model for model in models if model not in space]
+        if unknown:
+            raise ValueError("Unknown classifiers {}, expected one of {}".format(', '.join(unknown), ', '.join(space)))
+        space = {model: space[model] for model in models}
+    return space
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the hyperparameters of the classifiers, cached and resumable.")
+    parser.add_argument('inputs', nargs='+', help="feature tables (.xlsx/.csv), acquisition folders or stores")
+    parser.add_argument('--search', choices=('grid', 'halving'), default='grid')
+    parser.add_argument('--model', action='append', default=None,
+                        help="search only this classifier (repeatable): {}".format(', '.join(SEARCH_SPACE)))
+    parser.add_argument('--config', default=None, help="JSON file replacing the parameter grids of some classifiers")
+    parser.add_argument('--cache', default=CACHE_PATH, help="folder of the cached features, folds and models")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default one per CPU)")
+    parser.add_argument('--ddof', type=int, default=DATASET_DDOF, help="delta degrees of freedom of the variance")
+    parser.add_argument('--leaderboard', default='leaderboard.csv', help="CSV file of all the scores")
+    parser.add_argument('--export', default=None, metavar='FILE',
+                        help="write the best candidate of --export-model to FILE (.npz or pickle)")
+    parser.add_argument('--export-model', default='MLP', help="classifier exported with --export")
+    args = parser.parse_args(argv)
+
+    from sklearn.model_selection import train_test_split
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    space = load_space(args.config, args.model)
+    cache = TrainingCache(args.cache)
+    digest = data_digest(args.inputs, args.ddof)
+    features = cache.features(digest)
+    if features is None:
+        features = read_features(args.inputs, args.ddof, args.jobs)
+        cache.save_features(digest, *features)
+        logging.info("Extracted the features of {} windows".format(len(features[0])))
+    rows, labels = features
+    train_rows, test_rows, train_labels, test_labels = train_test_split(
+        rows, labels, test_size=TEST_SIZE, stratify=labels, random_state=SPLIT_SEED)
+
+    searcher = Searcher(train_rows, train_labels, digest, cache, args.jobs)
+    search = halving_search if args.search == 'halving' else grid_search
+    try:
+        scores = search(searcher, candidates(space))
+    except KeyboardInterrupt:
+        logging.info("Interrupted: {} folds fitted are cached, run again to resume".format(searcher.fitted))
+        return 1
+    refits = refit_best(scores, (train_rows, train_labels), (test_rows, test_labels), digest, cache)
+    write_leaderboard(args.leaderboard, scores, refits)
+
+    for model, (score, _, test_score, accuracy) in refits.items():
+        logging.info("{:<20} cv {} {:.3f} +- {:.3f}, test {:.3f}, accuracy {:.3f} with {}".format(
+            model, SCORING, score.score, score.std, test_score, accuracy, score.candidate.params))
+    if args.export:
+        if args.export_model not in refits:
+            logging.error("No {} was searched, nothing exported".format(args.export_model))
+            return 1
+        export(refits[args.export_model][1], args.export)
+        logging.info("Exported the best {} to {}".format(args.export_model, args.export))
+    logging.info("{} folds fitted, {} cached; leaderboard written to {} in {:.2f} s".format(
+        searcher.fitted, searcher.reused, args.leaderboard, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
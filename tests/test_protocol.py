@@ -0,0 +1,229 @@
+"""!
+@brief Regression checks of the frame decoders against the format sent by the firmware.
+
+The frames are built here as Custom_ISR_TIMER in Interrupt_Routines.c
+builds them, not with the encoders of smartglasses.protocol, so a change
+on either side that breaks the wire format is caught.
+
+Run from the top of the repository:
+
+    python -m pytest tests
+"""
+import struct
+
+import pytest
+
+from smartglasses import protocol
+from smartglasses.protocol import (
+    AsciiFrameDecoder,
+    AutoFrameDecoder,
+    BinaryFrameDecoder,
+    FRAME_SIZE,
+    BATCH_FRAMES,
+    crc16,
+    encode_binary_frame,
+    raw_to_pf
+)
+
+# Lines printed by main.c before the first frame
+BANNER = b'SmartGlasses booting\r\nI2C scan: 0x50\r\n'
+
+
+def firmware_binary_frame(seq, raw_values):
+    """!
+    @brief Binary frame as built by the firmware: sync, sequence, 4 x 24-bit values, CRC of the middle.
+    """
+    frame = bytearray(b'\xA5\x5A') + struct.pack('<H', seq & 0xFFFF)
+    for raw in raw_values:
+        frame += (raw & 0xFFFFFF).to_bytes(3, 'little')
+    crc = 0xFFFF
+    for byte in frame[2:]:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return bytes(frame + struct.pack('<H', crc))
+
+
+def firmware_ascii_frame(values):
+    """!
+    @brief ASCII frame as printed by the firmware: "SOS\\n", 4 x "%.2f\\n", "EOS\\n".
+    """
+    return ('SOS\n' + ''.join('%.2f\n' % value for value in values) + 'EOS\n').encode()
+
+
+def raw_values(seq):
+    # positive and negative measurements, different on every channel and frame
+    return [(seq * 977 + ch * 131071) % 0x1000000 - 0x800000 for ch in range(4)]
+
+
+def binary_stream(seqs):
+    return b''.join(firmware_binary_frame(seq, raw_values(seq)) for seq in seqs)
+
+
+def assert_no_errors(decoder):
+    stats = decoder.stats()
+    assert (stats['resyncs'], stats['discarded_bytes'], stats['dropped'], stats['corrupt']) == (0, 0, 0, 0)
+
+
+def feed_chunks(decoder, data, size):
+    frames = []
+    for start in range(0, len(data), size):
+        frames.extend(decoder.feed(data[start:start + size]))
+    return frames
+
+
+def test_crc16_check_value():
+    # check value of CRC-16/CCITT-FALSE
+    assert crc16(b'123456789') == 0x29B1
+
+
+def test_encoder_matches_firmware():
+    for seq in (0, 1, 0x1234, 0xFFFF):
+        assert encode_binary_frame(seq, raw_values(seq)) == firmware_binary_frame(seq, raw_values(seq))
+    assert protocol.encode_ascii_frame([1.0, 2.345, -0.5, 10.0]) == firmware_ascii_frame([1.0, 2.345, -0.5, 10.0])
+
+
+def test_binary_values():
+    frames = BinaryFrameDecoder().feed(firmware_binary_frame(7, [0, 1 << 19, -(1 << 19), 0x7FFFFF]))
+    assert len(frames) == 1
+    assert frames[0].seq == 7
+    assert frames[0].values == [0.0, 1.0, -1.0, raw_to_pf(0x7FFFFF)]
+
+
+@pytest.mark.parametrize('size', [1, 5, FRAME_SIZE - 1, FRAME_SIZE + 1, 100])
+def test_binary_frames_split_across_chunks(size):
+    data = binary_stream(range(40))
+    decoder = BinaryFrameDecoder()
+    frames = feed_chunks(decoder, data, size)
+    assert [frame.seq for frame in frames] == list(range(40))
+    assert_no_errors(decoder)
+    assert frames == BinaryFrameDecoder().feed(data)
+
+
+def test_binary_one_frame_per_chunk_counts_no_errors():
+    # the CRC of frame 224 ends with 0xA5, the first byte of the sync word
+    assert firmware_binary_frame(224, raw_values(224))[-1] == 0xA5
+    decoder = BinaryFrameDecoder()
+    frames = feed_chunks(decoder, binary_stream(range(200, 260)), FRAME_SIZE)
+    assert [frame.seq for frame in frames] == list(range(200, 260))
+    assert_no_errors(decoder)
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 29, 1000])
+def test_ascii_frames_split_across_chunks(size):
+    values = [[3.25 + seq / 100, 3.1, -0.05, 12.5] for seq in range(20)]
+    data = BANNER + b''.join(firmware_ascii_frame(row) for row in values)
+    decoder = AsciiFrameDecoder()
+    frames = feed_chunks(decoder, data, size)
+    assert [frame.values for frame in frames] == [[round(value, 2) for value in row] for row in values]
+    stats = decoder.stats()
+    # only the lines of the boot banner are discarded
+    assert (stats['resyncs'], stats['discarded_bytes'], stats['dropped'], stats['corrupt']) == (0, len(BANNER), 0, 0)
+
+
+def test_binary_garbage_before_sync():
+    # garbage with a lone first byte of the sync word and a false sync word
+    garbage = BANNER + b'\xA5\x00\xA5\x5A\x01\x02'
+    decoder = BinaryFrameDecoder()
+    frames = feed_chunks(decoder, garbage + binary_stream(range(5)), 7)
+    assert [frame.seq for frame in frames] == list(range(5))
+    stats = decoder.stats()
+    assert stats['frames'] == 5
+    assert stats['discarded_bytes'] > 0
+    assert stats['resyncs'] > 0
+    assert stats['dropped'] == 0
+
+
+def test_binary_corrupted_crc_counted_as_corrupt():
+    damaged = bytearray(firmware_binary_frame(1, raw_values(1)))
+    damaged[6] ^= 0x40
+    data = firmware_binary_frame(0, raw_values(0)) + bytes(damaged) + firmware_binary_frame(2, raw_values(2))
+    decoder = BinaryFrameDecoder()
+    frames = decoder.feed(data)
+    assert [frame.seq for frame in frames] == [0, 2]
+    stats = decoder.stats()
+    assert stats['corrupt'] >= 1
+    # the damaged frame is lost, which the sequence numbers show
+    assert stats['dropped'] == 1
+
+
+def test_binary_sequence_gap_counted_as_dropped():
+    decoder = BinaryFrameDecoder()
+    frames = decoder.feed(binary_stream([10, 11, 15, 16]))
+    assert [frame.seq for frame in frames] == [10, 11, 15, 16]
+    assert decoder.stats()['dropped'] == 3
+    assert decoder.stats()['corrupt'] == 0
+
+
+def test_binary_sequence_wraps_without_drop():
+    decoder = BinaryFrameDecoder()
+    decoder.feed(binary_stream([0xFFFE, 0xFFFF, 0, 1]))
+    assert decoder.stats()['dropped'] == 0
+
+
+def test_ascii_bad_value_counted_as_corrupt():
+    data = firmware_ascii_frame([1, 2, 3, 4]) + b'SOS\n1.00\nnan?\n3.00\n4.00\nEOS\n' + firmware_ascii_frame([5, 6, 7, 8])
+    decoder = AsciiFrameDecoder()
+    frames = feed_chunks(decoder, data, 4)
+    assert [frame.values for frame in frames] == [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert decoder.stats()['corrupt'] == 1
+
+
+def damaged_stream(count):
+    # gaps, a damaged CRC, a truncated frame and garbage among valid frames
+    data = bytearray()
+    for seq in range(count):
+        if seq % 97 == 50:
+            continue
+        frame = bytearray(firmware_binary_frame(seq, raw_values(seq)))
+        if seq % 131 == 70:
+            frame[10] ^= 0x01
+        if seq % 173 == 90:
+            frame = frame[:11]
+        if seq % 199 == 120:
+            data += b'\x00\xA5\x13'
+        data += frame
+    return bytes(data)
+
+
+@pytest.mark.parametrize('data, clean', [(binary_stream(range(1000)), True), (binary_stream(range(65400, 66400)), True),
+                                         (damaged_stream(1000), False)], ids=['clean', 'wrapping', 'damaged'])
+def test_vectorized_run_matches_per_frame(data, clean, monkeypatch):
+    batched = BinaryFrameDecoder()
+    runs = []
+    decode_run = batched._decode_run
+
+    def counted(buffer, start):
+        decoded = decode_run(buffer, start)
+        runs.append(len(decoded))
+        return decoded
+    monkeypatch.setattr(batched, '_decode_run', counted)
+    fast = feed_chunks(batched, data, 40 * FRAME_SIZE)
+    assert max(runs) >= BATCH_FRAMES
+    if clean:
+        # a bug shared by both paths would not show in the comparison below
+        assert len(fast) == 1000
+        assert_no_errors(batched)
+
+    # the same chunks through the per-frame path only
+    monkeypatch.setattr(protocol, 'BATCH_FRAMES', len(data))
+    single = BinaryFrameDecoder()
+    assert feed_chunks(single, data, 40 * FRAME_SIZE) == fast
+    assert single.stats() == batched.stats()
+    # garbage split across chunks counts as more resyncs, the frames are the same
+    bytewise = BinaryFrameDecoder()
+    assert feed_chunks(bytewise, data, 1) == fast
+    if clean:
+        assert_no_errors(bytewise)
+
+
+@pytest.mark.parametrize('data, expected', [
+    (BANNER + firmware_ascii_frame([1, 2, 3, 4]), 'ascii'),
+    (BANNER + binary_stream(range(3)), 'binary'),
+])
+def test_auto_detects_protocol(data, expected):
+    decoder = AutoFrameDecoder()
+    frames = feed_chunks(decoder, data, 5)
+    assert decoder.protocol == expected
+    assert frames